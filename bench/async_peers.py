@@ -0,0 +1,152 @@
+"""
+Many AsyncPeers on one event loop as a load generator.
+
+Starts a server and a relay as separate processes on 127.0.0.1, then runs
+--peers AsyncPeers on a single event loop in this process: registers them
+all, connects them in pairs through the relay and has every initiator send
+--messages datagrams to its partner. Reports registration rate, connect
+latency, delivery and the threads this process needed to do it.
+
+    python -m bench.async_peers --peers 2000 --messages 10
+
+Requests go out at most --window at a time: signaling has no retransmission
+of its own, so an unbounded burst only measures the server's socket buffer.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bench.loopback import percentile
+from src.common.metrics import query_stats
+from src.peer.async_peer import AsyncPeer
+
+
+def wait_for(port: int, relays: int, procs) -> bool:
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            stats = query_stats(("127.0.0.1", port), timeout=0.5)["stats"]
+            if stats["server_relays"][0]["value"] >= relays:
+                return True
+        except (OSError, KeyError, ValueError):
+            pass
+        time.sleep(0.2)
+    for proc in procs:
+        proc.terminate()
+    raise SystemExit("server/relay did not come up")
+
+
+def start_backend(port: int, relay_mux: bool, server_args=()):
+    server = subprocess.Popen([sys.executable, "-m", "src.server.server_main", "--host", "127.0.0.1",
+                               "--port", str(port), "--punch-timeout", "0", "--log-level", "ERROR",
+                               *server_args])
+    # The relay registers once, so the server has to be listening first
+    wait_for(port, 0, [server])
+    relay_cmd = [sys.executable, "-m", "src.peer.peer", "--relay", "--server-host", "127.0.0.1",
+                 "--server-port", str(port), "--capacity", "1000000", "--log-level", "ERROR"]
+    if relay_mux:
+        relay_cmd.append("--mux")
+    relay = subprocess.Popen(relay_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    wait_for(port, 1, [server, relay])
+    return [server, relay]
+
+
+async def bounded(window: int, coros):
+    """Run coroutines at most `window` at a time; returns results or exceptions."""
+    limit = asyncio.Semaphore(window)
+
+    async def run(coro):
+        async with limit:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros), return_exceptions=True)
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def main_async(args) -> dict:
+    received = [0]
+
+    def count(_data):
+        received[0] += 1
+
+    peers = [AsyncPeer("127.0.0.1", args.port, on_message=count) for _ in range(args.peers)]
+    start = time.perf_counter()
+    started = await bounded(args.window, [p.start() for p in peers])
+    register_elapsed = time.perf_counter() - start
+    registered = sum(1 for r in started if not isinstance(r, BaseException))
+
+    pairs = [(a, b) for a, b in zip(peers[::2], peers[1::2])]
+    latencies = await bounded(args.window, [timed(a.connect(b.peer_id, args.timeout)) for a, b in pairs])
+    connected = [pair for pair, r in zip(pairs, latencies) if not isinstance(r, BaseException)]
+    # Acceptors get relay_info together with initiators; wait for the stragglers
+    await bounded(args.window, [b.session_ready(args.timeout) for _, b in connected])
+    await asyncio.sleep(0.3)    # Let the relay learn both sides from the INIT packets
+
+    sent = 0
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        for a, _b in connected:
+            a.send(b"x" * args.size)
+            sent += 1
+        await asyncio.sleep(0)
+    deadline = time.perf_counter() + args.timeout
+    last, last_count = time.perf_counter(), 0
+    while received[0] < sent and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        if received[0] != last_count:
+            last, last_count = time.perf_counter(), received[0]
+        elif time.perf_counter() - last > 1.0:
+            break    # Delivery stalled; the rest was lost
+    deliver_elapsed = max(last - start, 1e-6)
+
+    result = {
+        "peers": args.peers,
+        "threads": threading.active_count(),
+        "open_fds": len(os.listdir("/proc/self/fd")),
+        "registered": registered,
+        "register_per_s": registered / register_elapsed,
+        "connected_pairs": len(connected),
+        "connect_p50_ms": percentile([r for r in latencies if isinstance(r, float)], 50) * 1000,
+        "connect_p99_ms": percentile([r for r in latencies if isinstance(r, float)], 99) * 1000,
+        "messages_sent": sent,
+        "messages_received": received[0],
+        "messages_per_s": received[0] / deliver_elapsed,
+    }
+    for peer in peers:
+        peer.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=10, help="messages per connected pair")
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--window", type=int, default=64, help="registrations/connects in flight")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=54000)
+    parser.add_argument("--relay-mux", action="store_true", help="run the relay in single-port mode")
+    args = parser.parse_args()
+
+    procs = start_backend(args.port, args.relay_mux)
+    try:
+        print(json.dumps(asyncio.run(main_async(args)), indent=2))
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
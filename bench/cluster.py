@@ -0,0 +1,117 @@
+"""
+Signaling throughput of a server cluster as nodes are added.
+
+For each node count, starts that many server processes on loopback as one
+cluster, waits for every node to see the full ring, then has --clients
+client processes pipeline `register` requests for random peer ids, each sent
+straight to its owner node (clients compute the ring the same way servers
+do). Reports completed registrations per second per node count.
+
+    python -m bench.cluster --nodes 1 2 4 --clients 4 --duration 5
+
+Throughput only scales while there are cores for the extra server and client
+processes.
+"""
+import argparse
+import json
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from src.common import wire
+from src.common.metrics import query_stats
+from src.server.cluster import HashRing, parse_node
+
+
+def start_nodes(count: int, base_port: int):
+    nodes = [f"127.0.0.1:{base_port + i}" for i in range(count)]
+    procs = [
+        subprocess.Popen([sys.executable, "-m", "src.server.server_main", "--host", "127.0.0.1",
+                          "--port", str(base_port + i), "--advertise", node,
+                          "--cluster", ",".join(nodes), "--log-level", "ERROR",
+                          # A few clients stand in for many peers: don't meter them per address
+                          "--source-rate", "0"])
+        for i, node in enumerate(nodes)
+    ]
+    return nodes, procs
+
+
+def wait_for_ring(nodes, timeout: float) -> bool:
+    """Wait until every node reports the whole cluster in its ring."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            sizes = [query_stats(parse_node(node), timeout=0.5)["stats"]["server_cluster_nodes"][0]["value"]
+                     for node in nodes]
+            if all(size == len(nodes) for size in sizes):
+                return True
+        except (OSError, KeyError, ValueError):
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def client(nodes, duration: float, window: int, results):
+    """Pipeline registrations to their owners for `duration` seconds."""
+    ring = HashRing(nodes)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.5)
+    in_flight = done = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        while in_flight < window:
+            peer_id = uuid.uuid4().hex[:8]
+            register = {"type": "register", "peer_id": peer_id, "is_relay_capable": False,
+                        "wire_versions": list(wire.SUPPORTED_VERSIONS)}
+            sock.sendto(wire.encode(register), parse_node(ring.owner(peer_id)))
+            in_flight += 1
+        try:
+            sock.recvfrom(65535)
+        except socket.timeout:
+            in_flight = 0  # Assume the window was lost and refill it
+            continue
+        in_flight -= 1
+        done += 1
+    sock.close()
+    results.put(done)
+
+
+def run(count: int, args) -> dict:
+    nodes, procs = start_nodes(count, args.base_port)
+    try:
+        if not wait_for_ring(nodes, 15.0):
+            return {"nodes": count, "error": "cluster did not converge"}
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(nodes, args.duration, args.window, results))
+                   for _ in range(args.clients)]
+        for proc in clients:
+            proc.start()
+        total = sum(results.get() for _ in clients)
+        for proc in clients:
+            proc.join()
+        return {"nodes": count, "register_per_s": total / args.duration}
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--window", type=int, default=32, help="registrations in flight per client")
+    parser.add_argument("--base-port", type=int, default=53000)
+    args = parser.parse_args()
+
+    print(json.dumps([run(count, args) for count in args.nodes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
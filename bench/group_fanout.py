@@ -0,0 +1,146 @@
+"""
+Multi-party traffic as one group session versus a full mesh of pairs.
+
+Starts a server and a relay as separate processes on 127.0.0.1 and connects
+--members AsyncPeers two ways:
+
+  mesh   every pair of members gets its own relayed session, so a member
+         holds members-1 sessions and sends each datagram members-1 times
+  group  one group session (connect_group) that the relay copies each
+         datagram to every other member from
+
+Then every member sends a --size byte datagram each --interval ms for
+--rounds rounds. Reports datagrams each member sent per round, sockets the
+relay opened for the sessions, relay CPU time, and how much arrived and how
+late. Both ways the relay sends the same number of datagrams; the group reads
+members-1 times fewer of them.
+
+    python -m bench.group_fanout --members 8 --rounds 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+from bench.async_peers import bounded, wait_for
+from bench.loopback import percentile
+from src.peer.async_peer import AsyncPeer
+
+# Send time and sender index at the start of each datagram
+HEADER = struct.Struct("!dI")
+
+
+def relay_fds(pid: int) -> int:
+    return len(os.listdir(f"/proc/{pid}/fd"))
+
+
+def relay_cpu(pid: int) -> float:
+    """User plus system CPU seconds the process has used."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def measure(mode: str, relay: subprocess.Popen, args) -> dict:
+    n = args.members
+    latencies = []
+
+    def on_message(data: bytes):
+        latencies.append(time.perf_counter() - HEADER.unpack_from(data)[0])
+
+    setup = time.perf_counter()
+    fds = relay_fds(relay.pid)
+    if mode == "group":
+        peers = [AsyncPeer("127.0.0.1", args.port, on_message=on_message) for _ in range(n)]
+        await bounded(args.window, [p.start() for p in peers])
+        setup = time.perf_counter()
+        await peers[0].connect_group(peers=[p.peer_id for p in peers[1:]], timeout=args.timeout)
+        await asyncio.gather(*(p.session_ready(args.timeout) for p in peers[1:]))
+        senders = [[p] for p in peers]
+    else:
+        links = {(i, j): AsyncPeer("127.0.0.1", args.port, on_message=on_message)
+                 for i in range(n) for j in range(n) if i != j}
+        peers = list(links.values())
+        await bounded(args.window, [p.start() for p in peers])
+        setup = time.perf_counter()
+        await bounded(args.window, [asyncio.gather(links[i, j].connect(links[j, i].peer_id, args.timeout),
+                                                   links[j, i].session_ready(args.timeout))
+                                    for i, j in links if i < j])
+        senders = [[links[i, j] for j in range(n) if j != i] for i in range(n)]
+    setup = time.perf_counter() - setup
+    await asyncio.sleep(0.5)    # Let the relay learn every member's address
+    sockets = relay_fds(relay.pid) - fds
+
+    cpu = relay_cpu(relay.pid)
+    sent = 0
+    for _ in range(args.rounds):
+        for index, links in enumerate(senders):
+            payload = HEADER.pack(time.perf_counter(), index).ljust(args.size, b"\0")
+            for peer in links:
+                peer.send(payload)
+                sent += 1
+        await asyncio.sleep(args.interval / 1000)
+    await asyncio.sleep(0.5)    # Let the last datagrams land
+    cpu = relay_cpu(relay.pid) - cpu
+
+    for peer in peers:
+        peer.close()
+    expected = args.rounds * n * (n - 1)
+    return {
+        "mode": mode,
+        "members": n,
+        "setup_s": setup,
+        "uplink_per_member_round": sent / (args.rounds * n),
+        "relay_sockets": sockets,
+        "relay_cpu_s": cpu,
+        "delivered": len(latencies) / expected,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run(mode: str, args) -> dict:
+    server = subprocess.Popen([sys.executable, "-m", "src.server.server_main", "--host", "127.0.0.1",
+                               "--port", str(args.port), "--punch-timeout", "0", "--source-rate", "0",
+                               "--log-level", "ERROR"])
+    procs = [server]
+    try:
+        wait_for(args.port, 0, procs)
+        # No warm pool, so the sockets counted are the sessions' own
+        cmd = [sys.executable, "-m", "src.peer.peer", "--relay", "--server-host", "127.0.0.1",
+               "--server-port", str(args.port), "--capacity", "1000000", "--pool", "0", "--log-level", "ERROR"]
+        if args.mux:
+            cmd.append("--mux")
+        relay = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        procs.append(relay)
+        wait_for(args.port, 1, procs)
+        return asyncio.run(measure(mode, relay, args))
+    finally:
+        for proc in procs:
+            proc.kill()
+        for proc in procs:
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=("mesh", "group"), default=["mesh", "group"])
+    parser.add_argument("--mux", action="store_true", help="the relay uses a single shared socket")
+    parser.add_argument("--rounds", type=int, default=500, help="datagrams each member sends")
+    parser.add_argument("--interval", type=float, default=20.0, help="ms between rounds")
+    parser.add_argument("--size", type=int, default=200, help="datagram payload bytes")
+    parser.add_argument("--window", type=int, default=64, help="registrations/setups in flight")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=54700)
+    args = parser.parse_args()
+
+    print(json.dumps([run(mode, args) for mode in args.modes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Direct (hole punched) versus relayed connection setup on loopback.
+
+Runs an AsyncServer, a relay and client peer pairs on 127.0.0.1 under two
+scenarios:
+
+  * open:     both peers accept punch traffic, so the direct path comes up
+  * blocked:  the accepting peer drops every punch probe and ack, like a NAT
+              that filters unsolicited traffic or maps each destination to a
+              new port, so the server falls back to the relay after
+              --punch-timeout
+
+For each it reports how many connections went direct or relayed (from the
+server's connections_total counters), setup latency at the initiating peer
+and whether a test message got through.
+
+    python -m bench.holepunch --pairs 10 --punch-timeout 1
+"""
+import argparse
+import json
+import threading
+import time
+
+from bench.loopback import percentile
+from src.peer.peer import Peer
+from src.server.server_main import AsyncServer
+
+
+class PunchPeer(Peer):
+    """Peer that records when its session becomes usable and what it receives."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connect_started = 0.0
+        self.setup_latency = None
+        self.path = None
+        self.ready = threading.Event()
+        self.received = []
+
+    def _handle_commands(self):
+        pass  # No console
+
+    def connect_to_peer(self, target_peer_id: str):
+        self.connect_started = time.perf_counter()
+        super().connect_to_peer(target_peer_id)
+
+    def _mark_ready(self, path: str):
+        if not self.ready.is_set():
+            self.path = path
+            if self.connect_started:
+                self.setup_latency = time.perf_counter() - self.connect_started
+            self.ready.set()
+
+    def _handle_punch_ack(self, message, addr):
+        super()._handle_punch_ack(message, addr)
+        if self.direct_addr:
+            self._mark_ready("direct")
+
+    def _handle_relay_info(self, message):
+        super()._handle_relay_info(message)
+        self._mark_ready("relayed")
+
+    def _handle_relay_data(self, message):
+        if "data" in message:
+            self.received.append(message["data"])
+
+
+class BlockedPeer(PunchPeer):
+    """Peer behind a NAT that lets no punch traffic through."""
+
+    def _process_message(self, message, addr):
+        if message.get("type") in ("punch_probe", "punch_ack"):
+            return
+        super()._process_message(message, addr)
+
+
+def run_scenario(server_addr, pairs: int, acceptor_cls, timeout: float) -> dict:
+    initiators = [PunchPeer(*server_addr) for _ in range(pairs)]
+    acceptors = [acceptor_cls(*server_addr) for _ in range(pairs)]
+    for peer in initiators + acceptors:
+        peer.start()
+    time.sleep(0.5)  # Let registrations land
+
+    for a, b in zip(initiators, acceptors):
+        a.connect_to_peer(b.peer_id)
+    deadline = time.time() + timeout
+    for peer in initiators + acceptors:
+        peer.ready.wait(max(0.0, deadline - time.time()))
+    time.sleep(0.3)  # Relay INIT packets teach the relay both addresses
+
+    for a, _b in zip(initiators, acceptors):
+        a.send_message("ping")
+    time.sleep(0.5)
+
+    latencies = [a.setup_latency for a in initiators if a.setup_latency is not None]
+    for peer in initiators + acceptors:
+        peer.running = False
+    return {
+        "direct": sum(1 for a in initiators if a.path == "direct"),
+        "relayed": sum(1 for a in initiators if a.path == "relayed"),
+        "setup_p50_ms": percentile(latencies, 50) * 1000,
+        "setup_p99_ms": percentile(latencies, 99) * 1000,
+        "delivered": sum(1 for b in acceptors if b.received),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=10)
+    parser.add_argument("--punch-timeout", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server = AsyncServer("127.0.0.1", 0, punch_timeout=args.punch_timeout)
+    threading.Thread(target=server.start, daemon=True).start()
+    while not server.running:
+        time.sleep(0.01)
+    server_addr = server.sock.getsockname()
+    PunchPeer(*server_addr, is_relay_capable=True).start()
+    time.sleep(0.3)
+
+    results = {}
+    for name, acceptor_cls in (("open", PunchPeer), ("blocked", BlockedPeer)):
+        before = {path: c.value for path, c in server.connection_paths.items()}
+        results[name] = run_scenario(server_addr, args.pairs, acceptor_cls, args.timeout)
+        results[name]["server_counts"] = {path: c.value - before[path]
+                                          for path, c in server.connection_paths.items()}
+    server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cost of logging on the signaling and relay paths.
+
+Runs the loopback benchmark once per logging mode, with records written to
+/dev/null so only the logging machinery itself is measured:
+
+  * off:        no setup_logging(), only warnings reach stderr
+  * info:       normal production logging
+  * debug:      per-message and per-packet records, rate-limited per session
+  * debug-all:  the same with rate limiting effectively disabled
+
+    python -m bench.logging_overhead --packets 5000
+"""
+import argparse
+import json
+import os
+
+from bench import loopback
+from src.common.log import setup_logging, shutdown_logging
+
+# mode -> (level, burst) or None for no logging setup
+MODES = {
+    "off": None,
+    "info": ("INFO", 5),
+    "debug": ("DEBUG", 5),
+    "debug-all": ("DEBUG", 10 ** 9),
+}
+
+REPORTED = ("register_per_s", "connect_p50_ms", "relay_pps", "relay_p50_ms", "relay_loss")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument("--pairs", type=int, default=4)
+    parser.add_argument("--registrations", type=int, default=2000)
+    parser.add_argument("--packets", type=int, default=2000, help="relay packets per pair")
+    parser.add_argument("--size", type=int, default=256)
+    args = parser.parse_args()
+
+    bench_args = argparse.Namespace(
+        relays=1, relay_workers=0, server_workers=0, pairs=args.pairs,
+        registrations=args.registrations, window=32, packets=args.packets,
+        size=args.size, timeout=10.0)
+
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for mode in args.modes:
+            if MODES[mode]:
+                level, burst = MODES[mode]
+                setup_logging(level, stream=devnull, burst=burst)
+            else:
+                shutdown_logging()
+            run = loopback.run(bench_args)["results"]
+            results[mode] = {metric: run.get(metric) for metric in REPORTED}
+        shutdown_logging()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
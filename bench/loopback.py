@@ -0,0 +1,266 @@
+"""
+Loopback benchmark for signaling latency and relay throughput.
+
+Runs an AsyncServer, relay Peer(s) and client Peers on 127.0.0.1 in this
+process and measures:
+
+  * register:  registration throughput and request -> register_response latency
+  * connect:   connect_request -> relay_info latency at the initiating peer
+  * relay:     packets/s, bytes/s and one-way latency through the relay
+
+Results are printed as JSON. With --baseline, each metric is compared with a
+stored result and the run fails if any regressed by more than --tolerance.
+
+    python -m bench.loopback --pairs 20 --output result.json
+    python -m bench.loopback --baseline result.json
+"""
+import argparse
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+
+from src.common import wire
+from src.common.log import setup_logging
+from src.peer.peer import Peer
+from src.server.server_main import AsyncServer
+
+# metric -> True if higher is better
+METRICS = {
+    "register_per_s": True,
+    "register_p50_ms": False,
+    "register_p99_ms": False,
+    "connect_p50_ms": False,
+    "connect_p99_ms": False,
+    "relay_pps": True,
+    "relay_bps": True,
+    "relay_p50_ms": False,
+    "relay_p99_ms": False,
+}
+
+STAMP = struct.Struct("!d")
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class BenchPeer(Peer):
+    """Peer that records when relay_info and relay data arrive instead of printing them."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connect_started = 0.0
+        self.connected = threading.Event()
+        self.connect_latency = None
+        self.received = 0
+        self.received_bytes = 0
+        self.latencies = []
+
+    def _handle_commands(self):
+        pass  # No console
+
+    def connect_to_peer(self, target_peer_id: str):
+        self.connect_started = time.perf_counter()
+        super().connect_to_peer(target_peer_id)
+
+    def _handle_relay_info(self, message):
+        super()._handle_relay_info(message)
+        if self.connect_started and not self.connected.is_set():
+            self.connect_latency = time.perf_counter() - self.connect_started
+        self.connected.set()
+
+    def _handle_relay_data(self, message):
+        data = message.get("data")
+        if isinstance(data, bytes) and len(data) >= STAMP.size:
+            self.received += 1
+            self.received_bytes += len(data)
+            self.latencies.append(time.perf_counter() - STAMP.unpack_from(data)[0])
+
+    def send_raw(self, payload: bytes):
+        self._send_to_session({"type": "relay_data", "session_id": self.current_session, "data": payload})
+
+
+def bench_register(server_addr, count: int, window: int) -> dict:
+    """Pipeline `count` register requests from one socket, `window` in flight."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(2.0)
+    latencies, sent_at = [], []
+    sent = done = 0
+    start = time.perf_counter()
+    while done < count:
+        while sent < count and sent - done < window:
+            register = {"type": "register", "peer_id": uuid.uuid4().hex[:8],
+                        "is_relay_capable": False, "wire_versions": list(wire.SUPPORTED_VERSIONS)}
+            sent_at.append(time.perf_counter())
+            sock.sendto(wire.encode(register), server_addr)
+            sent += 1
+        try:
+            sock.recvfrom(65535)
+        except socket.timeout:
+            break  # Lost replies; report what completed
+        # Replies come back in order on loopback
+        latencies.append(time.perf_counter() - sent_at[done])
+        done += 1
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return {
+        "register_per_s": done / elapsed,
+        "register_p50_ms": percentile(latencies, 50) * 1000,
+        "register_p99_ms": percentile(latencies, 99) * 1000,
+        "register_completed": done,
+    }
+
+
+def bench_connect(server_addr, pairs: int, timeout: float):
+    """Connect `pairs` pairs of peers through the relay and time each setup."""
+    peers = []
+    for _ in range(pairs * 2):
+        peer = BenchPeer(*server_addr)
+        peer.start()
+        peers.append(peer)
+    time.sleep(0.5)  # Let registrations land
+
+    initiators, acceptors = peers[0::2], peers[1::2]
+    for a, b in zip(initiators, acceptors):
+        a.connect_to_peer(b.peer_id)
+    deadline = time.time() + timeout
+    for peer in peers:
+        peer.connected.wait(max(0.0, deadline - time.time()))
+
+    latencies = [a.connect_latency for a in initiators if a.connect_latency is not None]
+    result = {
+        "connect_p50_ms": percentile(latencies, 50) * 1000,
+        "connect_p99_ms": percentile(latencies, 99) * 1000,
+        "connect_completed": len(latencies),
+    }
+    ready = [(a, b) for a, b in zip(initiators, acceptors) if a.connected.is_set() and b.connected.is_set()]
+    return result, ready
+
+
+def bench_relay(ready_pairs, packets: int, size: int, drain: float) -> dict:
+    """Send `packets` datagrams per pair from A to B through the relay."""
+    if not ready_pairs:
+        return {}
+    time.sleep(0.3)  # Let the INIT packets teach the relay both addresses
+    padding = b"x" * max(0, size - STAMP.size)
+    start = time.perf_counter()
+    for _ in range(packets):
+        for a, _b in ready_pairs:
+            a.send_raw(STAMP.pack(time.perf_counter()) + padding)
+    sent_elapsed = time.perf_counter() - start
+
+    total = packets * len(ready_pairs)
+    deadline = time.perf_counter() + drain
+    received, last_progress = 0, time.perf_counter()
+    while time.perf_counter() < deadline and received < total:
+        time.sleep(0.01)
+        now_received = sum(b.received for _, b in ready_pairs)
+        if now_received != received:
+            received, last_progress = now_received, time.perf_counter()
+        elif time.perf_counter() - last_progress > 0.5:
+            break  # The rest was lost; don't count the wait as relay time
+    elapsed = max(sent_elapsed, max(1e-6, last_progress - start))
+
+    received = sum(b.received for _, b in ready_pairs)
+    received_bytes = sum(b.received_bytes for _, b in ready_pairs)
+    latencies = [lat for _, b in ready_pairs for lat in b.latencies]
+    return {
+        "relay_pps": received / elapsed,
+        "relay_bps": received_bytes / elapsed,
+        "relay_p50_ms": percentile(latencies, 50) * 1000,
+        "relay_p99_ms": percentile(latencies, 99) * 1000,
+        "relay_loss": 1.0 - received / total,
+    }
+
+
+def run(args) -> dict:
+    # Loopback peers can always reach each other directly; skip punching so
+    # every connection is relayed and the relay is what gets measured
+    server = AsyncServer("127.0.0.1", 0, workers=args.server_workers, punch_timeout=0)
+    threading.Thread(target=server.start, daemon=True).start()
+    while not server.running:
+        time.sleep(0.01)
+    server_addr = server.sock.getsockname()
+
+    relays = []
+    for _ in range(args.relays):
+        relay = BenchPeer(*server_addr, is_relay_capable=True, relay_workers=args.relay_workers,
+                          relay_mux_port=0 if getattr(args, "relay_mux", False) else None,
+                          relay_pool=getattr(args, "relay_pool", None))
+        relay.start()
+        relays.append(relay)
+    time.sleep(0.3)
+
+    results = {}
+    results.update(bench_register(server_addr, args.registrations, args.window))
+    connect, ready = bench_connect(server_addr, args.pairs, args.timeout)
+    results.update(connect)
+    results.update(bench_relay(ready, args.packets, args.size, args.timeout))
+
+    server.stop()
+    return {"config": vars(args), "results": results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every metric that regressed beyond `tolerance`."""
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        new, old = results.get(metric), baseline.get(metric)
+        if new is None or old is None or old != old or new != new or old == 0:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {old:.3f} -> {new:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--relays", type=int, default=1)
+    parser.add_argument("--relay-workers", type=int, default=0)
+    parser.add_argument("--relay-mux", action="store_true", help="single-port relay with channel numbers")
+    parser.add_argument("--relay-pool", type=int, default=None,
+                        help="warm relay allocations, 0 = bind per session (default: Peer.RELAY_POOL)")
+    parser.add_argument("--server-workers", type=int, default=0)
+    parser.add_argument("--pairs", type=int, default=10, help="client peer pairs to connect")
+    parser.add_argument("--registrations", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=32, help="registrations in flight")
+    parser.add_argument("--packets", type=int, default=2000, help="relay packets per pair")
+    parser.add_argument("--size", type=int, default=256, help="relay payload bytes")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--output", help="write the JSON result here")
+    parser.add_argument("--baseline", help="compare against a stored JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression per metric")
+    parser.add_argument("--verbose", action="store_true", help="log server/peer events to stderr")
+    args = parser.parse_args()
+
+    if args.verbose:
+        setup_logging("INFO", stream=sys.stderr)
+    result = run(args)
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(result["results"], baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Session capacity of a single-port (multiplexed) relay.
+
+Builds a RelayEngine on one shared socket, adds --sessions sessions the way
+Peer._handle_mux_relay_setup does, then drives traffic through a sample of
+them from a pair of client sockets. Reports setup rate, descriptors and
+memory held, and forwarding rate and loss for the sample.
+
+    python -m bench.mux_sessions --sessions 200000 --active 1000
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import time
+import uuid
+
+from src.common import wire
+from src.common.bufpool import BufferPool
+from src.peer.relay_engine import RelayEngine, bind_mux_socket
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def drain(sock: socket.socket, expected: int, timeout: float):
+    """Receive until `expected` datagrams arrived or none did for `timeout`; returns (count, last arrival)."""
+    received, last = 0, time.perf_counter()
+    sock.settimeout(timeout)
+    try:
+        while received < expected:
+            sock.recvfrom(65535)
+            received, last = received + 1, time.perf_counter()
+    except socket.timeout:
+        pass
+    return received, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--active", type=int, default=1000, help="sessions that carry traffic")
+    parser.add_argument("--packets", type=int, default=10, help="packets per active session")
+    parser.add_argument("--size", type=int, default=256)
+    args = parser.parse_args()
+
+    fds_before, rss_before = open_fds(), max_rss_mb()
+    engine = RelayEngine("bench", BufferPool(), bind_mux_socket())
+    engine.start()
+    relay_addr = ("127.0.0.1", engine.mux_port)
+
+    start = time.perf_counter()
+    sessions = []
+    for _ in range(args.sessions):
+        session_id = str(uuid.uuid4())
+        session = {"peer_a": {"id": "a", "addr": None}, "peer_b": {"id": "b", "addr": None}}
+        engine.assign_channels(session_id, session)
+        engine.add_session(session_id, session)
+        sessions.append((session_id, session))
+    while len(engine.sessions) < args.sessions:
+        time.sleep(0.01)
+    setup_elapsed = time.perf_counter() - start
+
+    # One socket per side stands in for every peer; the relay binds each
+    # channel to the address it first hears from.
+    side_a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    side_b = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (side_a, side_b):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind(("127.0.0.1", 0))
+
+    active = sessions[:args.active]
+    frames = []
+    for session_id, session in active:
+        init = wire.encode({"type": "relay_data", "session_id": session_id, "action": "init"}, wire.WIRE_BINARY)
+        side_a.sendto(wire.frame_channel(session["peer_a"]["channel"], init), relay_addr)
+        side_b.sendto(wire.frame_channel(session["peer_b"]["channel"], init), relay_addr)
+        data = wire.encode({"type": "relay_data", "session_id": session_id, "data": b"x" * args.size},
+                           wire.WIRE_BINARY)
+        frames.append(wire.frame_channel(session["peer_a"]["channel"], data))
+    drain(side_a, len(active), 1.0)    # b's INITs, forwarded once a's address is known
+
+    total = args.packets * len(frames)
+    start = time.perf_counter()
+    sent = 0
+    for _ in range(args.packets):
+        for frame in frames:
+            side_a.sendto(frame, relay_addr)
+            sent += 1
+            if sent % 256 == 0:
+                time.sleep(0)    # Let the relay thread run
+    received, last = drain(side_b, total, 1.0)
+    elapsed = max(last - start, 1e-6)
+
+    result = {
+        "sessions": len(engine.sessions),
+        "setup_per_s": args.sessions / setup_elapsed,
+        "fds_added": open_fds() - fds_before,
+        "rss_mb_added": max_rss_mb() - rss_before,
+        "active_sessions": len(active),
+        "relay_pps": received / elapsed,
+        "relay_loss": 1.0 - received / total if total else 0.0,
+    }
+    engine.stop()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
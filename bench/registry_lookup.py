@@ -0,0 +1,63 @@
+"""
+Micro-benchmark for Registry lookups on the accept_connection path.
+
+Fills a Registry with N peers (16 of them relays) and N/2 pending connections,
+then times get_peer_id_by_addr, get_pending_connection and get_available_relays
+with random keys. Per-lookup cost should stay flat as N grows.
+
+    python -m bench.registry_lookup --sizes 1000,10000,100000,1000000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+from src.server.registry import Registry
+
+
+def _fill(n: int) -> Registry:
+    registry = Registry()
+    for i in range(n):
+        addr = (f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}", 40000 + i % 20000)
+        registry.register_peer(f"p{i}", addr, is_relay=(i < 16))
+    for i in range(0, n, 2):
+        registry.create_pending_connection(str(uuid.UUID(int=i)), f"p{i}", f"p{i + 1}")
+    return registry
+
+
+def _time_ns(fn, keys) -> float:
+    start = time.perf_counter_ns()
+    for key in keys:
+        fn(*key)
+    return (time.perf_counter_ns() - start) / len(keys)
+
+
+def run(size: int, lookups: int) -> dict:
+    registry = _fill(size)
+    rnd = random.Random(size)
+    peers = [rnd.randrange(size) for _ in range(lookups)]
+    addr_keys = [(registry.peers[f"p{i}"]["addr"],) for i in peers]
+    pending_keys = [(f"p{i & ~1}", f"p{(i & ~1) + 1}") for i in peers]
+
+    return {
+        "peers": size,
+        "relays": len(registry.relays),
+        "get_peer_id_by_addr_ns": round(_time_ns(registry.get_peer_id_by_addr, addr_keys), 1),
+        "get_pending_connection_ns": round(_time_ns(registry.get_pending_connection, pending_keys), 1),
+        "get_available_relays_ns": round(_time_ns(registry.get_available_relays, [()] * lookups), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(json.dumps(run(size, args.lookups)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Interactive latency through a relay shared with bulk transfers.
+
+Builds a RelayEngine with --bulk sessions and one interactive session, the
+way Peer._handle_relay_setup (or the single-port variant with --mux) does.
+A separate process blasts --size datagrams through every bulk session as
+fast as it can while this one sends a small timestamped ping through the
+interactive session every --interval ms. Reports ping latency and loss
+alongside what the relay forwarded, dropped and rate limited, once per
+--quanta value (0 forwards first come, first served).
+
+    python -m bench.relay_fairness --bulk 8 --quanta 0 16384
+    python -m bench.relay_fairness --bulk 8 --mux --bulk-rate 1000000
+
+--bulk-rate puts a token bucket on each bulk session (bytes/s), as the
+server does for every session with --session-rate.
+"""
+import argparse
+import json
+import multiprocessing
+import select
+import socket
+import struct
+import time
+import uuid
+
+from bench.loopback import percentile
+from src.common import wire
+from src.common.bufpool import BufferPool
+from src.peer.relay_engine import RelayEngine, bind_mux_socket
+
+PING = struct.Struct("!d")
+
+
+def client_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def add_session(engine: RelayEngine, mux: bool, rate_limit=None):
+    """Add a session to the engine; returns a function framing a payload for each side."""
+    session_id = str(uuid.uuid4())
+    session = {"peer_a": {"id": "a", "addr": None}, "peer_b": {"id": "b", "addr": None},
+               "rate_limit": rate_limit}
+    if mux:
+        port = engine.assign_channels(session_id, session)
+        targets = {key: (("127.0.0.1", port), session[key]["channel"]) for key in ("peer_a", "peer_b")}
+    else:
+        targets = {}
+        for key in ("peer_a", "peer_b"):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            session[key]["socket"] = sock
+            targets[key] = (sock.getsockname(), None)
+    engine.add_session(session_id, session)
+
+    def frame(key: str, payload: bytes):
+        addr, channel = targets[key]
+        return (wire.frame_channel(channel, payload) if mux else payload), addr
+
+    return frame
+
+
+def blast(frames, duration: float):
+    """Send the frames round robin as fast as possible for `duration` seconds."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for data, addr in frames:
+            try:
+                sock.sendto(data, addr)
+            except OSError:
+                pass
+
+
+def run(quantum: int, args) -> dict:
+    engine = RelayEngine("bench", BufferPool(), bind_mux_socket() if args.mux else None)
+    engine.QUANTUM = quantum
+    engine.start()
+
+    bulk_rate = {"bps": args.bulk_rate, "burst": args.bulk_rate} if args.bulk_rate else None
+    bulk = [add_session(engine, args.mux, bulk_rate) for _ in range(args.bulk)]
+    ping = add_session(engine, args.mux)
+    while len(engine.sessions) < args.bulk + 1:
+        time.sleep(0.01)
+
+    # Receivers announce themselves first so the relay knows where to forward
+    bulk_sink, ping_a, ping_b = client_socket(), client_socket(), client_socket()
+    for frame in bulk:
+        bulk_sink.sendto(*frame("peer_b", b"init"))
+    ping_b.sendto(*ping("peer_b", b"init"))
+    time.sleep(0.2)
+
+    payload = b"x" * args.size
+    blaster = multiprocessing.Process(target=blast, args=([f("peer_a", payload) for f in bulk], args.duration))
+    blaster.start()
+    time.sleep(0.2)    # Let the bulk sessions build up a backlog
+
+    latencies, sent = [], 0
+    header = len(ping("peer_a", b"")[0])
+    deadline = time.monotonic() + args.duration - 0.4
+    next_ping = time.monotonic()
+    while next_ping < deadline:
+        ping_a.sendto(*ping("peer_a", PING.pack(time.monotonic())))
+        sent += 1
+        next_ping += args.interval / 1000
+        # Receive while waiting for the next ping so arrivals are timed as they happen
+        while True:
+            ready, _, _ = select.select([ping_b], [], [], max(0.0, next_ping - time.monotonic()))
+            if not ready:
+                break
+            data = ping_b.recv(65535)
+            latencies.append(time.monotonic() - PING.unpack_from(data, header)[0])
+    blaster.join()
+    ping_b.settimeout(0.5)
+    try:
+        while len(latencies) < sent:
+            data = ping_b.recv(65535)
+            latencies.append(time.monotonic() - PING.unpack_from(data, header)[0])
+    except socket.timeout:
+        pass
+
+    result = {
+        "quantum": quantum,
+        "mux": args.mux,
+        "bulk_sessions": args.bulk,
+        "ping_p50_ms": percentile(latencies, 50) * 1000,
+        "ping_p99_ms": percentile(latencies, 99) * 1000,
+        "ping_loss": 1.0 - len(latencies) / sent if sent else 0.0,
+        "forwarded_mb_per_s": engine.bytes / args.duration / 1e6,
+        "drops": engine.drops,
+        "limited": engine.limited,
+    }
+    engine.stop()
+    for sock in (bulk_sink, ping_a, ping_b):
+        sock.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bulk", type=int, default=8, help="bulk sessions")
+    parser.add_argument("--quanta", type=int, nargs="+", default=[0, RelayEngine.QUANTUM],
+                        help="RelayEngine.QUANTUM values to compare, 0 = first come, first served")
+    parser.add_argument("--mux", action="store_true", help="relay on a single shared socket")
+    parser.add_argument("--bulk-rate", type=float, default=0, help="bytes/s limit per bulk session, 0 = none")
+    parser.add_argument("--size", type=int, default=1200, help="bulk datagram size")
+    parser.add_argument("--interval", type=float, default=5.0, help="ms between pings")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of bulk traffic per run")
+    args = parser.parse_args()
+
+    print(json.dumps([run(quantum, args) for quantum in args.quanta], indent=2))
+
+
+if __name__ == "__main__":
+    main()
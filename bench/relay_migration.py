@@ -0,0 +1,149 @@
+"""
+Relayed traffic while the relay carrying it goes away.
+
+Starts a server and a relay as separate processes on 127.0.0.1 and connects
+--pairs AsyncPeer pairs through that relay, then brings up a second relay.
+Every peer sends its partner a sequence-numbered datagram each --interval ms.
+Halfway through --duration the first relay is sent SIGTERM, which makes it
+drain: the server moves its sessions to the second relay and it exits once
+both peers of each have switched. With --modes kill it is SIGKILLed instead,
+which is what restarting a relay did before it could drain. Reports the
+longest gap each receiver saw after the signal (and before it, for
+comparison), packets lost and how long the relay took to exit.
+
+    python -m bench.relay_migration --pairs 20 --modes drain kill
+"""
+import argparse
+import asyncio
+import json
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from bench.async_peers import bounded, wait_for
+from bench.loopback import percentile
+from bench.signaling_storm import stat
+from src.common.metrics import query_stats
+from src.peer.async_peer import AsyncPeer
+
+SEQ = struct.Struct("!I")
+
+
+def start_relay(port: int, mux: bool) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "src.peer.peer", "--relay", "--server-host", "127.0.0.1",
+           "--server-port", str(port), "--capacity", "1000000", "--log-level", "ERROR"]
+    if mux:
+        cmd.append("--mux")
+    return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+
+class Receiver:
+    """Arrival times of one peer's incoming sequence numbers."""
+
+    def __init__(self):
+        self.arrivals = []
+        self.seqs = set()
+
+    def __call__(self, data: bytes):
+        self.arrivals.append(time.monotonic())
+        self.seqs.add(SEQ.unpack_from(data)[0])
+
+    def max_gap(self, start: float, end: float) -> float:
+        """Longest stretch without an arrival between `start` and `end`."""
+        times = [start] + [t for t in self.arrivals if start < t < end] + [end]
+        return max(b - a for a, b in zip(times, times[1:]))
+
+
+async def measure(mode: str, procs, args) -> dict:
+    receivers = [Receiver() for _ in range(args.pairs * 2)]
+    peers = [AsyncPeer("127.0.0.1", args.port, on_message=r) for r in receivers]
+    await bounded(args.window, [p.start() for p in peers])
+    pairs = list(zip(peers[::2], peers[1::2]))
+    await bounded(args.window, [asyncio.gather(a.connect(b.peer_id, args.timeout), b.session_ready(args.timeout))
+                                for a, b in pairs])
+
+    # Sessions are all on the first relay; now give them somewhere to go
+    procs.append(start_relay(args.port, args.mux))
+    wait_for(args.port, 2, procs)
+
+    old_relay = procs[1]
+    signalled = exited = None
+    sent = 0
+    start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        for peer in peers:
+            if peer.current_session is not None:
+                peer.send(SEQ.pack(sent))
+        sent += 1
+        if signalled is None and time.monotonic() - start >= args.duration / 2:
+            old_relay.send_signal(signal.SIGTERM if mode == "drain" else signal.SIGKILL)
+            signalled = time.monotonic()
+        if signalled is not None and exited is None and old_relay.poll() is not None:
+            exited = time.monotonic()
+        await asyncio.sleep(args.interval / 1000)
+    end = time.monotonic()
+    await asyncio.sleep(0.5)    # Let the last packets land
+
+    # Gaps before the signal are what the run shows without a handover
+    before = [r.max_gap(start + 1.0, signalled) for r in receivers]
+    gaps = [r.max_gap(signalled, end) for r in receivers]
+    # Packets sent after the signal that never arrived, per receiver
+    after = int((signalled - start) / (args.interval / 1000))
+    lost = [sum(1 for seq in range(after, sent) if seq not in r.seqs) for r in receivers]
+    for peer in peers:
+        peer.close()
+    return {
+        "mode": mode,
+        "pairs": len(pairs),
+        "recovered": sum(1 for r in receivers if r.arrivals and r.arrivals[-1] > end - 0.5),
+        "gap_before_max_ms": max(before) * 1000,
+        "gap_p50_ms": percentile(gaps, 50) * 1000,
+        "gap_max_ms": max(gaps) * 1000,
+        "loss_after_signal": sum(lost) / max(len(receivers) * (sent - after), 1),
+        "exit_s": (exited - signalled) if exited else None,
+    }
+
+
+def run(mode: str, args) -> dict:
+    server = subprocess.Popen([sys.executable, "-m", "src.server.server_main", "--host", "127.0.0.1",
+                               "--port", str(args.port), "--punch-timeout", "0", "--source-rate", "0",
+                               "--log-level", "ERROR"])
+    procs = [server]
+    wait_for(args.port, 0, procs)
+    procs.append(start_relay(args.port, args.mux))
+    wait_for(args.port, 1, procs)
+    try:
+        result = asyncio.run(measure(mode, procs, args))
+        stats = query_stats(("127.0.0.1", args.port), timeout=5.0)["stats"]
+    finally:
+        for proc in procs:
+            proc.kill()
+        for proc in procs:
+            proc.wait()
+    return {
+        **result,
+        "migrations": {outcome: stat(stats, "server_migrations_total", outcome=outcome)
+                       for outcome in ("switched", "forced", "closed", "stranded")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=("drain", "kill"), default=["drain", "kill"],
+                        help="how the first relay goes away")
+    parser.add_argument("--mux", action="store_true", help="relays use a single shared socket")
+    parser.add_argument("--interval", type=float, default=20.0, help="ms between datagrams from each peer")
+    parser.add_argument("--duration", type=float, default=6.0, help="seconds of traffic per run")
+    parser.add_argument("--window", type=int, default=64, help="registrations/setups in flight")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=54200)
+    args = parser.parse_args()
+
+    print(json.dumps([run(mode, args) for mode in args.modes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Connection setup latency with and without warm relay allocations.
+
+Without a pool the server asks the relay to bind sockets for every session
+(relay_setup -> relay_ready) before it can send relay_info; with one it hands
+out an allocation the relay advertised earlier and sends relay_info straight
+away. For each --pools size this runs an AsyncServer and one relay on
+127.0.0.1, connects --pairs peer pairs and reports connect_request ->
+relay_info latency at the initiator, plus a short burst of traffic to show
+the sessions forward.
+
+Loopback has next to no round trip time, so --relay-rtt delays the relay's
+handling of relay_setup/relay_assign to stand in for a relay that is far
+from the server.
+
+    python -m bench.relay_pool --pools 0 16 --pairs 10 --relay-rtt 20
+"""
+import argparse
+import json
+import threading
+import time
+
+from bench.loopback import BenchPeer, bench_connect, bench_relay
+from src.server.server_main import AsyncServer
+
+
+class DistantRelay(BenchPeer):
+    """Relay whose session messages from the server arrive `delay` seconds late."""
+
+    delay = 0.0
+
+    def _process_message(self, message, addr):
+        if self.delay and message.get("type") in ("relay_setup", "relay_assign"):
+            threading.Timer(self.delay, super()._process_message, args=(message, addr)).start()
+            return
+        super()._process_message(message, addr)
+
+
+def run(pool: int, args) -> dict:
+    server = AsyncServer("127.0.0.1", 0, punch_timeout=0)
+    threading.Thread(target=server.start, daemon=True).start()
+    while not server.running:
+        time.sleep(0.01)
+    server_addr = server.sock.getsockname()
+
+    DistantRelay.delay = args.relay_rtt / 1000
+    relay = DistantRelay(*server_addr, is_relay_capable=True, relay_pool=pool)
+    relay.start()
+    time.sleep(0.3)    # Registration and the first pool advertisement
+
+    connect, ready = bench_connect(server_addr, args.pairs, args.timeout)
+    relayed = bench_relay(ready, args.packets, 64, 2.0)
+    sources = {source: c.value for source, c in server.relay_allocations.items()}
+    relay.running = False
+    server.stop()
+    return {
+        "pool": pool,
+        "connect_p50_ms": connect["connect_p50_ms"],
+        "connect_p99_ms": connect["connect_p99_ms"],
+        "connect_completed": connect["connect_completed"],
+        "allocations": sources,
+        "relay_loss": relayed["relay_loss"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pools", type=int, nargs="+", default=[0, 16])
+    parser.add_argument("--pairs", type=int, default=10)
+    parser.add_argument("--relay-rtt", type=float, default=0.0, help="simulated server <-> relay RTT in ms")
+    parser.add_argument("--packets", type=int, default=100, help="packets per pair after setup")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(json.dumps([run(pool, args) for pool in args.pools], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Simulation of relay selection policies.
+
+Places sessions on R relays through the same Registry/RelayPolicy code the
+server uses. Sessions arrive one at a time and live for a random number of
+arrivals; every relay sends a load report every `report_every` arrivals, so
+policies work from slightly stale data just as they do in production.
+
+Prints, per policy, how many sessions each relay carries at the end and the
+coefficient of variation (0 = perfectly even), then checks each policy orders
+relays the way it should: on a fixed set of candidates, "first" keeps the
+first, "least-loaded" takes the least utilized and "p2c" never takes the most
+utilized; in the simulation, "first" fills one relay before the next while
+"least-loaded" and "p2c" keep every relay within --max-cv. Exits non-zero if a
+check fails.
+
+    python -m bench.relay_selection_sim --relays 8 --sessions 20000
+"""
+import argparse
+import heapq
+import json
+import random
+import statistics
+
+from src.server.registry import Registry
+from src.server.relay_policy import POLICIES, load_ratio
+
+
+def simulate(policy_name: str, relays: int, sessions: int, lifetime: int,
+             report_every: int, capacity: int, seed: int) -> dict:
+    random.seed(seed)
+    registry = Registry()
+    relay_ids = [f"relay{i}" for i in range(relays)]
+    for i, rid in enumerate(relay_ids):
+        registry.register_peer(rid, ("127.0.0.1", 60000 + i), is_relay=True)
+
+    policy = POLICIES[policy_name]()
+    carried = {rid: 0 for rid in relay_ids}
+    expiries = []    # (expires_at, relay)
+    rejected = 0
+
+    def report():
+        for rid in relay_ids:
+            registry.update_relay_load(rid, {"sessions": carried[rid], "capacity": capacity})
+
+    report()
+    for n in range(sessions):
+        while expiries and expiries[0][0] <= n:
+            _, rid = heapq.heappop(expiries)
+            carried[rid] -= 1
+        if n % report_every == 0:
+            report()
+
+        candidates = [c for c in registry.get_relay_candidates() if load_ratio(c) < 1.0]
+        relay = policy.choose(candidates, "a", "b")
+        if relay is None:
+            rejected += 1
+            continue
+        registry.create_session(f"s{n}", "a", "b", relay)
+        carried[relay] += 1
+        heapq.heappush(expiries, (n + random.randint(lifetime // 2, lifetime * 3 // 2), relay))
+
+    counts = [carried[rid] for rid in relay_ids]
+    mean = statistics.mean(counts)
+    return {
+        "policy": policy_name,
+        "per_relay": counts,
+        "min": min(counts),
+        "max": max(counts),
+        "cv": round(statistics.pstdev(counts) / mean, 3) if mean else 0.0,
+        "rejected": rejected,
+    }
+
+
+def check_choices() -> list:
+    """Failures of each policy picking from busy, mid and idle relays, listed in that order."""
+    candidates = [{"relay": rid, "sessions": sessions, "capacity": 100, "pps": 0.0, "bps": 0.0, "max_pps": 0.0}
+                  for rid, sessions in (("busy", 90), ("mid", 50), ("idle", 10))]
+    failures = []
+    for name, want in (("first", {"busy"}), ("least-loaded", {"idle"}), ("p2c", {"mid", "idle"})):
+        policy = POLICIES[name]()
+        picked = {policy.choose(candidates, "a", "b") for _ in range(200)}
+        if not picked <= want:
+            failures.append(f"{name} picked {sorted(picked - want)} out of busy/mid/idle")
+        if policy.choose([], "a", "b") is not None:
+            failures.append(f"{name} picked a relay out of none")
+    return failures
+
+
+def check_spread(result: dict, capacity: int, report_every: int, max_cv: float) -> list:
+    """Failures of a simulation result to spread sessions the way its policy should."""
+    name = result["policy"]
+    if name == "first":
+        # Fills the first relay up to capacity (give or take one stale report) before using the next
+        if result["max"] < capacity - report_every or result["cv"] <= max_cv:
+            return [f"first did not pack relays: {result['per_relay']}"]
+    elif result["cv"] > max_cv:
+        return [f"{name} spread sessions with cv {result['cv']} > {max_cv}: {result['per_relay']}"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--relays", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--lifetime", type=int, default=4000, help="mean session lifetime in arrivals")
+    parser.add_argument("--report-every", type=int, default=50)
+    parser.add_argument("--capacity", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-cv", type=float, default=0.05, help="largest cv a balancing policy may leave")
+    args = parser.parse_args()
+
+    failures = check_choices()
+    for name in sorted(POLICIES):
+        result = simulate(name, args.relays, args.sessions, args.lifetime,
+                          args.report_every, args.capacity, args.seed)
+        print(json.dumps(result))
+        failures += check_spread(result, args.capacity, args.report_every, args.max_cv)
+    if failures:
+        raise SystemExit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
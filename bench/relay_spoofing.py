@@ -0,0 +1,117 @@
+"""
+Datagrams from a third address on a relayed session are dropped.
+
+Builds a RelayEngine with one session per kind -- a pair and a three member
+group, each on per-session sockets and on the single port with --mux -- and
+lets every side's address be learned. A third socket on the same host then
+sends on the first side's socket (or channel): none of it may reach another
+side, and each datagram must count as a drop. The first side sends again
+afterwards to show the session still forwards its own traffic.
+
+Prints one JSON line per kind and exits non-zero if a check fails.
+
+    python -m bench.relay_spoofing --spoofs 100
+"""
+import argparse
+import json
+import socket
+import time
+import uuid
+
+from src.common import wire
+from src.common.bufpool import BufferPool
+from src.peer.relay_engine import RelayEngine, bind_mux_socket
+
+
+def client_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.2)
+    return sock
+
+
+def add_session(engine: RelayEngine, members: int, mux: bool):
+    """Add a pair (members == 2) or group session; returns it and a (data, addr) framer per side."""
+    session_id = str(uuid.uuid4())
+    keys = ["peer_a", "peer_b"] if members == 2 else [f"m{i}" for i in range(members)]
+    sides = {key: {"id": key, "addr": None, "host": "127.0.0.1"} for key in keys}
+    session = dict(sides) if members == 2 else {"group": True, "members": sides}
+    session["rate_limit"] = None
+    if mux:
+        port = engine.assign_channels(session_id, session)
+        targets = {key: (("127.0.0.1", port), side["channel"]) for key, side in sides.items()}
+    else:
+        targets = {}
+        for key, side in sides.items():
+            side["socket"] = sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            targets[key] = (sock.getsockname(), None)
+    engine.add_session(session_id, session)
+
+    def frame(key: str, payload: bytes):
+        addr, channel = targets[key]
+        return (wire.frame_channel(channel, payload) if mux else payload), addr
+
+    return session_id, keys, frame
+
+
+def drain(sock: socket.socket) -> list:
+    got = []
+    while True:
+        try:
+            got.append(sock.recv(65536))
+        except socket.timeout:
+            return got
+
+
+def run(engine: RelayEngine, members: int, mux: bool, spoofs: int) -> dict:
+    session_id, keys, frame = add_session(engine, members, mux)
+    clients = {key: client_socket() for key in keys}
+    time.sleep(0.1)    # Let the loop pick up the session
+
+    for key in keys:
+        clients[key].sendto(*frame(key, b"hello"))
+    time.sleep(0.1)
+    for sock in clients.values():
+        drain(sock)
+    drops = engine.session_stats()[session_id]["drops"]
+
+    spoofer = client_socket()
+    for i in range(spoofs):
+        spoofer.sendto(*frame(keys[0], b"spoof"))
+    leaked = sum(len(drain(clients[key])) for key in keys[1:])
+    dropped = engine.session_stats()[session_id]["drops"] - drops
+
+    clients[keys[0]].sendto(*frame(keys[0], b"genuine"))
+    forwarded = all(len(drain(clients[key])) == 1 for key in keys[1:])
+
+    spoofer.close()
+    for sock in clients.values():
+        sock.close()
+    engine.remove_session(session_id)
+    return {"kind": ("pair" if members == 2 else "group") + ("+mux" if mux else ""),
+            "spoofed": spoofs, "leaked": leaked, "dropped": dropped, "forwarded": forwarded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--spoofs", type=int, default=100, help="datagrams the third socket sends")
+    args = parser.parse_args()
+
+    engine = RelayEngine("bench", BufferPool(), bind_mux_socket())
+    engine.start()
+    failures = []
+    try:
+        for members, mux in ((2, False), (2, True), (3, False), (3, True)):
+            result = run(engine, members, mux, args.spoofs)
+            print(json.dumps(result))
+            if result["leaked"] or result["dropped"] != args.spoofs or not result["forwarded"]:
+                failures.append(f"{result['kind']}: third socket not dropped: {result}")
+    finally:
+        engine.stop()
+    if failures:
+        raise SystemExit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Replay a captured trace against a local server or relay.
+
+Traces come from `server_main --capture PATH` or `peer --relay --capture PATH`
+(see src/common/capture.py). Every source address in the trace gets its own
+socket on 127.0.0.1 and sends what that source sent, at the trace's pace
+scaled by --speed (2 = twice as fast, 0 = as fast as possible).
+
+  --target server  starts a server process (extra flags via --server-args) and
+                   replays signaling. Cluster traffic between nodes is left
+                   out. Latency is measured from each request with a request
+                   id to the first answer carrying it (reply, ack or busy).
+  --target relay   runs a RelayEngine in this process with a session for each
+                   one in the trace (sides told apart by the port, or channel,
+                   they arrived on) and replays the relayed traffic. Latency
+                   is measured from each datagram sent to its copy arriving
+                   at the other side.
+
+    python -m bench.replay busy_hour.trace --speed 1 5 0
+    python -m bench.replay relay.trace --target relay --speed 0
+
+Replies are not fed back into the replay: a session the trace set up only
+completes if the replayed messages still make sense to a fresh server (peers
+register and connect again, but ids the original server handed out, like
+session ids in relay_ready, won't exist). Reports how far the replay fell
+behind its schedule, so a run the replayer itself couldn't keep up with shows.
+"""
+import argparse
+import json
+import resource
+import selectors
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Tuple
+
+from bench.async_peers import wait_for
+from bench.loopback import percentile
+from bench.relay_fairness import add_session
+from src.common import wire
+from src.common.bufpool import BufferPool
+from src.common.capture import TraceRecord, read_trace
+from src.common.metrics import query_stats
+from src.peer.relay_engine import RelayEngine, bind_mux_socket
+
+
+class Sources:
+    """One loopback socket per source address in the trace, and what comes back to them."""
+
+    def __init__(self, records: List[TraceRecord], on_receive):
+        self.sockets: Dict[Tuple[str, int], socket.socket] = {}
+        self.selector = selectors.DefaultSelector()
+        for record in records:
+            if record.addr not in self.sockets:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(("127.0.0.1", 0))
+                sock.setblocking(False)
+                self.selector.register(sock, selectors.EVENT_READ)
+                self.sockets[record.addr] = sock
+        self.on_receive = on_receive
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def _receive(self):
+        while self.running:
+            for key, _ in self.selector.select(0.1):
+                try:
+                    while True:
+                        data = key.fileobj.recv(65535)
+                        self.on_receive(data, time.perf_counter())
+                except (BlockingIOError, OSError):
+                    pass
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for sock in self.sockets.values():
+            sock.close()
+
+
+def raise_fd_limit():
+    """Traces can have thousands of sources, each needing a socket."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def play(schedule: List[Tuple[float, socket.socket, bytes, Tuple[str, int]]], speed: float, on_send) -> dict:
+    """Send every (trace offset, socket, payload, destination) on time; returns pacing figures."""
+    lags = []
+    start = time.perf_counter()
+    for offset, sock, payload, dest in schedule:
+        if speed:
+            due = start + offset / speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            lags.append(max(0.0, time.perf_counter() - due))
+        on_send(payload, time.perf_counter())
+        try:
+            sock.sendto(payload, dest)
+        except OSError:
+            pass
+    elapsed = time.perf_counter() - start
+    return {
+        "sent": len(schedule),
+        "elapsed_s": elapsed,
+        "sent_per_s": len(schedule) / elapsed if elapsed else float("nan"),
+        "lag_p99_ms": percentile(lags, 99) * 1000 if lags else None,
+        "lag_max_ms": max(lags) * 1000 if lags else None,
+    }
+
+
+def replay_server(records: List[TraceRecord], speed: float, args) -> dict:
+    messages = []
+    for record in records:
+        if record.type.startswith("cluster_"):
+            continue
+        try:
+            messages.append((record, wire.decode(record.payload)))
+        except Exception:
+            messages.append((record, {}))
+
+    server = subprocess.Popen([sys.executable, "-m", "src.server.server_main", "--host", "127.0.0.1",
+                               "--port", str(args.port), "--log-level", "ERROR",
+                               *shlex.split(args.server_args)])
+    wait_for(args.port, 0, [server])
+
+    pending: Dict[str, float] = {}
+    latencies = []
+
+    def on_receive(data, now):
+        try:
+            reply = wire.decode(data)
+        except Exception:
+            return
+        sent = pending.pop(reply.get("ack") or reply.get("busy"), None)
+        if sent is not None:
+            latencies.append(now - sent)
+
+    sources = Sources([record for record, _ in messages], on_receive)
+    dest = ("127.0.0.1", args.port)
+    first = records[0].time if records else 0.0
+    schedule = []
+    rids = []
+    for record, message in messages:
+        schedule.append((record.time - first, sources.sockets[record.addr], record.payload, dest))
+        rids.append(message.get("rid"))
+
+    # Requests are stamped as they go out; the payload alone doesn't say which one it was
+    sent_rids = iter(rids)
+
+    def stamp(payload, now):
+        rid = next(sent_rids)
+        if rid is not None and rid not in pending:
+            pending[rid] = now
+
+    try:
+        result = play(schedule, speed, stamp)
+        time.sleep(args.settle)
+        stats = query_stats(dest, timeout=5.0)["stats"]
+    finally:
+        sources.close()
+        server.terminate()
+        server.wait()
+    handled = sum(e.get("value", 0) for e in stats.get("server_messages_total", ()))
+    shed = sum(e.get("value", 0) for e in stats.get("server_shed_messages_total", ()))
+    return {
+        "target": "server",
+        "speed": speed,
+        "sources": len(sources.sockets),
+        **result,
+        "requests": sum(1 for rid in rids if rid is not None),
+        "answered": len(latencies),
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "handled": handled,
+        "shed": shed,
+    }
+
+
+def replay_relay(records: List[TraceRecord], speed: float, args) -> dict:
+    # A side of a session is the port it arrived on, plus the channel on single-port relays;
+    # sides are paired into sessions by the session id in their traffic
+    sides: Dict[Tuple[int, int], str] = {}
+    for record in records:
+        channel = wire.channel_of(record.payload)
+        side = (record.port, channel or 0)
+        if side in sides:
+            continue
+        try:
+            session_id = wire.decode(record.payload).get("session_id")
+        except Exception:
+            session_id = None
+        sides[side] = session_id or f"port:{side}"
+
+    by_session = defaultdict(list)
+    for side, session_id in sides.items():
+        by_session[session_id].append(side)
+    mux = any(channel for _, channel in sides)
+    engine = RelayEngine("replay", BufferPool(), bind_mux_socket() if mux else None)
+    engine.start()
+    framing = {}
+    for session_id, session_sides in by_session.items():
+        # More than two sides (a port reused by a later session) start another session
+        for i in range(0, len(session_sides), 2):
+            frame = add_session(engine, mux)
+            for key, side in zip(("peer_a", "peer_b"), session_sides[i:i + 2]):
+                framing[side] = (frame, key)
+
+    in_flight = defaultdict(deque)
+    latencies = []
+
+    def on_send(payload, now):
+        in_flight[payload].append(now)
+
+    def on_receive(data, now):
+        sent = in_flight.get(data)
+        if sent:
+            latencies.append(now - sent.popleft())
+
+    sources = Sources(records, on_receive)
+    first = records[0].time if records else 0.0
+    schedule = []
+    for record in records:
+        channel = wire.channel_of(record.payload)
+        frame, key = framing[(record.port, channel or 0)]
+        payload = record.payload[4:] if channel is not None else record.payload
+        data, dest = frame(key, payload)
+        schedule.append((record.time - first, sources.sockets[record.addr], data, dest))
+
+    try:
+        result = play(schedule, speed, on_send)
+        time.sleep(args.settle)
+    finally:
+        sources.close()
+        engine.stop()
+    return {
+        "target": "relay",
+        "speed": speed,
+        "sources": len(sources.sockets),
+        "sessions": len(engine.sessions),
+        **result,
+        "delivered": len(latencies),
+        "forwarded_mb_per_s": engine.bytes / result["elapsed_s"] / 1e6 if result["elapsed_s"] else 0.0,
+        "drops": engine.drops,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="trace file written with --capture")
+    parser.add_argument("--target", choices=("server", "relay"), default="server")
+    parser.add_argument("--speed", type=float, nargs="+", default=[1.0],
+                        help="replay speed multipliers to run, 0 = as fast as possible")
+    parser.add_argument("--server-args", default="", help="extra server_main flags, e.g. \"--workers 2\"")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait for answers after the last send")
+    parser.add_argument("--port", type=int, default=54300)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    records = sorted(read_trace(args.trace), key=lambda r: r.time)
+    replay = replay_server if args.target == "server" else replay_relay
+    print(json.dumps([replay(records, speed, args) for speed in args.speed], indent=2))
+
+
+if __name__ == "__main__":
+    main()
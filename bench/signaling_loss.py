@@ -0,0 +1,142 @@
+"""
+Connection setup under signaling packet loss.
+
+For each --loss rate this runs an AsyncServer and a relay on 127.0.0.1, then
+registers --pairs pairs of AsyncPeers and connects them through the relay
+while every signaling datagram (server, relay and peers, acks included) is
+dropped with that probability. Relay data is left alone. Reports how many
+setups completed within --timeout and their latency, plus the resends and
+duplicates it took.
+
+    python -m bench.signaling_loss --loss 0.01 0.05 0.1 0.2 --pairs 50
+
+--retries 0 sends every request once, which is how signaling behaved before
+it was acknowledged. --relay-pool 0 (the default here) sets every session up
+with relay_setup/relay_ready instead of handing out warm allocations.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+
+from bench.async_peers import bounded, timed
+from bench.loopback import percentile
+from src.peer.async_peer import AsyncPeer
+from src.peer.peer import Peer
+from src.server.server_main import AsyncServer
+
+# Signaling datagrams dropped by every sender below
+LOSS = [0.0]
+
+
+def lossy() -> bool:
+    return LOSS[0] > 0 and random.random() < LOSS[0]
+
+
+class LossyServer(AsyncServer):
+    def _send(self, message, addr):
+        if not lossy():
+            super()._send(message, addr)
+
+
+class LossyRelay(Peer):
+    def _handle_commands(self):
+        pass  # No console
+
+    def _send_signal(self, message, addr):
+        if not lossy():
+            super()._send_signal(message, addr)
+
+    def _send_to_server(self, message):
+        if not lossy():
+            super()._send_to_server(message)
+
+
+class LossyPeer(AsyncPeer):
+    def _send_signal(self, message, addr):
+        if not lossy():
+            super()._send_signal(message, addr)
+
+
+def retries(obj, n):
+    if n is not None:
+        obj.requests.retries = n
+
+
+async def setup_pair(a: LossyPeer, b: LossyPeer, timeout: float):
+    # Both ends have to be told where to send before data can flow
+    await asyncio.gather(a.connect(b.peer_id, timeout), b.session_ready(timeout))
+
+
+async def run_loss(loss: float, args) -> dict:
+    server = LossyServer("127.0.0.1", 0, punch_timeout=0)
+    if args.retries is not None:
+        server.retransmitter.retries = args.retries
+    threading.Thread(target=server.start, daemon=True).start()
+    while not server.running:
+        await asyncio.sleep(0.01)
+    server_addr = server.sock.getsockname()
+
+    # The relay comes up before the loss starts: only the setups are measured
+    LOSS[0] = 0.0
+    relay = LossyRelay(*server_addr, is_relay_capable=True, relay_pool=args.relay_pool)
+    retries(relay, args.retries)
+    relay.start()
+    while not server.registry.relays:
+        await asyncio.sleep(0.01)
+
+    LOSS[0] = loss
+    peers = [LossyPeer(*server_addr) for _ in range(args.pairs * 2)]
+    for peer in peers:
+        retries(peer, args.retries)
+    started = await bounded(args.window, [p.start() for p in peers])
+    registered = [p for p, r in zip(peers, started) if not isinstance(r, BaseException)]
+
+    pairs = list(zip(registered[::2], registered[1::2]))
+    latencies = await bounded(args.window, [timed(setup_pair(a, b, args.timeout)) for a, b in pairs])
+    setups = [r for r in latencies if isinstance(r, float)]
+    LOSS[0] = 0.0
+
+    result = {
+        "loss": loss,
+        "registered": len(registered),
+        "register_rate": len(registered) / len(peers),
+        "connected": len(setups),
+        "setup_rate": len(setups) / args.pairs,
+        "setup_p50_ms": percentile(setups, 50) * 1000,
+        "setup_p99_ms": percentile(setups, 99) * 1000,
+        "setup_max_ms": max(setups, default=float("nan")) * 1000,
+        "client_retransmits": sum(p.requests.retransmits for p in peers) + relay.requests.retransmits,
+        "server_retransmits": server.retransmitter.retransmits,
+        "duplicate_requests": server.seen_requests.duplicates,
+    }
+    for peer in peers:
+        peer.close()
+    relay.running = False
+    server.stop()
+    return result
+
+
+async def main_async(args):
+    return [await run_loss(loss, args) for loss in args.loss]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.01, 0.05, 0.1, 0.2],
+                        help="fraction of signaling datagrams dropped")
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--window", type=int, default=64, help="registrations/setups in flight")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds a setup may take")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="override resends per request, 0 = no retransmission")
+    parser.add_argument("--relay-pool", type=int, default=0,
+                        help="warm relay allocations, 0 = relay_setup for every session")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Connection completion latency during a register/connect storm.
+
+Starts a server and a relay as separate processes on 127.0.0.1 and gets
+--pairs AsyncPeer pairs part way through connecting: the initiators have
+sent connect_request and the acceptors hold their incoming_connection. A
+separate process then floods the server with register and connect_request
+from --storm-sources addresses (a reconnect storm, or a few misbehaving
+clients with a small --storm-sources) while the acceptors accept. Reports how
+long those already-started connections took to complete, how many storm
+requests the server handled and how many it shed, once per --ingress-limits
+value (0 runs without admission control: every datagram handled in arrival
+order).
+
+    python -m bench.signaling_storm --pairs 50 --storm-rate 20000 --ingress-limits 0 1024
+
+Admission control orders and sheds what the server has read; it can't help
+once the server can't even read as fast as the storm arrives and the kernel
+drops datagrams first. Pick a --storm-rate above what the server can handle
+but below what it can read (--storm-rate 0 on a single core is the latter).
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+import uuid
+
+from bench.async_peers import bounded, start_backend
+from bench.loopback import percentile
+from src.common import wire
+from src.common.metrics import query_stats
+from src.common.retransmit import new_rid
+from src.peer.async_peer import AsyncPeer
+
+
+class HeldAcceptor(AsyncPeer):
+    """Holds an incoming connection until accept() instead of accepting it at once."""
+
+    held = None
+
+    def _handle_incoming_connection(self, message, addr):
+        self.held = (message, addr)
+
+    def accept(self):
+        super()._handle_incoming_connection(*self.held)
+
+
+def storm(port: int, sources: int, rate: float, go, duration: float, sent_count):
+    """Send registers and connects to peers that don't exist, from `sources` sockets."""
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(sources)]
+    for sock in socks:
+        sock.setblocking(False)
+    server = ("127.0.0.1", port)
+    go.wait()
+    sent, start = 0, time.monotonic()
+    while time.monotonic() - start < duration:
+        # Pace to `rate` datagrams/s overall (0 = as fast as possible)
+        if rate and sent > (time.monotonic() - start) * rate:
+            time.sleep(0.001)
+            continue
+        sock = random.choice(socks)
+        peer_id = uuid.uuid4().hex[:8]
+        if sent % 2:
+            message = {"type": "register", "peer_id": peer_id, "is_relay_capable": False,
+                       "wire_versions": list(wire.SUPPORTED_VERSIONS), "rid": new_rid()}
+        else:
+            message = {"type": "connect_request", "from_peer": peer_id, "to_peer": "nobody", "rid": new_rid()}
+        try:
+            sock.sendto(wire.encode(message, wire.WIRE_JSON), server)
+        except OSError:
+            pass
+        sent += 1
+    sent_count.value = sent
+
+
+def stat(stats: dict, name: str, **labels) -> float:
+    return sum(e.get("value", 0) for e in stats.get(name, ())
+               if all(e["labels"].get(k) == v for k, v in labels.items()))
+
+
+async def measure(args, go) -> dict:
+    initiators = [AsyncPeer("127.0.0.1", args.port) for _ in range(args.pairs)]
+    acceptors = [HeldAcceptor("127.0.0.1", args.port) for _ in range(args.pairs)]
+    await bounded(args.window, [p.start() for p in initiators + acceptors])
+
+    connects = [asyncio.ensure_future(a.connect(b.peer_id, args.timeout)) for a, b in zip(initiators, acceptors)]
+    deadline = time.monotonic() + args.timeout
+    while any(b.held is None for b in acceptors) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    go.set()
+    await asyncio.sleep(args.ramp)    # Let the storm fill the server's queues
+
+    async def complete(a, b, connect):
+        start = time.perf_counter()
+        b.accept()
+        await asyncio.gather(connect, b.session_ready(args.timeout))
+        return time.perf_counter() - start
+
+    held = [(a, b, c) for a, b, c in zip(initiators, acceptors, connects) if b.held is not None]
+    results = await asyncio.gather(*(complete(a, b, c) for a, b, c in held), return_exceptions=True)
+    latencies = [r for r in results if isinstance(r, float)]
+    for peer in initiators + acceptors:
+        peer.close()
+    return {
+        "completed": len(latencies),
+        "complete_p50_ms": percentile(latencies, 50) * 1000,
+        "complete_p99_ms": percentile(latencies, 99) * 1000,
+        "complete_max_ms": max(latencies, default=float("nan")) * 1000,
+    }
+
+
+def run(limit: int, args) -> dict:
+    procs = start_backend(args.port, False, ["--ingress-limit", str(limit)])
+    go, sent = multiprocessing.Event(), multiprocessing.Value("l", 0)
+    stormer = multiprocessing.Process(target=storm, args=(args.port, args.storm_sources, args.storm_rate,
+                                                          go, args.duration, sent))
+    stormer.start()
+    try:
+        result = asyncio.run(measure(args, go))
+        go.set()
+        stormer.join()
+        time.sleep(1.0)    # Let the server work through what is left
+        stats = query_stats(("127.0.0.1", args.port), timeout=5.0)["stats"]
+    finally:
+        stormer.terminate()
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+    return {
+        "ingress_limit": limit,
+        **result,
+        "storm_sent": sent.value,
+        # Less the measured peers' own registers and connects
+        "storm_handled": stat(stats, "server_messages_total", type="register")
+        + stat(stats, "server_messages_total", type="connect_request") - 3 * args.pairs,
+        "shed_rate": stat(stats, "server_shed_messages_total", reason="rate"),
+        "shed_queue": stat(stats, "server_shed_messages_total", reason="queue"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=50, help="connections in progress when the storm hits")
+    parser.add_argument("--storm-sources", type=int, default=500, help="addresses the storm comes from")
+    parser.add_argument("--storm-rate", type=float, default=20000, help="storm datagrams/s, 0 = as fast as possible")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds the storm lasts")
+    parser.add_argument("--ramp", type=float, default=0.5, help="seconds of storm before the acceptors accept")
+    parser.add_argument("--ingress-limits", type=int, nargs="+", default=[0, 1024],
+                        help="server --ingress-limit values to compare, 0 = no admission control")
+    parser.add_argument("--window", type=int, default=64, help="registrations in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=54100)
+    args = parser.parse_args()
+
+    print(json.dumps([run(limit, args) for limit in args.ingress_limits], indent=2))
+
+
+if __name__ == "__main__":
+    main()
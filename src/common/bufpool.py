@@ -0,0 +1,70 @@
+"""
+Allocation-free UDP receive path.
+
+Receivers read with recvfrom_into() into a preallocated buffer taken from a
+BufferPool and hand back a memoryview of the datagram, so the hot path never
+allocates a new bytes object per packet. Each buffer is one byte larger than
+the configured max datagram size: if the kernel fills it completely the
+datagram was longer than allowed, so it is counted as truncated and dropped
+instead of being processed half-read.
+"""
+import socket
+import threading
+from typing import List, Optional, Tuple
+
+MAX_DATAGRAM_LIMIT = 65535
+DEFAULT_MAX_DATAGRAM = 65507    # largest UDP payload over IPv4
+
+
+class BufferPool:
+    """Free list of equally sized bytearrays."""
+
+    def __init__(self, max_datagram: int = DEFAULT_MAX_DATAGRAM, prealloc: int = 0):
+        if not 0 < max_datagram <= MAX_DATAGRAM_LIMIT:
+            raise ValueError(f"max_datagram must be in 1..{MAX_DATAGRAM_LIMIT}, got {max_datagram}")
+        self.max_datagram = max_datagram
+        self.buffer_size = max_datagram + 1
+        self._free: List[bytearray] = [bytearray(self.buffer_size) for _ in range(prealloc)]
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bytearray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buf: bytearray):
+        with self._lock:
+            self._free.append(buf)
+
+
+class Receiver:
+    """
+    Receives datagrams from any socket into one pooled buffer. The returned view
+    is only valid until the next recv() on the same Receiver, so each thread or
+    event loop owns its own Receiver.
+    """
+
+    def __init__(self, pool: BufferPool):
+        self.pool = pool
+        self.buf = pool.acquire()
+        self.view = memoryview(self.buf)
+        self.max_datagram = pool.max_datagram
+        self.received = 0
+        self.truncated = 0
+
+    def recv(self, sock: socket.socket) -> Tuple[Optional[memoryview], Tuple[str, int]]:
+        """
+        Read one datagram. Returns (view, addr), or (None, addr) when the datagram
+        exceeded max_datagram and was dropped. Raises like recvfrom() otherwise.
+        """
+        nbytes, addr = sock.recvfrom_into(self.buf)
+        self.received += 1
+        if nbytes > self.max_datagram:
+            self.truncated += 1
+            return None, addr
+        return self.view[:nbytes], addr
+
+    def close(self):
+        """Return the buffer to the pool; views handed out must no longer be used."""
+        self.pool.release(self.buf)
@@ -0,0 +1,102 @@
+"""
+Append-only binary trace of received datagrams, for replaying real traffic
+against a local server or relay (see bench/replay.py).
+
+A trace starts with MAGIC, followed by one record per datagram:
+
+    | time f64 | source IPv4 4B | source port u16 | local port u16 |
+    | type length u8 | payload length u32 | type | payload |
+
+Times are wall-clock seconds. The local port is the one the datagram arrived
+on: the server's, or a relay session's (the shared port on single-port
+relays, where the channel is in the payload). The type is the message type
+("" if the datagram didn't decode); the payload is the datagram as received.
+
+Writes are buffered: a write flushes the buffer if the last flush was
+FLUSH_INTERVAL seconds ago or more, and close() flushes what is left.
+Appending to an existing trace continues it.
+"""
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+from . import wire
+
+MAGIC = b"P2PTRACE1\n"
+# Fixed part of a record, followed by the type and the payload
+RECORD = struct.Struct("!d4sHHBI")
+# Seconds between flushes of the write buffer
+FLUSH_INTERVAL = 1.0
+
+
+class TraceRecord(NamedTuple):
+    time: float
+    addr: Tuple[str, int]
+    port: int
+    type: str
+    payload: bytes
+
+
+def message_type(data) -> str:
+    """Type of an encoded message (channel framed or not), "" if it doesn't decode."""
+    try:
+        return str(wire.decode(data).get("type", ""))
+    except Exception:
+        return ""
+
+
+class Capture:
+    """Writes received datagrams to a trace file. Thread-safe."""
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, data, addr: Tuple[str, int], port: int, msg_type: Optional[str] = None):
+        """Record one datagram; `msg_type` is decoded from it if not given."""
+        if msg_type is None:
+            msg_type = message_type(data)
+        # Callers pass whatever they peeked or parsed: a malformed datagram must not raise here
+        tag = msg_type.encode(errors="replace")[:255] if isinstance(msg_type, str) else b""
+        header = RECORD.pack(self.clock(), socket.inet_aton(addr[0]), addr[1], port, len(tag), len(data))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(header + tag)
+            self.file.write(data)
+            self.records += 1
+            now = time.monotonic()
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_trace(path: str) -> Iterator[TraceRecord]:
+    """Records of a trace in the order they were written; a truncated last record is skipped."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            stamp, ip, src_port, port, tag_len, size = RECORD.unpack(header)
+            tag = f.read(tag_len)
+            payload = f.read(size)
+            if len(tag) < tag_len or len(payload) < size:
+                return
+            yield TraceRecord(stamp, (socket.inet_ntoa(ip), src_port), port, tag.decode(errors="replace"),
+                              payload)
@@ -0,0 +1,130 @@
+"""
+Logging for the server, peers and relays.
+
+Records go through a bounded queue to a background writer thread, so the
+threads doing the work never block on stdout. Hot paths log at DEBUG with
+%-style arguments (formatting only happens if the record is emitted) and can
+pass `extra={"rate_key": ...}` to cap how many records per key get through,
+e.g. one key per relay session.
+
+Until setup_logging() is called only warnings and errors reach stderr, which
+is what library users and benchmarks get by default.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO, Tuple
+
+ROOT = "dturn"
+QUEUE_SIZE = 10000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+_lock = threading.Lock()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records per `interval` seconds through for each
+    `rate_key`; records without a key always pass. The next record emitted for
+    a key says how many were suppressed in between.
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 1.0, max_keys: int = 10000):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_keys = max_keys
+        # key -> (window start, records in window, suppressed since last emit)
+        self.windows: Dict[object, Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "rate_key", None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        start, count, suppressed = self.windows.get(key, (now, 0, 0))
+        if now - start >= self.interval:
+            start, count = now, 0
+        if count >= self.burst:
+            self.windows[key] = (start, count, suppressed + 1)
+            return False
+
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        self.windows[key] = (start, count + 1, 0)
+        if len(self.windows) > self.max_keys:
+            self._prune(now)
+        return True
+
+    def _prune(self, now: float):
+        expired = [k for k, (start, _, _) in self.windows.items() if now - start >= self.interval]
+        for k in expired:
+            del self.windows[k]
+        if len(self.windows) > self.max_keys:
+            self.windows.clear()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the writer falls behind."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = "INFO", stream: Optional[TextIO] = None,
+                  burst: int = 5, interval: float = 1.0) -> logging.Logger:
+    """
+    Route all project loggers through a queue to a background writer on `stream`
+    (stdout by default). Safe to call again to change level or stream.
+    """
+    global _listener, _handler
+    with _lock:
+        root = logging.getLogger(ROOT)
+        if _listener:
+            _listener.stop()
+            root.removeHandler(_handler)
+
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(logging.Formatter("%(message)s"))
+
+        log_queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+        _handler = DroppingQueueHandler(log_queue)
+        _handler.addFilter(RateLimitFilter(burst, interval))
+        _listener = logging.handlers.QueueListener(log_queue, writer)
+        _listener.start()
+
+        root.addHandler(_handler)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        root.propagate = False
+        return root
+
+
+def configured_level() -> Optional[int]:
+    """Level set by setup_logging(), or None if it was never called."""
+    return logging.getLogger(ROOT).level if _listener else None
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    with _lock:
+        if _listener:
+            _listener.stop()
+            logging.getLogger(ROOT).removeHandler(_handler)
+            _listener = _handler = None
@@ -0,0 +1,256 @@
+"""
+Lightweight runtime metrics: counters, gauges and latency histograms.
+
+Recording is a plain attribute update (plus a bisect for histograms) with no
+locking: under the GIL a rare lost increment between threads is acceptable for
+monitoring, and it keeps the cost low enough to leave on in production.
+Gauges can be backed by a callable, so sizes such as registry tables cost
+nothing until a snapshot is taken.
+
+Snapshots are served over UDP: send {"type": "stats", "format": "json"} or
+"prometheus" to a server or relay and it replies with a "stats_response".
+Series that grow with the load, such as per-session counters, would soon
+outgrow one datagram, so they are only sent when the request sets "detail",
+DETAIL_PAGE series at a time from "offset"; a reply with more to come says
+where the "next" page starts. Pages after the first carry only those series.
+
+    python -m src.common.metrics 127.0.0.1:50000 --format prometheus --detail
+"""
+import bisect
+import json
+import socket
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds in seconds, 10us .. 10s
+LATENCY_BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+    1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Collected series per stats reply; keeps a page well inside one datagram
+DETAIL_PAGE = 200
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict, float]    # (name, labels, value)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value", "fn")
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value: float):
+        self.value = value
+
+    def get(self) -> float:
+        return self.fn() if self.fn else self.value
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)    # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Named, labelled metrics of one process component."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        # (kind, name) -> help text; (name, labels) -> metric
+        self.help: Dict[Tuple[str, str], str] = {}
+        self.metrics: Dict[Tuple[str, Labels], object] = {}
+        # Callables producing short-lived series at snapshot time, e.g. per session
+        self.collectors: List[Callable[[], List[Sample]]] = []
+
+    def add_collector(self, kind: str, name: str, help: str, fn: Callable[[], List[Tuple[Dict, float]]]):
+        """Register series computed on demand: `fn` returns [(labels, value), ...]."""
+        full_name = f"{self.prefix}_{name}"
+        self.help.setdefault((kind, full_name), help)
+        self.collectors.append(lambda: [(full_name, labels, value) for labels, value in fn()])
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get("counter", name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str = "", fn: Optional[Callable[[], float]] = None,
+              **labels) -> Gauge:
+        return self._get("gauge", name, help, labels, lambda: Gauge(fn))
+
+    def histogram(self, name: str, help: str = "", buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                  **labels) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def _get(self, kind: str, name: str, help: str, labels: Dict, factory):
+        key = (f"{self.prefix}_{name}", tuple(sorted((k, str(v)) for k, v in labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            metric = self.metrics.setdefault(key, factory())
+            self.help.setdefault((kind, key[0]), help)
+        return metric
+
+    def collect(self, offset: int = 0, limit: int = DETAIL_PAGE) -> Tuple[List[Sample], Optional[int]]:
+        """A page of the collectors' series, and where the next page starts (None after the last)."""
+        samples = [sample for collect in self.collectors for sample in collect()]
+        end = offset + limit
+        return samples[offset:end], (end if end < len(samples) else None)
+
+    def snapshot(self, detail: List[Sample] = (), totals: bool = True) -> Dict:
+        """The metrics (if `totals`) and collected `detail` series as plain JSON-serialisable data."""
+        out: Dict[str, List[Dict]] = {}
+        for (name, labels), metric in (list(self.metrics.items()) if totals else ()):
+            entry: Dict = {"labels": dict(labels)}
+            if isinstance(metric, Counter):
+                entry["value"] = metric.value
+            elif isinstance(metric, Gauge):
+                entry["value"] = metric.get()
+            else:
+                entry.update(count=metric.count, sum=metric.sum,
+                             p50=metric.quantile(0.5), p99=metric.quantile(0.99))
+            out.setdefault(name, []).append(entry)
+        for name, labels, value in detail:
+            out.setdefault(name, []).append({"labels": labels, "value": value})
+        return out
+
+    def render_prometheus(self, detail: List[Sample] = (), totals: bool = True) -> str:
+        """The metrics (if `totals`) and collected `detail` series in the Prometheus text format."""
+        lines = []
+        kinds = {name: kind for kind, name in self.help}
+        by_name: Dict[str, List] = {}
+        for (name, labels), metric in (list(self.metrics.items()) if totals else ()):
+            by_name.setdefault(name, []).append((labels, metric))
+        for name, labels, value in detail:
+            by_name.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+
+        for name, series in sorted(by_name.items()):
+            kind = kinds[name]
+            lines.append(f"# HELP {name} {self.help[(kind, name)]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, n in zip(metric.bounds + (float("inf"),), metric.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+                else:
+                    if isinstance(metric, Gauge):
+                        value = metric.get()
+                    elif isinstance(metric, Counter):
+                        value = metric.value
+                    else:
+                        value = metric    # collected sample
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def stats_response(self, message: Dict) -> Dict:
+        """Build the reply to a "stats" request."""
+        detail, next_offset = [], None
+        offset = int(message.get("offset", 0))
+        if message.get("detail"):
+            detail, next_offset = self.collect(offset)
+        if message.get("format") == "prometheus":
+            reply = {"type": "stats_response", "format": "prometheus",
+                     "stats": self.render_prometheus(detail, totals=not offset)}
+        else:
+            reply = {"type": "stats_response", "format": "json", "stats": self.snapshot(detail, totals=not offset)}
+        if next_offset is not None:
+            reply["next"] = next_offset
+        return reply
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def merge_prometheus(pages: List[str]) -> str:
+    """
+    Join pages of the text format into one exposition: each family's HELP and
+    TYPE once, and its samples from every page together under them.
+    """
+    families: Dict[str, List[str]] = {}
+    lines: List[str] = []
+    for page in pages:
+        for line in page.splitlines():
+            if line.startswith("# "):
+                lines = families.setdefault(line.split(" ", 3)[2], [])
+                if line in lines[:2]:
+                    continue    # Repeated on a later page
+            lines.append(line)
+    return "".join(line + "\n" for family in families.values() for line in family)
+
+
+def query_stats(addr: Tuple[str, int], fmt: str = "json", timeout: float = 2.0,
+                detail: bool = False, offset: int = 0) -> Dict:
+    """Ask a server or relay for a stats snapshot (with a page of the detail series if `detail`)."""
+    request = {"type": "stats", "format": fmt}
+    if detail:
+        request.update(detail=True, offset=offset)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(json.dumps(request).encode(), addr)
+        data, _ = sock.recvfrom(65535)
+        return json.loads(data.decode())
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Query a server or relay for stats")
+    parser.add_argument("target", help="host:port")
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    parser.add_argument("--detail", action="store_true", help="include per-session series, fetched page by page")
+    args = parser.parse_args()
+
+    host, port = args.target.rsplit(":", 1)
+    reply = query_stats((host, int(port)), args.format, detail=args.detail)
+    pages = [reply["stats"]]
+    while "next" in reply:
+        reply = query_stats((host, int(port)), args.format, detail=True, offset=reply["next"])
+        pages.append(reply["stats"])
+    if args.format == "prometheus":
+        print(merge_prometheus(pages), end="")
+    else:
+        stats = pages[0]
+        for page in pages[1:]:
+            for name, series in page.items():
+                stats.setdefault(name, []).extend(series)
+        print(json.dumps(stats, indent=2, sort_keys=True))
@@ -0,0 +1,26 @@
+"""
+Token bucket rate limiting, shared by the relay data plane (bytes per
+session) and the signaling server's admission control (messages per source).
+"""
+
+
+class TokenBucket:
+    """Budget refilled at `rate` units/s up to `burst` units; callers pass the clock."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, size: float, now: float) -> bool:
+        """Spend `size` units if the bucket holds them; False means over the limit."""
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens < size:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - size
+        return True
@@ -0,0 +1,196 @@
+"""
+Acknowledged delivery for signaling messages over UDP.
+
+Requests that a lost datagram would otherwise stall (register, connect_request,
+accept_connection, relay_setup, relay_ready, relay_info, ...) carry a request id
+in "rid". The receiver acknowledges every copy it gets with a message carrying
+that id in "ack": either its normal reply or a bare {"type": "ack", "ack": rid}.
+
+  * Retransmitter (sender): resends a request with exponential backoff and
+    jitter until it is acknowledged or runs out of retries.
+  * DedupeCache (receiver): remembers the last N request ids and the replies
+    sent for them, so a retransmission is answered again instead of handled
+    again (a repeated connect_request must not create a second session).
+
+A receiver shedding load answers {"type": "busy", "busy": rid, "retry_after": s}
+instead; the sender defers its next resend rather than backing off blindly.
+
+Both are passive, like TimingWheel: the owner does the socket I/O and calls
+Retransmitter.poll() from whatever timer or loop it already runs.
+"""
+import heapq
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds before the first resend; doubles on every resend up to RTO_MAX
+RTO_INITIAL = 0.25
+RTO_MAX = 4.0
+# Resends before giving up on a request (about 20 seconds with the defaults)
+MAX_RETRIES = 8
+# Timeouts are scaled by a random factor in [1 - JITTER, 1 + JITTER] so
+# requests lost together (a burst, a link flap) aren't resent together
+JITTER = 0.25
+# Request ids a DedupeCache remembers
+DEDUPE_SIZE = 65536
+
+Addr = Tuple[str, int]
+
+
+def new_rid() -> str:
+    """A request id unique enough to key dedupe caches shared by every sender."""
+    return uuid.uuid4().hex[:16]
+
+
+def ack_for(rid: str) -> Dict:
+    """Bare acknowledgement for a request that has no reply of its own."""
+    return {"type": "ack", "ack": rid}
+
+
+class Retransmitter:
+    """Outstanding requests, resent until acknowledged."""
+
+    def __init__(self, send: Callable[[Dict, Addr], None],
+                 on_give_up: Optional[Callable[[Dict, Addr], None]] = None,
+                 rto: float = RTO_INITIAL, max_rto: float = RTO_MAX, retries: int = MAX_RETRIES,
+                 jitter: float = JITTER, clock: Callable[[], float] = time.monotonic):
+        self.send_fn = send
+        self.on_give_up = on_give_up
+        self.rto = rto
+        self.max_rto = max_rto
+        self.retries = retries
+        self.jitter = jitter
+        self.clock = clock
+
+        # rid -> [message, addr, resends so far, deadline]
+        self.pending: Dict[str, list] = {}
+        # (deadline, rid) min-heap; entries for acknowledged or rescheduled
+        # requests are left in place and skipped when they surface
+        self.deadlines: List[Tuple[float, str]] = []
+        self.retransmits = 0
+        self.given_up = 0
+        # Guards the tables; wait() sleeps on it and send() wakes it
+        self.cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def send(self, message: Dict, addr: Addr) -> str:
+        """Send a request with a fresh id and keep resending it until ack(); returns the id."""
+        rid = new_rid()
+        message = {**message, "rid": rid}
+        with self.cond:
+            deadline = self.clock() + self._timeout(0)
+            self.pending[rid] = [message, addr, 0, deadline]
+            heapq.heappush(self.deadlines, (deadline, rid))
+            self.cond.notify()
+        self.send_fn(message, addr)
+        return rid
+
+    def ack(self, rid: str) -> Optional[Dict]:
+        """Stop resending `rid`; returns the request if it was still outstanding."""
+        with self.cond:
+            entry = self.pending.pop(rid, None)
+        return entry[0] if entry else None
+
+    def defer(self, rid: str, delay: float) -> bool:
+        """Hold the next resend of `rid` off for about `delay` seconds; the wait isn't counted as a resend."""
+        with self.cond:
+            entry = self.pending.get(rid)
+            if entry is None:
+                return False
+            # Jittered like any timeout, so senders told to wait together don't return together
+            entry[3] = self.clock() + delay * (1 + self.jitter * (2 * random.random() - 1))
+            heapq.heappush(self.deadlines, (entry[3], rid))
+        return True
+
+    def next_due(self) -> Optional[float]:
+        """Seconds until the next resend (0 if overdue), or None if nothing is outstanding."""
+        with self.cond:
+            return self._next_due()
+
+    def wait(self, timeout: float):
+        """Block until a resend may be due, a request is sent or `timeout` passes (threaded owners)."""
+        with self.cond:
+            due = self._next_due()
+            if due is None or due > 0:
+                self.cond.wait(timeout if due is None else min(due, timeout))
+
+    def poll(self) -> int:
+        """Resend every request whose timeout ran out and drop those out of retries; returns resends."""
+        resend, give_up = [], []
+        with self.cond:
+            now = self.clock()
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, rid = heapq.heappop(self.deadlines)
+                entry = self.pending.get(rid)
+                if entry is None or entry[3] != deadline:
+                    continue
+                if entry[2] >= self.retries:
+                    del self.pending[rid]
+                    give_up.append(entry)
+                    continue
+                entry[2] += 1
+                entry[3] = now + self._timeout(entry[2])
+                heapq.heappush(self.deadlines, (entry[3], rid))
+                resend.append(entry)
+            self.retransmits += len(resend)
+            self.given_up += len(give_up)
+
+        for message, addr, _, _ in resend:
+            self.send_fn(message, addr)
+        if self.on_give_up:
+            for message, addr, _, _ in give_up:
+                self.on_give_up(message, addr)
+        return len(resend)
+
+    def _timeout(self, resends: int) -> float:
+        base = min(self.rto * (2 ** resends), self.max_rto)
+        return base * (1 + self.jitter * (2 * random.random() - 1))
+
+    def _next_due(self) -> Optional[float]:
+        while self.deadlines:
+            deadline, rid = self.deadlines[0]
+            entry = self.pending.get(rid)
+            if entry is not None and entry[3] == deadline:
+                return max(0.0, deadline - self.clock())
+            heapq.heappop(self.deadlines)
+        return None
+
+
+class DedupeCache:
+    """
+    Bounded memory of request ids already handled and the replies sent for them.
+    The oldest ids are forgotten first; the cache only has to outlive a
+    sender's retransmissions.
+    """
+
+    def __init__(self, size: int = DEDUPE_SIZE):
+        self.size = size
+        self.replies: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.replies)
+
+    def check(self, rid: str) -> Tuple[List[Dict], bool]:
+        """
+        The reply list for `rid` and whether it was already known (a
+        retransmission). New ids get an empty list to record replies in.
+        """
+        with self.lock:
+            replies = self.replies.get(rid)
+            if replies is not None:
+                self.duplicates += 1
+                return replies, True
+            replies = self.replies[rid] = []
+            if len(self.replies) > self.size:
+                self.replies.popitem(last=False)
+            return replies, False
+
+    def get(self, rid: str) -> Optional[List[Dict]]:
+        return self.replies.get(rid)
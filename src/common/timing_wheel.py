@@ -0,0 +1,108 @@
+"""
+Hierarchical timing wheel for TTL expiry.
+
+Level 0 has `slots` buckets of one tick each, level 1 has `slots` buckets of
+`slots` ticks each, and so on. Scheduling, rescheduling and cancelling a timer
+are O(1); advancing costs O(1) per tick plus the timers that fire or cascade
+down a level. Timers are identified by a hashable key, and scheduling a key
+again replaces its previous deadline (this is how keepalives refresh a TTL).
+"""
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TimingWheel:
+    def __init__(self, tick: float = 0.5, slots: int = 64, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.origin = clock()
+        self.current = 0     # ticks elapsed since origin
+
+        # wheel[level][slot] -> { key: expiry_tick }
+        self.wheel: List[List[Dict[Hashable, int]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        # key -> (level, slot) so a timer can be found without scanning
+        self.where: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.where
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)arm the timer for `key` to fire `delay` seconds from now."""
+        self.cancel(key)
+        now_tick = int((self.clock() - self.origin) / self.tick)
+        expiry = max(now_tick, self.current) + max(1, int(delay / self.tick + 0.999999))
+        self._insert(key, expiry)
+
+    def cancel(self, key: Hashable) -> bool:
+        loc = self.where.pop(key, None)
+        if loc is None:
+            return False
+        level, slot = loc
+        del self.wheel[level][slot][key]
+        return True
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Absolute clock() time at which `key` fires, if scheduled."""
+        loc = self.where.get(key)
+        if loc is None:
+            return None
+        level, slot = loc
+        return self.origin + self.wheel[level][slot][key] * self.tick
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """Move the wheel up to `now` and return the keys whose timers fired."""
+        target = int(((self.clock() if now is None else now) - self.origin) / self.tick)
+        fired: List[Hashable] = []
+        while self.current < target:
+            self.current += 1
+            # Cascade higher levels whose bucket boundary we just crossed
+            span = 1
+            for level in range(1, self.levels):
+                span *= self.slots
+                if self.current % span:
+                    break
+                self._cascade(level, (self.current // span) % self.slots)
+
+            bucket = self.wheel[0][self.current % self.slots]
+            if bucket:
+                self.wheel[0][self.current % self.slots] = {}
+                for key, expiry in bucket.items():
+                    if expiry <= self.current:
+                        del self.where[key]
+                        fired.append(key)
+                    else:
+                        self._insert(key, expiry)
+        return fired
+
+    def _cascade(self, level: int, slot: int):
+        bucket = self.wheel[level][slot]
+        if not bucket:
+            return
+        self.wheel[level][slot] = {}
+        for key, expiry in bucket.items():
+            self._insert(key, expiry)
+
+    def _insert(self, key: Hashable, expiry: int):
+        delta = max(expiry - self.current, 0)
+        slot_tick = self.current + delta
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                break
+            if level == self.levels - 1:
+                # Beyond the top level's range: park in its farthest bucket,
+                # the timer is re-inserted when that bucket cascades
+                slot_tick = self.current + span * (self.slots - 1)
+                break
+            span *= self.slots
+        slot = (slot_tick // span) % self.slots
+        self.wheel[level][slot][key] = expiry
+        self.where[key] = (level, slot)
@@ -0,0 +1,188 @@
+"""
+Wire format shared by the server, peers and relays.
+
+Two encodings are understood on every socket:
+
+  * JSON (version 0): the original `json.dumps(message).encode()` dict.
+  * Binary (version 1): a fixed 20-byte header followed by the payload.
+
+        0      1        2       3       4                  20
+        +------+--------+-------+-------+------------------+----------
+        | 0xD7 | version| type  | flags | session id (16B) | payload
+        +------+--------+-------+-------+------------------+----------
+
+    For data-carrying types (relay_data, stream) the payload is the raw application
+    bytes, so relays and receivers never re-encode it. For signaling types the
+    payload is the compact JSON of the remaining fields (or empty).
+
+decode() tells the two apart by the first byte, so a receiver never needs to
+know which encoding the sender picked. The encoding used towards a peer is
+negotiated during `register` (see negotiate()).
+
+Traffic to and from a multiplexed relay (one UDP port for every session) is
+prefixed with a 4-byte channel header, in the spirit of TURN ChannelData:
+
+        0      1                      4
+        +------+----------------------+----------
+        | 0xD8 | channel number (24b) | message in either encoding
+        +------+----------------------+----------
+
+Each side of a session gets its own channel, so the relay finds the session and
+direction with one lookup and forwards the datagram untouched. decode() skips
+the header.
+"""
+import json
+import re
+import struct
+import uuid
+from enum import IntEnum
+from typing import Dict, Iterable, Optional, Union
+
+WIRE_JSON = 0
+WIRE_BINARY = 1
+SUPPORTED_VERSIONS = (WIRE_BINARY,)
+
+MAGIC = 0xD7
+HEADER = struct.Struct("!BBBB16s")
+NO_SESSION = bytes(16)
+
+FLAG_INIT = 0x01        # relay_data "action": "init" (NAT pinhole opener)
+
+CHANNEL_MAGIC = 0xD8
+CHANNEL_HEADER = struct.Struct("!I")    # magic in the top byte, channel below
+MAX_CHANNEL = 0xFFFFFF
+
+
+class MsgType(IntEnum):
+    REGISTER = 1
+    REGISTER_RESPONSE = 2
+    KEEPALIVE = 3
+    CONNECT_REQUEST = 4
+    INCOMING_CONNECTION = 5
+    ACCEPT_CONNECTION = 6
+    RELAY_SETUP = 7
+    RELAY_READY = 8
+    RELAY_INFO = 9
+    RELAY_DATA = 10
+    ERROR = 11
+    RELAY_LOAD = 12
+    RELAY_TEARDOWN = 13
+    SESSION_CLOSED = 14
+    REDIRECT = 15
+    KEEPALIVE_ACK = 16
+    PUNCH = 17
+    PUNCH_PROBE = 18
+    PUNCH_ACK = 19
+    PUNCH_RESULT = 20
+    STREAM = 21
+    ACK = 22
+
+
+# Message types whose "data" field travels as the raw payload
+RAW_TYPES = {MsgType.RELAY_DATA, MsgType.STREAM}
+
+_TYPE_BY_NAME = {t.name.lower(): t for t in MsgType}
+_NAME_BY_TYPE = {t: t.name.lower() for t in MsgType}
+_COMPACT = (",", ":")
+# "type" of a JSON message, looked for in its first PEEK_BYTES bytes by peek_type()
+_JSON_TYPE = re.compile(rb'"type":\s*"([^"]{0,64})"')
+PEEK_BYTES = 128
+
+
+def negotiate(offered: Iterable[int]) -> int:
+    """Pick the highest wire version both sides support (JSON if none)."""
+    common = set(offered or ()) & set(SUPPORTED_VERSIONS)
+    return max(common) if common else WIRE_JSON
+
+
+def encode(message: Dict, version: int = WIRE_JSON) -> bytes:
+    """Encode a message dict. Falls back to JSON when binary can't represent it."""
+    if version >= WIRE_BINARY:
+        frame = _encode_binary(message)
+        if frame is not None:
+            return frame
+    return json.dumps(message).encode()
+
+
+def frame_channel(channel: int, payload: bytes) -> bytes:
+    """Prefix an encoded message with the channel header of a multiplexed relay."""
+    return CHANNEL_HEADER.pack(CHANNEL_MAGIC << 24 | channel) + payload
+
+
+def channel_of(data: Union[bytes, bytearray, memoryview]) -> Optional[int]:
+    """Channel number of a channel frame, or None if `data` isn't one."""
+    if len(data) < CHANNEL_HEADER.size or data[0] != CHANNEL_MAGIC:
+        return None
+    return CHANNEL_HEADER.unpack_from(data)[0] & MAX_CHANNEL
+
+
+def decode(data: Union[bytes, bytearray, memoryview]) -> Dict:
+    """Decode a datagram in either encoding into a message dict."""
+    if len(data) >= CHANNEL_HEADER.size and data[0] == CHANNEL_MAGIC:
+        data = memoryview(data)[CHANNEL_HEADER.size:]
+    if len(data) >= HEADER.size and data[0] == MAGIC:
+        return _decode_binary(data)
+    return json.loads(bytes(data).decode())
+
+
+def peek_type(data: Union[bytes, bytearray, memoryview]) -> str:
+    """
+    Message type of a datagram without decoding it: the header byte of a binary
+    frame, or a "type" near the start of a JSON one. "" if neither is found.
+    """
+    if len(data) >= CHANNEL_HEADER.size and data[0] == CHANNEL_MAGIC:
+        data = memoryview(data)[CHANNEL_HEADER.size:]
+    if len(data) >= HEADER.size and data[0] == MAGIC:
+        return _NAME_BY_TYPE.get(data[2], "")
+    match = _JSON_TYPE.search(data[:PEEK_BYTES])
+    return match.group(1).decode(errors="replace") if match else ""
+
+
+def _encode_binary(message: Dict):
+    msg_type = _TYPE_BY_NAME.get(message.get("type"))
+    if msg_type is None:
+        return None
+
+    session_id = message.get("session_id")
+    if session_id is None:
+        sid = NO_SESSION
+    else:
+        try:
+            sid = uuid.UUID(session_id).bytes
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    flags = 0
+    fields = {k: v for k, v in message.items() if k not in ("type", "session_id")}
+    if msg_type in RAW_TYPES:
+        if fields.pop("action", None) == "init":
+            flags |= FLAG_INIT
+        data = fields.pop("data", b"")
+        if fields:
+            return None  # Extra fields have nowhere to go in a raw frame
+        payload = data.encode() if isinstance(data, str) else bytes(data)
+    else:
+        payload = json.dumps(fields, separators=_COMPACT).encode() if fields else b""
+
+    return HEADER.pack(MAGIC, WIRE_BINARY, msg_type, flags, sid) + payload
+
+
+def _decode_binary(data) -> Dict:
+    _, version, type_code, flags, sid = HEADER.unpack_from(data)
+    if version != WIRE_BINARY:
+        raise ValueError(f"Unsupported wire version {version}")
+    msg_type = MsgType(type_code)
+    payload = memoryview(data)[HEADER.size:]
+
+    message = {"type": _NAME_BY_TYPE[msg_type]}
+    if sid != NO_SESSION:
+        message["session_id"] = str(uuid.UUID(bytes=sid))
+
+    if msg_type in RAW_TYPES:
+        if flags & FLAG_INIT:
+            message["action"] = "init"
+        else:
+            message["data"] = bytes(payload)
+    elif len(payload):
+        message.update(json.loads(bytes(payload)))
+    return message
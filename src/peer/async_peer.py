@@ -0,0 +1,506 @@
+"""
+Client peer driven by an asyncio event loop, for embedding and load generation.
+
+Peer runs two threads per instance and blocks in its console. AsyncPeer speaks
+the same client side of the protocol (register, keepalive and failover,
+connect, hole punching, relayed or direct data) from callbacks on one event
+loop, so thousands of them can share a loop in a single process. It never
+acts as a relay; run Peer for that.
+
+    peer = AsyncPeer("127.0.0.1", 50000, on_message=lambda data: ...)
+    await peer.start()
+    await peer.connect(other_peer_id)
+    peer.send(b"hello")
+    async for data in peer.messages():
+        ...
+    peer.close()
+
+Like Peer, an AsyncPeer holds one session at a time and accepts incoming
+connections automatically; await session_ready() on the accepting side.
+connect_group() starts or joins a group session instead, where everything
+sent reaches every other member through the relay; peers put in a group by
+someone else get its session too.
+"""
+import asyncio
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from ..common import wire
+from ..common.log import get_logger
+from ..common.retransmit import DedupeCache, Retransmitter, ack_for
+
+log = get_logger("peer")
+
+
+class _PeerProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams from the event loop into an AsyncPeer"""
+
+    def __init__(self, peer: "AsyncPeer"):
+        self.peer = peer
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        self.peer._dispatch(data, addr)
+
+    def error_received(self, exc: Exception):
+        log.debug("[PEER %s] Socket error: %s", self.peer.peer_id, exc)
+
+
+class AsyncPeer:
+    # Seconds between keepalives to the server
+    KEEPALIVE_INTERVAL = 10
+    # Unacknowledged keepalives before moving to another cluster node
+    SERVER_MISSES = 3
+    # Seconds between hole punching probes, and how long to keep probing
+    PUNCH_INTERVAL = 0.1
+    PUNCH_DURATION = 5.0
+    # Seconds to probe a relay a session is moving to before switching to it regardless
+    MIGRATE_DURATION = 5.0
+    # Seconds start() waits for register_response (resent meanwhile if lost)
+    REGISTER_TIMEOUT = 10.0
+    # Datagrams held for messages(); newer ones are dropped while it is full
+    MESSAGE_QUEUE = 1024
+
+    def __init__(self, server_host: str = "15.0.0.3", server_port: int = 50000,
+                 on_message: Optional[Callable[[bytes], None]] = None,
+                 peer_id: Optional[str] = None):
+        self.server_addr = (server_host, server_port)
+        self.peer_id = peer_id or str(uuid.uuid4())[:8]
+        self.on_message = on_message
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.running = False
+        self.tasks: List[asyncio.Task] = []
+
+        self.wire_version = wire.WIRE_JSON
+        self.session_wire = wire.WIRE_JSON
+        self.server_nodes: List[Tuple[str, int]] = []
+        self.redirects = 0
+        self.last_server_ack = time.monotonic()
+
+        # Acknowledged signaling, as in Peer; the timer is armed for the
+        # earliest resend while a request awaits its ack
+        self.requests = Retransmitter(self._send_signal, on_give_up=self._on_request_lost)
+        self.seen_requests = DedupeCache(1024)
+        self._retransmit_timer: Optional[asyncio.TimerHandle] = None
+
+        # Current session, as in Peer
+        self.current_session: Optional[str] = None
+        self.relay_addr: Optional[Tuple[str, int]] = None
+        self.relay_channel: Optional[int] = None
+        self.target_peer: Optional[str] = None
+        self.direct_addr: Optional[Tuple[str, int]] = None
+        self.punch_report = False
+        # (address, channel) of the relay the session is moving to
+        self.pending_relay: Optional[Tuple[Tuple[str, int], Optional[int]]] = None
+        # Everyone in the current session when it is a group (as of our relay_info)
+        self.group_members: List[str] = []
+
+        # Resolved by register_response / once the current session can carry data
+        self._registered: Optional[asyncio.Future] = None
+        self._session: Optional[asyncio.Future] = None
+        # Data for messages(), queued from the start so none is lost; None marks
+        # the end and stays queued, so iterating after close() ends at once. The
+        # waiter is made on the running loop by messages() itself.
+        self._inbox: deque = deque()
+        self._inbox_waiter: Optional[asyncio.Future] = None
+
+        self.handlers = {
+            "register_response": self._handle_register_response,
+            "redirect": self._handle_redirect,
+            "keepalive_ack": self._handle_keepalive_ack,
+            "incoming_connection": self._handle_incoming_connection,
+            "relay_info": self._handle_relay_info,
+            "punch": self._handle_punch,
+            "punch_probe": self._handle_punch_probe,
+            "punch_ack": self._handle_punch_ack,
+            "relay_data": self._handle_relay_data,
+            "session_closed": self._handle_session_closed,
+            "error": self._handle_error,
+            "busy": self._handle_busy,
+        }
+
+    # ============== PUBLIC API ==============
+    async def start(self, local_addr: Tuple[str, int] = ("0.0.0.0", 0)):
+        """Open the socket and register; raises asyncio.TimeoutError if the server doesn't answer."""
+        self.loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(local_addr)
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: _PeerProtocol(self), sock=sock)
+        self.running = True
+        self._registered = self.loop.create_future()
+        self._session = self.loop.create_future()
+        self._register_with_server()
+        await asyncio.wait_for(asyncio.shield(self._registered), self.REGISTER_TIMEOUT)
+        self.tasks.append(self.loop.create_task(self._keepalive_loop()))
+
+    async def connect(self, target_peer_id: str, timeout: Optional[float] = None) -> str:
+        """
+        Ask the server to connect us to another peer. Resolves with the session
+        id once data can flow (relay_info received or direct path up); raises
+        ConnectionError if the server reports an error.
+        """
+        if not self.running:
+            raise ConnectionError("Peer not started")
+        self._reset_session()
+        self.target_peer = target_peer_id
+        self._request({"type": "connect_request", "from_peer": self.peer_id, "to_peer": target_peer_id})
+        log.info("[PEER %s] Requesting connection to %s", self.peer_id, target_peer_id)
+        return await self.session_ready(timeout)
+
+    async def connect_group(self, peers: Optional[List[str]] = None, group: Optional[str] = None,
+                            timeout: Optional[float] = None) -> str:
+        """
+        Start a group session with `peers`, or join the group named `group`
+        (started if nobody is in it). Resolves with the session id once our
+        relay allocation is known; raises ConnectionError as connect() does.
+        """
+        if not self.running:
+            raise ConnectionError("Peer not started")
+        self._reset_session()
+        message = {"type": "connect_request", "from_peer": self.peer_id}
+        if group is not None:
+            message["group"] = group
+        else:
+            message["to_peers"] = list(peers or ())
+        self._request(message)
+        log.info("[PEER %s] Requesting group %s", self.peer_id, group if group is not None else peers)
+        return await self.session_ready(timeout)
+
+    async def session_ready(self, timeout: Optional[float] = None) -> str:
+        """Wait until the current (or next) session can carry data; returns its id."""
+        return await asyncio.wait_for(asyncio.shield(self._session), timeout)
+
+    def send(self, data: Union[bytes, str]):
+        """
+        Send data to the other peer, directly if punching worked, else through the
+        relay. A session on the JSON wire carries text, so bytes must be UTF-8 there.
+        """
+        if not self.direct_addr and not self.relay_addr:
+            raise ConnectionError("Not connected")
+        if self.session_wire == wire.WIRE_JSON and not isinstance(data, str):
+            try:
+                data = bytes(data).decode()
+            except UnicodeDecodeError:
+                raise ValueError("Session uses the JSON wire, which only carries UTF-8 text") from None
+        self._send_to_session({"type": "relay_data", "session_id": self.current_session, "data": data})
+
+    async def messages(self):
+        """Async iterator over data from the other peer, until close()."""
+        while True:
+            while self._inbox:
+                if self._inbox[0] is None:
+                    return
+                yield self._inbox.popleft()
+            self._inbox_waiter = asyncio.get_running_loop().create_future()
+            await self._inbox_waiter
+
+    def close(self):
+        """Stop keepalives and punching, close the socket and fail pending waits."""
+        if not self.running:
+            return
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+        if self._retransmit_timer:
+            self._retransmit_timer.cancel()
+        for future in (self._registered, self._session):
+            if future and not future.done():
+                future.set_exception(ConnectionError("Peer closed"))
+                future.exception()    # Retrieved: nobody may be waiting
+        self._put_inbox(None)
+        if self.transport:
+            self.transport.close()
+
+    # ============== SIGNALING ==============
+    def _register_with_server(self):
+        message = {
+            "type": "register",
+            "peer_id": self.peer_id,
+            "is_relay_capable": False,
+            "wire_versions": list(wire.SUPPORTED_VERSIONS),
+            "redirects": self.redirects
+        }
+        self._request(message)
+        log.debug("[PEER %s] Registering with server...", self.peer_id)
+
+    async def _keepalive_loop(self):
+        # Spread the first keepalive so peers started together don't send in lockstep
+        await asyncio.sleep(random.uniform(0, self.KEEPALIVE_INTERVAL))
+        while self.running:
+            self._check_server()
+            self._send_to_server({"type": "keepalive", "peer_id": self.peer_id})
+            await asyncio.sleep(self.KEEPALIVE_INTERVAL)
+
+    def _check_server(self):
+        """Register with another cluster node if ours stopped acknowledging us."""
+        if not self.server_nodes:
+            return
+        if time.monotonic() - self.last_server_ack < self.KEEPALIVE_INTERVAL * self.SERVER_MISSES:
+            return
+        others = [n for n in self.server_nodes if n != self.server_addr]
+        if not others:
+            return
+        self.server_addr = others[hash(self.peer_id) % len(others)]
+        self.last_server_ack = time.monotonic()
+        log.warning("[PEER %s] Server not responding, trying %s:%s", self.peer_id, *self.server_addr)
+        self.redirects = 0
+        self._register_with_server()
+
+    def _arm_retransmit(self):
+        due = self.requests.next_due()
+        if due is None or not self.running:
+            return
+        when = self.loop.time() + due
+        if self._retransmit_timer:
+            if self._retransmit_timer.when() <= when:
+                return
+            self._retransmit_timer.cancel()
+        self._retransmit_timer = self.loop.call_at(when, self._retransmit_tick)
+
+    def _retransmit_tick(self):
+        self._retransmit_timer = None
+        self.requests.poll()
+        self._arm_retransmit()
+
+    def _on_request_lost(self, message: Dict, addr: Tuple[str, int]):
+        log.warning("[PEER %s] No answer to %s from %s:%s, giving up", self.peer_id, message["type"], *addr)
+        if message["type"] == "register":
+            future = self._registered
+        elif message["type"] in ("connect_request", "accept_connection") and self.current_session is None:
+            future = self._session
+        else:
+            return
+        if not future.done():
+            future.set_exception(ConnectionError("No answer from server"))
+            future.exception()
+
+    def _dispatch(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            if self.pending_relay and addr == self.pending_relay[0]:
+                self._switch_relay(self.pending_relay)    # The relay we are moving to works
+            message = wire.decode(data)
+            if "ack" in message:
+                self.requests.ack(message["ack"])
+            if "rid" in message:
+                # The server resends this until we ack it; handle it only once
+                rid = message["rid"]
+                _, duplicate = self.seen_requests.check(rid)
+                self._send_signal(ack_for(rid), addr)
+                if duplicate:
+                    return
+            if message.get("type") == "ack":
+                return
+            handler = self.handlers.get(message.get("type"))
+            if handler is None:
+                log.warning("[PEER %s] Unknown message type: %s", self.peer_id, message.get("type"))
+                return
+            handler(message, addr)
+        except Exception as e:
+            log.error("[PEER %s] Error handling message: %s", self.peer_id, e)
+
+    def _handle_register_response(self, message: Dict, addr: Tuple[str, int]):
+        if message["status"] != "success":
+            if not self._registered.done():
+                self._registered.set_exception(ConnectionError("Registration failed"))
+            return
+        self.wire_version = message.get("wire_version", wire.WIRE_JSON)
+        self.server_nodes = [tuple(n) for n in message.get("nodes", ())]
+        self.redirects = 0
+        self.last_server_ack = time.monotonic()
+        if not self._registered.done():
+            self._registered.set_result(None)
+            log.info("[PEER %s] Registration successful", self.peer_id)
+
+    def _handle_redirect(self, message: Dict, addr: Tuple[str, int]):
+        if not self._from_server(addr):
+            log.warning("[PEER %s] Ignored redirect from %s:%s, not our server", self.peer_id, *addr)
+            return
+        self.server_addr = tuple(message["server"])
+        self.redirects += 1
+        log.info("[PEER %s] Redirected to server %s:%s", self.peer_id, *self.server_addr)
+        self._register_with_server()
+
+    def _from_server(self, addr: Tuple[str, int]) -> bool:
+        """Whether a datagram came from the server we are registered with"""
+        host, port = self.server_addr
+        if addr == (host, port):
+            return True
+        try:
+            return addr == (socket.gethostbyname(host), port)
+        except OSError:
+            return False
+
+    def _handle_keepalive_ack(self, message: Dict, addr: Tuple[str, int]):
+        self.last_server_ack = time.monotonic()
+
+    def _handle_incoming_connection(self, message: Dict, addr: Tuple[str, int]):
+        from_peer = message["from_peer"]
+        log.info("[PEER %s] Incoming connection from %s, accepting", self.peer_id, from_peer)
+        self._reset_session()
+        self.target_peer = from_peer
+        self._request({"type": "accept_connection", "from_peer": from_peer})
+
+    def _handle_busy(self, message: Dict, addr: Tuple[str, int]):
+        # The server shed our request; resend it when it says to
+        self.requests.defer(message["busy"], message.get("retry_after", 1.0))
+
+    def _handle_error(self, message: Dict, addr: Tuple[str, int]):
+        log.warning("[PEER %s] Server error: %s", self.peer_id, message.get("message", ""))
+        if self.current_session is None and not self._session.done():
+            self._session.set_exception(ConnectionError(message.get("message", "Server error")))
+            self._session.exception()
+
+    # ============== SESSION ==============
+    def _reset_session(self):
+        self.current_session = None
+        self.relay_addr = self.relay_channel = self.direct_addr = None
+        self.target_peer = self.pending_relay = None
+        self.group_members = []
+        if self._session.done():
+            self._session = self.loop.create_future()
+
+    def _session_up(self):
+        if not self._session.done():
+            self._session.set_result(self.current_session)
+
+    def _handle_relay_info(self, message: Dict, addr: Tuple[str, int]):
+        if message.get("migrate") and message["session_id"] == self.current_session and self.relay_addr:
+            self._start_migration(message)
+            return
+        if message["session_id"] != self.current_session and self._session.done():
+            self._session = self.loop.create_future()    # Put in a group by another peer
+        self.pending_relay = None
+        self.current_session = message["session_id"]
+        self.group_members = message.get("members", [])
+        self.relay_addr = (message["relay_addr"][0], message["port"])
+        self.relay_channel = message.get("channel")
+        self.direct_addr = None
+        self.session_wire = message.get("wire", wire.WIRE_JSON)
+        log.info("[PEER %s] Relay info: connect to %s:%s", self.peer_id, *self.relay_addr)
+        # Open our NAT mapping towards the relay
+        self._send_to_session({"type": "relay_data", "session_id": self.current_session, "action": "init"})
+        self._session_up()
+
+    def _start_migration(self, message: Dict):
+        # Our relay is draining: keep using it until packets come back from the new one
+        self.pending_relay = ((message["relay_addr"][0], message["port"]), message.get("channel"))
+        log.info("[PEER %s] Session moving to relay %s:%s", self.peer_id, *self.pending_relay[0])
+        self.tasks.append(self.loop.create_task(self._migrate_loop(self.current_session, self.pending_relay)))
+
+    async def _migrate_loop(self, session_id: str, path: Tuple[Tuple[str, int], Optional[int]]):
+        frame = wire.encode({"type": "relay_data", "session_id": session_id, "action": "init"},
+                            self.session_wire)
+        if path[1] is not None:
+            frame = wire.frame_channel(path[1], frame)
+        deadline = time.monotonic() + self.MIGRATE_DURATION
+        try:
+            while (self.running and time.monotonic() < deadline and self.current_session == session_id
+                   and self.pending_relay == path):
+                self.transport.sendto(frame, path[0])
+                await asyncio.sleep(self.PUNCH_INTERVAL)
+            if self.current_session == session_id and self.pending_relay == path:
+                # The old relay is going away whether or not the new one answered
+                self._switch_relay(path)
+        finally:
+            task = asyncio.current_task()
+            if task in self.tasks:
+                self.tasks.remove(task)
+
+    def _switch_relay(self, path: Tuple[Tuple[str, int], Optional[int]]):
+        self.pending_relay = None
+        self.relay_addr, self.relay_channel = path
+        log.info("[PEER %s] Switched to relay %s:%s", self.peer_id, *self.relay_addr)
+        # Lets the other peer see the new path work too, even if it has nothing to send
+        self._send_to_session({"type": "relay_data", "session_id": self.current_session, "action": "init"})
+        self._request({"type": "relay_switched", "session_id": self.current_session, "peer_id": self.peer_id})
+
+    def _handle_punch(self, message: Dict, addr: Tuple[str, int]):
+        self.current_session = message["session_id"]
+        self.target_peer = message["peer_id"]
+        self.session_wire = message.get("wire", wire.WIRE_JSON)
+        self.pending_relay = None
+        self.relay_addr = self.relay_channel = self.direct_addr = None
+        self.punch_report = message.get("report", False)
+        peer_addr = tuple(message["addr"])
+        log.info("[PEER %s] Punching to %s at %s:%s", self.peer_id, self.target_peer, *peer_addr)
+        self.tasks.append(self.loop.create_task(self._punch_loop(self.current_session, peer_addr)))
+
+    async def _punch_loop(self, session_id: str, peer_addr: Tuple[str, int]):
+        probe = wire.encode({"type": "punch_probe", "session_id": session_id, "peer_id": self.peer_id},
+                            self.session_wire)
+        deadline = time.monotonic() + self.PUNCH_DURATION
+        try:
+            while (self.running and time.monotonic() < deadline and self.current_session == session_id
+                   and self.direct_addr is None and self.relay_addr is None):
+                self.transport.sendto(probe, peer_addr)
+                await asyncio.sleep(self.PUNCH_INTERVAL)
+        finally:
+            task = asyncio.current_task()
+            if task in self.tasks:
+                self.tasks.remove(task)
+
+    def _handle_punch_probe(self, message: Dict, addr: Tuple[str, int]):
+        if message["session_id"] != self.current_session:
+            return
+        ack = {"type": "punch_ack", "session_id": self.current_session}
+        self.transport.sendto(wire.encode(ack, self.session_wire), addr)
+
+    def _handle_punch_ack(self, message: Dict, addr: Tuple[str, int]):
+        if (message["session_id"] != self.current_session or self.direct_addr is not None
+                or self.relay_addr is not None):
+            return
+        self.direct_addr = addr
+        log.info("[PEER %s] Direct path to %s established at %s:%s", self.peer_id, self.target_peer, *addr)
+        if self.punch_report:
+            self._request({"type": "punch_result", "session_id": self.current_session})
+        self._session_up()
+
+    def _handle_relay_data(self, message: Dict, addr: Tuple[str, int]):
+        if message.get("action") == "init":
+            return
+        data = message.get("data", b"")
+        if isinstance(data, str):
+            data = data.encode()
+        if self.on_message:
+            self.on_message(data)
+        if len(self._inbox) < self.MESSAGE_QUEUE:
+            self._put_inbox(data)
+
+    def _put_inbox(self, data: Optional[bytes]):
+        self._inbox.append(data)
+        if self._inbox_waiter is not None and not self._inbox_waiter.done():
+            self._inbox_waiter.set_result(None)
+
+    def _handle_session_closed(self, message: Dict, addr: Tuple[str, int]):
+        if message["session_id"] != self.current_session:
+            return
+        log.info("[PEER %s] Session %s closed", self.peer_id, message["session_id"])
+        self._reset_session()
+
+    # ============== SENDING ==============
+    def _send_to_session(self, message: Dict):
+        frame = wire.encode(message, self.session_wire)
+        if self.direct_addr:
+            self.transport.sendto(frame, self.direct_addr)
+            return
+        if self.relay_channel is not None:
+            frame = wire.frame_channel(self.relay_channel, frame)
+        self.transport.sendto(frame, self.relay_addr)
+
+    def _send_to_server(self, message: Dict):
+        self._send_signal(message, self.server_addr)
+
+    def _request(self, message: Dict):
+        """Send a signaling request and resend it until the server acks it."""
+        self.requests.send(message, self.server_addr)
+        self._arm_retransmit()
+
+    def _send_signal(self, message: Dict, addr: Tuple[str, int]):
+        self.transport.sendto(wire.encode(message, self.wire_version), addr)
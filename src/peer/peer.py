@@ -1,41 +1,165 @@
+import os
+import signal
 import socket
-import json
+import tempfile
 import threading
 import time
 import uuid
-from typing import Dict, Tuple, Optional
+from typing import BinaryIO, Dict, List, Set, Tuple, Optional
+from .relay_engine import RelayEngine, bind_mux_socket
+from .relay_workers import RelayWorkerPool
+from .transport import Transport
+from ..common import wire
+from ..common.bufpool import BufferPool, Receiver, DEFAULT_MAX_DATAGRAM
+from ..common.capture import Capture
+from ..common.log import get_logger, setup_logging
+from ..common.metrics import Metrics
+from ..common.retransmit import DedupeCache, Retransmitter, ack_for
+
+log = get_logger("peer")
 
 class Peer:
-    def __init__(self, server_host="15.0.0.3", server_port=50000, is_relay_capable=False):
+    # Seconds between relay load reports to the server
+    LOAD_REPORT_INTERVAL = 5
+    # Seconds between keepalives to the server
+    KEEPALIVE_INTERVAL = 10
+    # Unacknowledged keepalives/load reports before moving to another cluster node
+    SERVER_MISSES = 3
+    # Seconds between hole punching probes, and how long to keep probing
+    PUNCH_INTERVAL = 0.1
+    PUNCH_DURATION = 5.0
+    # Receive buffer requested for the main socket, which queues bursts of stream segments
+    MAIN_RCVBUF = 4 * 1024 * 1024
+    # Relay allocations kept bound and advertised ahead of demand (relay only)
+    RELAY_POOL = 16
+    # Seconds to probe a relay a session is moving to before switching to it regardless
+    MIGRATE_DURATION = 5.0
+    # Seconds a draining relay waits for the server to move its sessions elsewhere
+    DRAIN_TIMEOUT = 30.0
+
+    def __init__(self, server_host="15.0.0.3", server_port=50000, is_relay_capable=False,
+                 relay_capacity=1000, relay_max_pps=0, max_datagram=DEFAULT_MAX_DATAGRAM,
+                 relay_workers=0, relay_mux_port=None, relay_pool=None, relay_capture=None):
         self.server_addr = (server_host, server_port)
         self.peer_id = str(uuid.uuid4())[:8]
         self.is_relay_capable = is_relay_capable
+        # Self-declared limits advertised in load reports (relay only)
+        self.relay_capacity = relay_capacity
+        self.relay_max_pps = relay_max_pps
         
         # Main socket for communication with the server (and possibly for sending data to the relay)
         self.main_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.main_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.MAIN_RCVBUF)
+        except OSError:
+            pass
         self.main_sock.bind(("0.0.0.0", 0))  # OS selects an ephemeral local port
+
+        # Receive buffers for the message thread and the relay loop
+        self.buffer_pool = BufferPool(max_datagram)
         
         # Status flags
         self.running = False
+
+        # Encoding used towards the server (negotiated on register) and towards
+        # the other peer over the relay (announced in relay_info)
+        self.wire_version = wire.WIRE_JSON
+        self.session_wire = wire.WIRE_JSON
+
+        # Clustered servers: the nodes to fail over to, redirects followed for
+        # the current registration, and when the server last acknowledged us
+        self.server_nodes = []
+        self.redirects = 0
+        self.last_server_ack = time.monotonic()
+
+        # Acknowledged signaling: our requests are resent until the server acks
+        # them, and what it resends to us is handled once per request id
+        self.requests = Retransmitter(self._send_signal, on_give_up=self._on_request_lost)
+        self.seen_requests = DedupeCache()
         
         # Connection info (for normal peers)
         self.current_session = None
         self.relay_addr = None    # The IP of the relay
         self.relay_port = None    # The UDP port assigned to this peer
+        self.relay_channel = None # Our channel number on a single-port relay
         self.target_peer = None   # The peer we’re connecting to
+        self.direct_addr = None   # The other peer's address once a direct path is up
+        self.punch_report = False # Whether we tell the server when it comes up
+        # (ip, port, channel) of the relay the session is moving to, while we
+        # still send through the old one
+        self.pending_relay = None
+        self.migrate_lock = threading.Lock()
+        # Reliable streams (send_stream/send_file) over the current session;
+        # incoming ones are written to a spool file as they arrive (stream_id -> file)
+        self.transport = Transport(self.peer_id, self._send_stream_segment, self._on_stream_chunk,
+                                   self._on_stream)
+        self.incoming_streams: Dict[int, BinaryIO] = {}
 
         # Relay-specific data (only used if is_relay_capable=True)
         self.relay_sessions: Dict[str, Dict] = {}
-        self.relay_threads: Dict[str, list] = {}
+        # session_id -> address of the server that set it up (where updates go)
+        self.relay_session_servers: Dict[str, Tuple[str, int]] = {}
+        # Relay data plane: one event loop in this process, or N worker processes.
+        # With a mux port, all sessions share one socket (per worker) and are told
+        # apart by channel numbers instead of getting two sockets each.
+        # `relay_capture` is a path to trace every relayed datagram received to
+        # (per worker: the path plus ".<index>"); signaling is in the server's trace.
+        self.relay_mux = relay_mux_port is not None
+        self.relay_engine = None
+        self.relay_capture = None
+        if is_relay_capable and relay_workers > 0:
+            self.relay_engine = RelayWorkerPool(self.peer_id, relay_workers, self.buffer_pool,
+                                                mux_port=relay_mux_port, capture_path=relay_capture)
+        elif is_relay_capable:
+            mux_sock = bind_mux_socket(relay_mux_port) if self.relay_mux else None
+            self.relay_capture = Capture(relay_capture) if relay_capture else None
+            self.relay_engine = RelayEngine(self.peer_id, self.buffer_pool, mux_sock, self.relay_capture)
+        if self.relay_engine:
+            self.relay_engine.on_session_expired = self._on_relay_session_expired
+            self._init_relay_metrics()
+        # Warm pool: allocations already relaying under their own id, waiting for
+        # the server to hand them to a session (alloc id -> (session, advertisement)).
+        # 0 falls back to binding on every relay_setup.
+        self.relay_pool_size = self.RELAY_POOL if relay_pool is None else relay_pool
+        self.relay_pool: Dict[str, Tuple[Dict, Dict]] = {}
+        self.relay_pool_lock = threading.Lock()
+        # alloc id -> session_id, for sessions that came out of the pool
+        self.relay_allocs: Dict[str, str] = {}
+        # Draining: the servers still moving our sessions elsewhere, set once they all have
+        self.draining = False
+        self.drain_servers: Set[Tuple[str, int]] = set()
+        self.drained = threading.Event()
 
         local_ip, local_port = self.main_sock.getsockname()
-        print(f"\n[PEER {self.peer_id}] Started on ({local_ip}:{local_port})")
+        log.info("[PEER %s] Started on (%s:%s)", self.peer_id, local_ip, local_port)
         if is_relay_capable:
-            print(f"[PEER {self.peer_id}] Running as relay node")
+            log.info("[PEER %s] Running as relay node", self.peer_id)
+
+    def _init_relay_metrics(self):
+        """Relay counters, served in reply to "stats" requests (per session only if asked for detail)."""
+        engine = self.relay_engine
+        self.metrics = Metrics("relay")
+        self.metrics.gauge("sessions", "Relay sessions", fn=lambda: len(self.relay_sessions))
+        self.metrics.gauge("forwarded_packets", "Datagrams forwarded", fn=lambda: engine.packets)
+        self.metrics.gauge("forwarded_bytes", "Bytes forwarded", fn=lambda: engine.bytes)
+        self.metrics.gauge("dropped_packets", "Datagrams dropped", fn=lambda: engine.drops)
+        self.metrics.gauge("limited_packets", "Datagrams dropped for exceeding a session rate limit",
+                           fn=lambda: engine.limited)
+        for field in ("packets", "bytes", "drops", "limited"):
+            self.metrics.add_collector(
+                "counter", f"session_{field}_total", f"Per-session {field}",
+                lambda field=field: [({"session": sid}, stats[field])
+                                     for sid, stats in engine.session_stats().items()])
 
     def start(self):
         """Start peer operation."""
         self.running = True
+
+        # Start the relay data plane before we can be asked to set up sessions
+        # (and before any other thread exists, as worker processes are forked)
+        if self.relay_engine:
+            self.relay_engine.start()
+            self._fill_relay_pool()
         
         # Register with server
         self._register_with_server()
@@ -44,11 +168,15 @@ class Peer:
         msg_thread = threading.Thread(target=self._handle_messages)
         msg_thread.daemon = True
         msg_thread.start()
+        threading.Thread(target=self._retransmit_loop, daemon=True).start()
 
         # (Optional) Keep sending keepalives periodically, only if not a relay
         if not self.is_relay_capable:
             keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
             keepalive_thread.start()
+        else:
+            load_thread = threading.Thread(target=self._load_report_loop, daemon=True)
+            load_thread.start()
         
         # Start command interface (interactive console)
         self._handle_commands()
@@ -58,15 +186,27 @@ class Peer:
         message = {
             "type": "register",
             "peer_id": self.peer_id,
-            "is_relay_capable": self.is_relay_capable
+            "is_relay_capable": self.is_relay_capable,
+            "wire_versions": list(wire.SUPPORTED_VERSIONS),
+            "redirects": self.redirects
         }
-        self._send_to_server(message)
-        print(f"[PEER {self.peer_id}] Registering with server...")
+        self._request(message)
+        log.info("[PEER %s] Registering with server...", self.peer_id)
+
+    def _retransmit_loop(self):
+        """Resend signaling requests the server hasn't acknowledged."""
+        while self.running:
+            self.requests.wait(self.KEEPALIVE_INTERVAL)
+            self.requests.poll()
+
+    def _on_request_lost(self, message: Dict, addr: Tuple[str, int]):
+        log.warning("[PEER %s] No answer to %s from %s:%s, giving up", self.peer_id, message["type"], *addr)
 
     def _keepalive_loop(self):
         """Periodically send keepalive to keep NAT mapping open (for normal peers)."""
         while self.running:
-            time.sleep(10)  # every 10 seconds
+            time.sleep(self.KEEPALIVE_INTERVAL)
+            self._check_server(self.KEEPALIVE_INTERVAL)
             self._send_keepalive()
 
     def _send_keepalive(self):
@@ -78,69 +218,221 @@ class Peer:
             "type": "keepalive",
             "peer_id": self.peer_id
         }
-        self.main_sock.sendto(json.dumps(keepalive_msg).encode(), self.server_addr)
-        print(f"[PEER {self.peer_id}] Sent keepalive to server from ({local_ip}:{local_port})")
+        self._send_to_server(keepalive_msg)
+        log.debug("[PEER %s] Sent keepalive to server from (%s:%s)", self.peer_id, local_ip, local_port)
+
+    def _load_report_loop(self):
+        """Periodically report relay load so the server can balance sessions (relay only)."""
+        last_time = time.monotonic()
+        last_packets, last_bytes = self.relay_engine.packets, self.relay_engine.bytes
+        self._send_relay_load(0.0, 0.0)
+        while self.running:
+            time.sleep(self.LOAD_REPORT_INTERVAL)
+            self._check_server(self.LOAD_REPORT_INTERVAL)
+            now = time.monotonic()
+            packets, bytes_ = self.relay_engine.packets, self.relay_engine.bytes
+            elapsed = max(now - last_time, 1e-6)
+            self._send_relay_load((packets - last_packets) / elapsed, (bytes_ - last_bytes) / elapsed)
+            self._advertise_relay_pool()    # Resync in case an advertisement was lost
+            last_time, last_packets, last_bytes = now, packets, bytes_
+
+    def _send_relay_load(self, pps: float, bps: float):
+        # A group costs an allocation per member, so it counts as that many sessions
+        sessions = sum(len(session["members"]) if session.get("group") else 1
+                       for session in list(self.relay_sessions.values()))
+        load_msg = {
+            "type": "relay_load",
+            "peer_id": self.peer_id,
+            "sessions": sessions,
+            "pps": round(pps, 1),
+            "bps": round(bps, 1),
+            "capacity": self.relay_capacity,
+            "max_pps": self.relay_max_pps
+        }
+        self._send_to_server(load_msg)
+
+    def _check_server(self, interval: float):
+        """Register with another cluster node if ours stopped acknowledging us."""
+        if not self.server_nodes:
+            return  # Single server: nothing to fail over to
+        if time.monotonic() - self.last_server_ack < interval * self.SERVER_MISSES:
+            return
+        others = [n for n in self.server_nodes if n != self.server_addr]
+        if not others:
+            return
+        # Any node will do: it redirects us to our new owner
+        self.server_addr = others[hash(self.peer_id) % len(others)]
+        self.last_server_ack = time.monotonic()
+        log.warning("[PEER %s] Server not responding, trying %s:%s", self.peer_id, *self.server_addr)
+        self.redirects = 0
+        self._register_with_server()
 
     def _handle_messages(self):
         """Background thread: handle incoming UDP messages."""
+        receiver = Receiver(self.buffer_pool)
         while self.running:
             try:
-                data, addr = self.main_sock.recvfrom(1024)
-                message = json.loads(data.decode())
+                data, addr = receiver.recv(self.main_sock)
+                if data is None:
+                    log.warning("[PEER %s] Dropped oversized datagram from %s", self.peer_id, addr,
+                                extra={"rate_key": addr})
+                    continue
+                message = wire.decode(data)
                 self._process_message(message, addr)
             except Exception as e:
-                print(f"[PEER {self.peer_id}] Error handling message: {e}")
+                log.error("[PEER %s] Error handling message: %s", self.peer_id, e)
 
     def _process_message(self, message: Dict, addr: Tuple[str, int]):
         """Dispatch messages based on 'type'."""
         msg_type = message.get("type", "")
-        
+        if self.pending_relay and addr == self.pending_relay[:2]:
+            self._switch_relay(self.pending_relay)    # The relay we are moving to works
+        if "ack" in message:
+            self.requests.ack(message["ack"])
+        if "rid" in message and self._acknowledge(message, addr):
+            return  # A resend of something we already handled
+
         if msg_type == "register_response":
-            print(f"[PEER {self.peer_id}] Registration {'successful' if message['status'] == 'success' else 'failed'}")
+            log.info("[PEER %s] Registration %s", self.peer_id, 'successful' if message['status'] == 'success' else 'failed')
+            if message["status"] == "success":
+                self.wire_version = message.get("wire_version", wire.WIRE_JSON)
+                self.server_nodes = [tuple(n) for n in message.get("nodes", ())]
+                self.redirects = 0
+                self.last_server_ack = time.monotonic()
             # Immediately send a keepalive now (in addition to the periodic loop)
             if message["status"] == "success" and not self.is_relay_capable:
                 self._send_keepalive()
+            elif message["status"] == "success":
+                self._advertise_relay_pool()
+
+        elif msg_type == "redirect":
+            self._handle_redirect(message, addr)
+
+        elif msg_type == "keepalive_ack":
+            self.last_server_ack = time.monotonic()
+
+        elif msg_type == "ack":
+            pass  # Handled above
+
+        elif msg_type == "busy":
+            # The server shed our request; resend it when it says to
+            self.requests.defer(message["busy"], message.get("retry_after", 1.0))
+            log.debug("[PEER %s] Server busy, retrying in %ss", self.peer_id, message.get("retry_after"))
 
         elif msg_type == "incoming_connection":
             self._handle_incoming_connection(message)
             
         elif msg_type == "relay_setup" and self.is_relay_capable:
-            self._handle_relay_setup(message)
+            self._handle_relay_setup(message, addr)
+
+        elif msg_type == "relay_assign" and self.is_relay_capable:
+            self._handle_relay_assign(message, addr)
             
+        elif msg_type == "relay_teardown" and self.is_relay_capable:
+            self._handle_relay_teardown(message)
+
+        elif msg_type == "relay_group_join" and self.is_relay_capable:
+            self._handle_relay_group_join(message, addr)
+
+        elif msg_type == "relay_group_leave" and self.is_relay_capable:
+            self._handle_relay_group_leave(message)
+
+        elif msg_type == "relay_drained" and self.is_relay_capable:
+            self._handle_relay_drained(message, addr)
+
+        elif msg_type == "session_closed":
+            self._handle_session_closed(message)
+
         elif msg_type == "relay_info":
             self._handle_relay_info(message)
+
+        elif msg_type == "punch":
+            self._handle_punch(message)
+
+        elif msg_type == "punch_probe":
+            self._handle_punch_probe(message, addr)
+
+        elif msg_type == "punch_ack":
+            self._handle_punch_ack(message, addr)
             
         elif msg_type == "relay_data":
             self._handle_relay_data(message)
+
+        elif msg_type == "stream":
+            if message.get("session_id") == self.current_session:
+                self.transport.handle(message["data"])
         
+        elif msg_type == "stats" and self.is_relay_capable:
+            reply = self.metrics.stats_response(message)
+            self.main_sock.sendto(wire.encode(reply), addr)
+
         elif msg_type == "error":
-            print(f"[PEER {self.peer_id}] Server error: {message.get('message', '')}")
+            log.warning("[PEER %s] Server error: %s", self.peer_id, message.get('message', ''))
         
         else:
-            print(f"[PEER {self.peer_id}] Unknown message type: {msg_type}")
+            log.warning("[PEER %s] Unknown message type: %s", self.peer_id, msg_type)
+
+    def _acknowledge(self, message: Dict, addr: Tuple[str, int]) -> bool:
+        """Ack a message the server resends until we do; True if we handled it before."""
+        _, duplicate = self.seen_requests.check(message["rid"])
+        self._send_signal(ack_for(message["rid"]), addr)
+        return duplicate
+
+    def _handle_redirect(self, message: Dict, addr: Tuple[str, int]):
+        """A cluster node says another node owns us: register there."""
+        if not self._from_server(addr):
+            log.warning("[PEER %s] Ignored redirect from %s:%s, not our server", self.peer_id, *addr)
+            return
+        self.server_addr = tuple(message["server"])
+        self.redirects += 1
+        log.info("[PEER %s] Redirected to server %s:%s", self.peer_id, *self.server_addr)
+        self._register_with_server()
+
+    def _from_server(self, addr: Tuple[str, int]) -> bool:
+        """Whether a datagram came from the server we are registered with"""
+        host, port = self.server_addr
+        if addr == (host, port):
+            return True
+        try:
+            return addr == (socket.gethostbyname(host), port)
+        except OSError:
+            return False
 
     def _handle_incoming_connection(self, message: Dict):
         """Peer B receives a connection request from Peer A."""
         from_peer = message["from_peer"]
-        print(f"[PEER {self.peer_id}] Incoming connection from {from_peer}")
+        log.info("[PEER %s] Incoming connection from %s", self.peer_id, from_peer)
         
         # Auto-accept connection
         accept_msg = {
             "type": "accept_connection",
             "from_peer": from_peer
         }
-        print(f"[PEER {self.peer_id}] Accepting connection")
-        self._send_to_server(accept_msg)
+        log.info("[PEER %s] Accepting connection", self.peer_id)
+        self._request(accept_msg)
 
     # ============== RELAY MODE (If is_relay_capable=True) ==============
-    def _handle_relay_setup(self, message: Dict):
+    def _handle_relay_setup(self, message: Dict, server: Tuple[str, int]):
         """
-        The server is telling this peer to act as a relay for peer_a and peer_b.
-        We'll create two sockets, one for each peer, and then send back 'relay_ready'.
+        The server is telling this peer to relay for peer_a and peer_b, or for
+        every member of a group: allocate a socket (or channel) per peer and
+        send back 'relay_ready'.
         """
         session_id = message["session_id"]
+        # Optional {"bps": bytes/s, "burst": bytes} the relay enforces for the session
+        rate_limit = message.get("rate_limit")
+        # In a cluster any node may place sessions here; answer the one that asked
+        self.relay_session_servers[session_id] = server
+        # The IP the server sees each peer at; a side only accepts its peer's traffic from there
+        hosts = {peer_id: addr[0] for peer_id, addr in message.get("addrs", {}).items()}
+        if "members" in message:
+            self._handle_group_relay_setup(session_id, message["members"], hosts, rate_limit)
+            return
         peer_a = message["peer_a"]
         peer_b = message["peer_b"]
+        if self.relay_mux:
+            self._handle_mux_relay_setup(session_id, peer_a, peer_b, hosts, rate_limit)
+            return
         
         # Create sockets for both peers
         sock_a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -150,13 +442,11 @@ class Peer:
         
         # Store session info
         self.relay_sessions[session_id] = {
-            "peer_a": {"id": peer_a, "socket": sock_a, "addr": None},
-            "peer_b": {"id": peer_b, "socket": sock_b, "addr": None}
+            "peer_a": {"id": peer_a, "socket": sock_a, "addr": None, "host": hosts.get(peer_a)},
+            "peer_b": {"id": peer_b, "socket": sock_b, "addr": None, "host": hosts.get(peer_b)},
+            "rate_limit": rate_limit
         }
         
-        # Start relay threads
-        self._start_relay_threads(session_id)
-        
         # Send ports to server
         response = {
             "type": "relay_ready",
@@ -167,53 +457,219 @@ class Peer:
                 peer_b: sock_b.getsockname()[1]
             }
         }
-        self._send_to_server(response)
-        print(f"[PEER {self.peer_id}] Relay setup complete. Session {session_id}")
 
-    def _start_relay_threads(self, session_id: str):
-        """Start threads to relay data in both directions."""
-        session = self.relay_sessions[session_id]
-        
-        thread_ab = threading.Thread(
-            target=self._relay_thread,
-            args=(session["peer_a"]["socket"], session["peer_b"]["socket"], 
-                  "peer_a", "peer_b", session_id)
-        )
-        thread_ba = threading.Thread(
-            target=self._relay_thread,
-            args=(session["peer_b"]["socket"], session["peer_a"]["socket"], 
-                  "peer_b", "peer_a", session_id)
-        )
-        
-        thread_ab.daemon = True
-        thread_ba.daemon = True
-        
-        self.relay_threads[session_id] = [thread_ab, thread_ba]
-        thread_ab.start()
-        thread_ba.start()
+        # Hand both sockets to the relay data plane (which may move them to a worker)
+        self.relay_engine.add_session(session_id, self.relay_sessions[session_id])
+        self._request(response, self.relay_session_servers[session_id])
+        log.info("[PEER %s] Relay setup complete. Session %s", self.peer_id, session_id)
+
+    def _handle_mux_relay_setup(self, session_id: str, peer_a: str, peer_b: str, hosts: Dict[str, str],
+                                rate_limit: Optional[Dict] = None):
+        """Single-port relay: give each peer a channel on the shared socket instead of a port."""
+        session = {
+            "peer_a": {"id": peer_a, "addr": None, "host": hosts.get(peer_a)},
+            "peer_b": {"id": peer_b, "addr": None, "host": hosts.get(peer_b)},
+            "rate_limit": rate_limit
+        }
+        mux_port = self.relay_engine.assign_channels(session_id, session)
+        self.relay_sessions[session_id] = session
 
-    def _relay_thread(self, from_sock: socket.socket, to_sock: socket.socket, 
-                     from_peer_key: str, to_peer_key: str, session_id: str):
+        response = {
+            "type": "relay_ready",
+            "session_id": session_id,
+            "mux_port": mux_port,
+            "channels": {
+                peer_a: session["peer_a"]["channel"],
+                peer_b: session["peer_b"]["channel"]
+            }
+        }
+        self.relay_engine.add_session(session_id, session)
+        self._request(response, self.relay_session_servers[session_id])
+        log.info("[PEER %s] Relay setup complete. Session %s on port %s", self.peer_id, session_id, mux_port)
+
+    def _handle_group_relay_setup(self, session_id: str, members: List[str], hosts: Dict[str, str],
+                                  rate_limit: Optional[Dict] = None):
         """
-        Repeatedly recv from one socket and forward to the other peer's known address.
-        If we don't know the address yet, we learn it from the first inbound packet.
+        A group session: a socket (or channel) per member, each member's
+        datagrams copied to all the others. "ready" keeps what relay_ready
+        reported, for members joining later.
         """
-        session = self.relay_sessions[session_id]
-        while self.running and session_id in self.relay_sessions:
-            try:
-                data, addr = from_sock.recvfrom(1024)
-                
-                # If we haven't learned the "from" peer's NAT address yet, store it
-                if not session[from_peer_key]["addr"]:
-                    session[from_peer_key]["addr"] = addr
-                    print(f"[RELAY {self.peer_id}] Learned {from_peer_key} address: {addr}")
-                
-                # Forward the packet if we know where to send it
-                if session[to_peer_key]["addr"]:
-                    to_sock.sendto(data, session[to_peer_key]["addr"])
-                    print(f"[RELAY {self.peer_id}] Relayed {from_peer_key} -> {to_peer_key}")
-            except Exception as e:
-                print(f"[RELAY {self.peer_id}] Error in relay: {e}")
+        session = {
+            "group": True,
+            "members": {peer_id: self._group_side(peer_id, hosts.get(peer_id)) for peer_id in members},
+            "rate_limit": rate_limit
+        }
+        if self.relay_mux:
+            mux_port = self.relay_engine.assign_channels(session_id, session)
+            ready = {"mux_port": mux_port,
+                     "channels": {peer_id: side["channel"] for peer_id, side in session["members"].items()}}
+        else:
+            ready = {"ports": {peer_id: side["socket"].getsockname()[1]
+                               for peer_id, side in session["members"].items()}}
+        session["ready"] = ready
+        self.relay_sessions[session_id] = session
+
+        response = {"type": "relay_ready", "session_id": session_id, **ready}
+        self.relay_engine.add_session(session_id, session)
+        self._request(response, self.relay_session_servers[session_id])
+        log.info("[PEER %s] Relay setup complete. Group session %s with %s members", self.peer_id, session_id,
+                 len(members))
+
+    def _group_side(self, peer_id: str, host: Optional[str]) -> Dict:
+        if self.relay_mux:
+            return {"id": peer_id, "addr": None, "host": host}
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("0.0.0.0", 0))
+        return {"id": peer_id, "socket": sock, "addr": None, "host": host}
+
+    def _handle_relay_group_join(self, message: Dict, server: Tuple[str, int]):
+        """Allocate for a member joining a group session and tell the server where it is."""
+        session_id = message["session_id"]
+        peer_id = message["peer_id"]
+        session = self.relay_sessions.get(session_id)
+        if session is None or not session.get("group"):
+            log.warning("[PEER %s] Join for unknown group session %s", self.peer_id, session_id)
+            return
+        ready = session["ready"]
+        key = "channels" if self.relay_mux else "ports"
+        # Asked again (the server's relay_ready was lost): same allocation as before
+        if peer_id not in ready[key]:
+            addr = message.get("addrs", {}).get(peer_id)
+            side = self._group_side(peer_id, addr[0] if addr else None)
+            if self.relay_mux:
+                self.relay_engine.assign_channels(session_id, {"group": True, "members": {peer_id: side}})
+                ready[key][peer_id] = side["channel"]
+            else:
+                ready[key][peer_id] = side["socket"].getsockname()[1]
+            self.relay_engine.add_member(session_id, peer_id, side)
+
+        response = {"type": "relay_ready", "session_id": session_id, key: {peer_id: ready[key][peer_id]}}
+        if self.relay_mux:
+            response["mux_port"] = ready["mux_port"]
+        self._request(response, server)
+        log.info("[PEER %s] %s joined group session %s", self.peer_id, peer_id, session_id)
+
+    def _handle_relay_group_leave(self, message: Dict):
+        """A member left a group session: release its allocation."""
+        session = self.relay_sessions.get(message["session_id"])
+        if session is None or not session.get("group"):
+            return
+        key = "channels" if self.relay_mux else "ports"
+        if session["ready"][key].pop(message["peer_id"], None) is not None:
+            self.relay_engine.remove_member(message["session_id"], message["peer_id"])
+            log.info("[PEER %s] %s left group session %s", self.peer_id, message["peer_id"],
+                     message["session_id"])
+
+    def _fill_relay_pool(self):
+        """Bind allocations until the warm pool is full and start relaying on them."""
+        # Called from the message and load threads: checking and topping up
+        # under one lock keeps them from both filling the same gap
+        with self.relay_pool_lock:
+            while len(self.relay_pool) < self.relay_pool_size:
+                alloc_id = uuid.uuid4().hex[:12]
+                if self.relay_mux:
+                    session = {"peer_a": {"id": None, "addr": None}, "peer_b": {"id": None, "addr": None}}
+                    port = self.relay_engine.assign_channels(alloc_id, session)
+                    advert = {"id": alloc_id, "port": port,
+                              "channels": [session["peer_a"]["channel"], session["peer_b"]["channel"]]}
+                else:
+                    sock_a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock_b = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock_a.bind(("0.0.0.0", 0))
+                    sock_b.bind(("0.0.0.0", 0))
+                    session = {"peer_a": {"id": None, "socket": sock_a, "addr": None},
+                               "peer_b": {"id": None, "socket": sock_b, "addr": None}}
+                    advert = {"id": alloc_id, "ports": [sock_a.getsockname()[1], sock_b.getsockname()[1]]}
+                self.relay_pool[alloc_id] = (session, advert)
+                self.relay_engine.add_session(alloc_id, session)
+
+    def _advertise_relay_pool(self):
+        if not self.relay_pool_size or self.draining:
+            return
+        with self.relay_pool_lock:
+            allocations = [advert for _, advert in self.relay_pool.values()]
+        self._send_to_server({"type": "relay_pool", "peer_id": self.peer_id, "allocations": allocations})
+
+    def _handle_relay_assign(self, message: Dict, server: Tuple[str, int]):
+        """
+        The server gave one of our warm allocations to a session (and has already
+        sent its peers relay_info). It is relaying already; just record the session.
+        """
+        session_id = message["session_id"]
+        alloc_id = message["alloc"]
+        with self.relay_pool_lock:
+            entry = self.relay_pool.pop(alloc_id, None)
+        if entry is None:
+            log.warning("[PEER %s] Unknown relay allocation %s for session %s", self.peer_id, alloc_id, session_id)
+            return
+        session = entry[0]
+        session["peer_a"]["id"] = message["peer_a"]
+        session["peer_b"]["id"] = message["peer_b"]
+        session["alloc"] = alloc_id
+        if message.get("rate_limit"):
+            session["rate_limit"] = message["rate_limit"]
+            self.relay_engine.set_rate_limit(alloc_id, message["rate_limit"])
+        self.relay_allocs[alloc_id] = session_id
+        self.relay_session_servers[session_id] = server
+        self.relay_sessions[session_id] = session
+        log.info("[PEER %s] Relay allocation %s serves session %s", self.peer_id, alloc_id, session_id)
+        self._fill_relay_pool()
+        self._advertise_relay_pool()
+
+    def _handle_relay_teardown(self, message: Dict):
+        """The server expired a session: release its sockets."""
+        session_id = message["session_id"]
+        self.relay_session_servers.pop(session_id, None)
+        session = self.relay_sessions.pop(session_id, None)
+        if session is not None:
+            # Pool sessions are known to the data plane by their allocation id
+            alloc_id = session.get("alloc")
+            self.relay_allocs.pop(alloc_id, None)
+            self.relay_engine.remove_session(alloc_id or session_id)
+            log.info("[PEER %s] Relay session %s torn down", self.peer_id, session_id)
+
+    def _on_relay_session_expired(self, session_id: str):
+        """Relay loop dropped an idle session: forget it and let the server know."""
+        with self.relay_pool_lock:
+            warm = self.relay_pool.pop(session_id, None)
+        if warm is not None:
+            # An allocation nobody was given went idle: replace it
+            self._fill_relay_pool()
+            self._advertise_relay_pool()
+            return
+        session_id = self.relay_allocs.pop(session_id, session_id)
+        self.relay_sessions.pop(session_id, None)
+        self._send_to_session_server(session_id, {"type": "session_closed", "session_id": session_id})
+        self.relay_session_servers.pop(session_id, None)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ask the servers that placed sessions here to move them to other relays,
+        relaying as usual meanwhile. Returns True once every server reports
+        done, False if `timeout` (default DRAIN_TIMEOUT) runs out first.
+        """
+        if not self.is_relay_capable:
+            return True
+        self.draining = True
+        self.drained.clear()
+        # In a cluster any node may have placed sessions here
+        self.drain_servers = set(self.relay_session_servers.values()) | {self.server_addr}
+        log.info("[PEER %s] Draining %d relay sessions", self.peer_id, len(self.relay_sessions))
+        for server in list(self.drain_servers):
+            self._request({"type": "relay_drain", "peer_id": self.peer_id}, server)
+        done = self.drained.wait(self.DRAIN_TIMEOUT if timeout is None else timeout)
+        if not done:
+            log.warning("[PEER %s] Drain timed out with %d sessions left", self.peer_id, len(self.relay_sessions))
+        return done
+
+    def _handle_relay_drained(self, message: Dict, server: Tuple[str, int]):
+        """A server has moved all the sessions it could off this relay."""
+        if message.get("stranded"):
+            log.warning("[PEER %s] %s sessions had no other relay to go to", self.peer_id, message["stranded"])
+        self.drain_servers.discard(server)
+        if not self.drain_servers:
+            log.info("[PEER %s] Drained", self.peer_id)
+            self.drained.set()
 
     # ============== NORMAL PEER MODE ==============
     def _handle_relay_info(self, message: Dict):
@@ -221,14 +677,24 @@ class Peer:
         The server tells me which port the relay allocated for me. 
         I'll store that and send an initial packet to open my NAT pinhole.
         """
+        if message.get("migrate") and message["session_id"] == self.current_session and self.relay_addr:
+            self._start_migration(message)
+            return
+        self.pending_relay = None
         self.current_session = message["session_id"]
         relay_ip = message["relay_addr"][0]  
         relay_port_for_me = message["port"]
 
         self.relay_addr = relay_ip
         self.relay_port = relay_port_for_me
+        self.relay_channel = message.get("channel")
+        self.direct_addr = None  # Punching failed (or wasn't tried); the relay carries the session
+        self.session_wire = message.get("wire", wire.WIRE_JSON)
         
-        print(f"[PEER {self.peer_id}] Relay info: connect to {relay_ip}:{relay_port_for_me}")
+        log.info("[PEER %s] Relay info: connect to %s:%s", self.peer_id, relay_ip, relay_port_for_me)
+        if "members" in message:
+            log.info("[PEER %s] In group %s, %s members", self.peer_id, message.get("group") or self.current_session,
+                     len(message["members"]))
 
         # Send an 'init' message to the relay to create a NAT mapping
         init_msg = {
@@ -236,15 +702,116 @@ class Peer:
             "session_id": self.current_session,
             "action": "init"
         }
-        self.main_sock.sendto(json.dumps(init_msg).encode(), (relay_ip, relay_port_for_me))
-        print(f"[PEER {self.peer_id}] Sent INIT to relay at {relay_ip}:{relay_port_for_me}")
+        self._send_to_session(init_msg)
+        log.debug("[PEER %s] Sent INIT to relay at %s:%s", self.peer_id, relay_ip, relay_port_for_me)
+
+    def _start_migration(self, message: Dict):
+        """
+        Our relay is draining and the server moved the session to another one.
+        Keep using the old relay until packets come back from the new one.
+        """
+        path = (message["relay_addr"][0], message["port"], message.get("channel"))
+        self.pending_relay = path
+        log.info("[PEER %s] Session moving to relay %s:%s", self.peer_id, path[0], path[1])
+        threading.Thread(target=self._migrate_loop, args=(self.current_session, path), daemon=True).start()
+
+    def _migrate_loop(self, session_id: str, path: Tuple):
+        """Open our NAT mapping towards the new relay until it answers, then switch anyway."""
+        frame = wire.encode({"type": "relay_data", "session_id": session_id, "action": "init"},
+                            self.session_wire)
+        if path[2] is not None:
+            frame = wire.frame_channel(path[2], frame)
+        deadline = time.monotonic() + self.MIGRATE_DURATION
+        while (self.running and time.monotonic() < deadline and self.current_session == session_id
+               and self.pending_relay == path):
+            self.main_sock.sendto(frame, path[:2])
+            time.sleep(self.PUNCH_INTERVAL)
+        if self.current_session == session_id:
+            # The old relay is going away whether or not the new one answered
+            self._switch_relay(path)
+
+    def _switch_relay(self, path: Tuple):
+        """Send through the new relay from now on and tell the server we have moved."""
+        with self.migrate_lock:
+            if self.pending_relay != path:
+                return
+            self.pending_relay = None
+            self.relay_addr, self.relay_port, self.relay_channel = path
+        log.info("[PEER %s] Switched to relay %s:%s", self.peer_id, path[0], path[1])
+        # Lets the other peer see the new path work too, even if it has nothing to send
+        self._send_to_session({"type": "relay_data", "session_id": self.current_session, "action": "init"})
+        self._request({"type": "relay_switched", "session_id": self.current_session, "peer_id": self.peer_id})
+
+    def _handle_punch(self, message: Dict):
+        """
+        The server gave us the other peer's public address: probe it until a
+        probe is acknowledged (direct path up) or the server sends relay_info.
+        """
+        self.current_session = message["session_id"]
+        self.target_peer = message["peer_id"]
+        self.session_wire = message.get("wire", wire.WIRE_JSON)
+        self.relay_addr = self.relay_port = self.relay_channel = None
+        self.direct_addr = self.pending_relay = None
+        self.punch_report = message.get("report", False)
+        peer_addr = tuple(message["addr"])
+        log.info("[PEER %s] Punching to %s at %s:%s", self.peer_id, self.target_peer, *peer_addr)
+        threading.Thread(target=self._punch_loop, args=(self.current_session, peer_addr),
+                         daemon=True).start()
+
+    def _punch_loop(self, session_id: str, peer_addr: Tuple[str, int]):
+        probe = wire.encode({"type": "punch_probe", "session_id": session_id, "peer_id": self.peer_id},
+                            self.session_wire)
+        deadline = time.monotonic() + self.PUNCH_DURATION
+        while (self.running and time.monotonic() < deadline and self.current_session == session_id
+               and self.direct_addr is None and self.relay_addr is None):
+            self.main_sock.sendto(probe, peer_addr)
+            time.sleep(self.PUNCH_INTERVAL)
+
+    def _handle_punch_probe(self, message: Dict, addr: Tuple[str, int]):
+        """The other peer's probe got through our NAT: acknowledge it to where it came from."""
+        if message["session_id"] != self.current_session:
+            return
+        ack = {"type": "punch_ack", "session_id": self.current_session}
+        self.main_sock.sendto(wire.encode(ack, self.session_wire), addr)
+
+    def _handle_punch_ack(self, message: Dict, addr: Tuple[str, int]):
+        """Our probe was answered, so packets flow both ways: use the direct path."""
+        if (message["session_id"] != self.current_session or self.direct_addr is not None
+                or self.relay_addr is not None):
+            return
+        self.direct_addr = addr
+        log.info("[PEER %s] Direct path to %s established at %s:%s", self.peer_id, self.target_peer, *addr)
+        if self.punch_report:
+            self._request({"type": "punch_result", "session_id": self.current_session})
+
+    def _handle_session_closed(self, message: Dict):
+        """The server tells us our relay session is gone."""
+        if message["session_id"] != self.current_session:
+            return
+        self.current_session = None
+        self.relay_addr = None
+        self.relay_port = None
+        self.relay_channel = None
+        self.direct_addr = None
+        self.pending_relay = None
+        self.transport.close()
+        for spool in self.incoming_streams.values():
+            spool.close()
+            os.unlink(spool.name)
+        self.incoming_streams.clear()
+        log.info("[PEER %s] Session %s closed", self.peer_id, message['session_id'])
 
     def _handle_relay_data(self, message: Dict):
-        """We received relay_data from the relay."""
+        """We received relay_data from the relay (or straight from the other peer)."""
         if message.get("action") == "init":
-            print(f"[PEER {self.peer_id}] NAT pinhole established.")
+            log.info("[PEER %s] NAT pinhole established.", self.peer_id)
         else:
-            print(f"[PEER {self.peer_id}] Received from relay: {message.get('data', '')}")
+            data = message.get("data", "")
+            if isinstance(data, bytes):
+                data = data.decode(errors="replace")
+            log.info("[PEER %s] Received from %s: %s", self.peer_id,
+                     "peer" if self.direct_addr else "relay", data,
+                     extra={"rate_key": message.get("session_id")})
 
     def connect_to_peer(self, target_peer_id: str):
         """Request connection to another peer via the server."""
@@ -253,13 +820,27 @@ class Peer:
             "from_peer": self.peer_id,
             "to_peer": target_peer_id
         }
-        self._send_to_server(message)
-        print(f"[PEER {self.peer_id}] Requesting connection to {target_peer_id}")
+        self._request(message)
+        log.info("[PEER %s] Requesting connection to %s", self.peer_id, target_peer_id)
+
+    def connect_to_group(self, peers: Optional[List[str]] = None, group: Optional[str] = None):
+        """
+        Request a group session via the server: with `peers`, or joining the
+        group named `group` (started if nobody is in it). What we send then
+        reaches every other member through the relay.
+        """
+        message = {"type": "connect_request", "from_peer": self.peer_id}
+        if group is not None:
+            message["group"] = group
+        else:
+            message["to_peers"] = list(peers or ())
+        self._request(message)
+        log.info("[PEER %s] Requesting group %s", self.peer_id, group if group is not None else peers)
 
     def send_message(self, data: str):
-        """Send a message through the relay."""
-        if not self.relay_addr or not self.relay_port:
-            print(f"[PEER {self.peer_id}] Error: Not connected to relay")
+        """Send a message to the other peer, directly if punching worked, else through the relay."""
+        if not self.direct_addr and (not self.relay_addr or not self.relay_port):
+            log.warning("[PEER %s] Error: Not connected to relay", self.peer_id)
             return
             
         message = {
@@ -267,33 +848,158 @@ class Peer:
             "session_id": self.current_session,
             "data": data
         }
-        self.main_sock.sendto(json.dumps(message).encode(), (self.relay_addr, self.relay_port))
-        print(f"[PEER {self.peer_id}] Sent message to relay: {data}")
+        self._send_to_session(message)
+        log.debug("[PEER %s] Sent message to relay: %s", self.peer_id, data)
+
+    def send_stream(self, data: bytes) -> Optional[Dict]:
+        """
+        Send a payload of any size reliably and in order. Blocks until the other
+        peer has all of it and returns transfer statistics (throughput_bps etc.).
+        """
+        if not self._stream_ready():
+            return None
+        stats = self.transport.send_stream(data)
+        log.info("[PEER %s] Sent %d bytes in %.2fs (%.1f Mbit/s, %d retransmits)", self.peer_id,
+                 stats["bytes"], stats["seconds"], stats["throughput_bps"] / 1e6, stats["retransmits"])
+        return stats
+
+    def send_file(self, path: str) -> Optional[Dict]:
+        """Send a file's contents as a stream (see send_stream)."""
+        if not self._stream_ready():
+            return None
+        stats = self.transport.send_file(path)
+        log.info("[PEER %s] Sent %s: %d bytes in %.2fs (%.1f Mbit/s, %d retransmits)", self.peer_id, path,
+                 stats["bytes"], stats["seconds"], stats["throughput_bps"] / 1e6, stats["retransmits"])
+        return stats
+
+    def _stream_ready(self) -> bool:
+        if not self.direct_addr and (not self.relay_addr or not self.relay_port):
+            log.warning("[PEER %s] Error: Not connected to relay", self.peer_id)
+            return False
+        if self.session_wire < wire.WIRE_BINARY:
+            log.warning("[PEER %s] Error: Streams need the binary wire format", self.peer_id)
+            return False
+        return True
+
+    def _send_stream_segment(self, segment: bytes):
+        self._send_to_session({"type": "stream", "session_id": self.current_session, "data": segment})
+
+    def _on_stream_chunk(self, stream_id: int, data: bytes):
+        """The next in-order data of a stream from the other peer: append it to the stream's spool file."""
+        spool = self.incoming_streams.get(stream_id)
+        if spool is None:
+            spool = self.incoming_streams[stream_id] = tempfile.NamedTemporaryFile(
+                prefix=f"stream-{stream_id}-", delete=False)
+        spool.write(data)
+
+    def _on_stream(self, stream_id: int, size: int):
+        """A stream from the other peer arrived complete."""
+        spool = self.incoming_streams.pop(stream_id)
+        spool.close()
+        log.info("[PEER %s] Received stream %s: %d bytes in %s", self.peer_id, stream_id, size, spool.name)
+
+    def _send_to_session(self, message: Dict):
+        """Helper: send a message over the current session (framed for single-port relays)."""
+        frame = wire.encode(message, self.session_wire)
+        if self.direct_addr:
+            self.main_sock.sendto(frame, self.direct_addr)
+            return
+        if self.relay_channel is not None:
+            frame = wire.frame_channel(self.relay_channel, frame)
+        self.main_sock.sendto(frame, (self.relay_addr, self.relay_port))
 
     def _send_to_server(self, message: Dict):
-        """Helper: send JSON-encoded message to the central server."""
-        self.main_sock.sendto(json.dumps(message).encode(), self.server_addr)
+        """Helper: send a message to the central server in the negotiated encoding."""
+        self.main_sock.sendto(wire.encode(message, self.wire_version), self.server_addr)
+
+    def _request(self, message: Dict, server: Optional[Tuple[str, int]] = None):
+        """Helper: send a signaling request and resend it until the server acks it."""
+        self.requests.send(message, server or self.server_addr)
+
+    def _send_signal(self, message: Dict, addr: Tuple[str, int]):
+        self.main_sock.sendto(wire.encode(message, self.wire_version), addr)
+
+    def _send_to_session_server(self, session_id: str, message: Dict):
+        """Helper: send a relay session update to the server that set the session up."""
+        server = self.relay_session_servers.get(session_id, self.server_addr)
+        self.main_sock.sendto(wire.encode(message, self.wire_version), server)
 
     def _handle_commands(self):
         """Interactive console loop."""
         while self.running:
             try:
-                cmd = input("\nEnter command (connect <peer_id> or send <message>): ")
+                cmd = input("\nEnter command (connect <peer_id> [<peer_id> ...], group <name>, send <message>, "
+                            "sendfile <path> or drain): ")
                 parts = cmd.split(maxsplit=1)
                 if not parts:
                     continue
                     
-                if parts[0] == "connect" and len(parts) == 2:
+                if parts[0] == "connect" and len(parts) == 2 and len(parts[1].split()) > 1:
+                    self.connect_to_group(peers=parts[1].split())
+                elif parts[0] == "connect" and len(parts) == 2:
                     self.connect_to_peer(parts[1])
+                elif parts[0] == "group" and len(parts) == 2:
+                    self.connect_to_group(group=parts[1])
                 elif parts[0] == "send" and len(parts) == 2:
                     self.send_message(parts[1])
+                elif parts[0] == "sendfile" and len(parts) == 2:
+                    self.send_file(parts[1])
+                elif parts[0] == "drain" and self.is_relay_capable:
+                    self.drain()
                 else:
-                    print("Invalid command. Use 'connect <peer_id>' or 'send <message>'")
+                    print("Invalid command. Use 'connect <peer_id> [<peer_id> ...]', 'group <name>',"
+                          " 'send <message>', 'sendfile <path>' or 'drain' (relay only)")
+            except EOFError:
+                # No console (stdin closed or redirected): keep running headless
+                log.info("[PEER %s] No console input, running headless", self.peer_id)
+                while self.running:
+                    time.sleep(1)
             except Exception as e:
-                print(f"[PEER {self.peer_id}] Command error: {e}")
+                log.error("[PEER %s] Command error: %s", self.peer_id, e)
 
 if __name__ == "__main__":
-    import sys
-    is_relay = (len(sys.argv) > 1 and sys.argv[1] == "--relay")
-    peer = Peer(is_relay_capable=is_relay)
-    peer.start()
+    import argparse
+    parser = argparse.ArgumentParser(description="Peer / relay node")
+    parser.add_argument("--relay", action="store_true", help="run as a relay node")
+    parser.add_argument("--server-host", default="15.0.0.3")
+    parser.add_argument("--server-port", type=int, default=50000)
+    parser.add_argument("--capacity", type=int, default=1000,
+                        help="max sessions this relay accepts (relay only)")
+    parser.add_argument("--max-pps", type=int, default=0,
+                        help="packets/s this relay can forward, 0 = unlimited (relay only)")
+    parser.add_argument("--max-datagram", type=int, default=DEFAULT_MAX_DATAGRAM,
+                        help="largest datagram accepted, up to 65535 bytes")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="relay through N worker processes (relay only)")
+    parser.add_argument("--mux", action="store_true",
+                        help="relay every session over one UDP port using channel numbers (relay only)")
+    parser.add_argument("--mux-port", type=int, default=0,
+                        help="port for --mux, 0 = ephemeral; workers use consecutive ports")
+    parser.add_argument("--pool", type=int, default=Peer.RELAY_POOL,
+                        help="relay allocations kept ready ahead of demand, 0 = bind per session (relay only)")
+    parser.add_argument("--capture", default=None, metavar="PATH",
+                        help="append every relayed datagram received to a trace file (relay only, "
+                             "see bench/replay.py)")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    peer = Peer(args.server_host, args.server_port, is_relay_capable=args.relay,
+                relay_capacity=args.capacity, relay_max_pps=args.max_pps,
+                max_datagram=args.max_datagram, relay_workers=args.workers,
+                relay_mux_port=args.mux_port if args.mux else None, relay_pool=args.pool,
+                relay_capture=args.capture if args.relay else None)
+    if args.relay:
+        def drain_and_exit(signum, frame):
+            # Move our sessions elsewhere before going away
+            peer.drain()
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, drain_and_exit)
+    try:
+        peer.start()
+    finally:
+        if args.capture and args.workers and peer.relay_engine:
+            peer.relay_engine.stop()    # Workers flush their traces on the way out
+        if peer.relay_capture is not None:
+            peer.relay_capture.close()
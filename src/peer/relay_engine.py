@@ -0,0 +1,660 @@
+import logging
+import secrets
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from ..common import wire
+from ..common.bufpool import BufferPool, Receiver
+from ..common.capture import Capture
+from ..common.log import get_logger
+from ..common.ratelimit import TokenBucket
+from ..common.timing_wheel import TimingWheel
+
+log = get_logger("relay")
+
+# Selector key data of the shared socket in single-port mode
+MUX = "mux"
+# Receive buffer requested for single-port relay sockets
+MUX_RCVBUF = 4 * 1024 * 1024
+
+
+def bind_mux_socket(port: int = 0) -> socket.socket:
+    """UDP socket shared by all sessions of a single-port relay."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Every session's traffic queues here; ask for room to absorb bursts
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MUX_RCVBUF)
+    except OSError:
+        pass
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+
+class ChannelAllocator:
+    """
+    Hands out channel numbers for single-port relay sessions, at random from
+    the whole 24-bit space so that a live channel can't be guessed from one's own.
+    """
+
+    def __init__(self):
+        self.allocated: Set[int] = set()
+        self.lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self.lock:
+            if len(self.allocated) >= wire.MAX_CHANNEL:
+                raise RuntimeError("No free relay channels")
+            channel = secrets.randbelow(wire.MAX_CHANNEL) + 1
+            while channel in self.allocated:
+                channel = secrets.randbelow(wire.MAX_CHANNEL) + 1
+            self.allocated.add(channel)
+            return channel
+
+    def release(self, channel: int):
+        with self.lock:
+            self.allocated.discard(channel)
+
+
+def make_bucket(rate_limit: Optional[Dict], now: float) -> Optional[TokenBucket]:
+    """Bucket for a relay_setup "rate_limit" ({"bps": bytes/s, "burst": bytes}), if any."""
+    if not rate_limit or not rate_limit.get("bps"):
+        return None
+    return TokenBucket(rate_limit["bps"], rate_limit.get("burst") or rate_limit["bps"], now)
+
+
+def _accepts(side: Dict, addr: Tuple[str, int]) -> bool:
+    """
+    Whether a side that hasn't learned its peer's address may learn `addr`:
+    only from the IP the server sees the peer at, when it said. The port isn't
+    checked as a NAT may map the peer's socket to a new one towards the relay.
+    """
+    host = side.get("host")
+    return host is None or host == addr[0]
+
+
+def _sides(session: Dict):
+    """A session's sides: its two peers, or every member of a group."""
+    return session["members"].values() if session.get("group") else (session["peer_a"], session["peer_b"])
+
+
+class RelayEngine:
+    """
+    Relay data plane that multiplexes every relay session socket on a single
+    selector loop, so the number of threads stays constant as sessions grow.
+
+    Given `mux_sock`, sessions can instead share that one socket: each side of
+    a session is assigned a channel number (see wire.frame_channel) and packets
+    are routed by a dict lookup, so sessions cost no descriptors or ports.
+
+    Busy sessions share the loop by deficit round robin: each round a session
+    may forward QUANTUM bytes (carried over while it stays backlogged), so a
+    bulk transfer can't hold up interactive sessions for longer than one
+    quantum per busy session. With per-session sockets the kernel queues each
+    session separately and the quantum bounds how much is read from each. The
+    shared socket is a single FIFO: a session's frames are sent straight from
+    the receive buffer until it has sent a quantum in one drain of the socket,
+    and only past that copied into a per-session queue (at most QUEUE_LIMIT
+    datagrams, the excess is dropped) that is sent from in rounds. A session may also carry a token bucket ("rate_limit" in
+    relay_setup/relay_assign); datagrams over it are dropped and counted.
+
+    A group session ({"group": True, "members": {peer_id: side}}) has a socket
+    or channel per member instead of two sides, and every datagram a member
+    sends is copied to all the others from the one receive buffer, so each
+    member sends once however many receive it. Members join and leave while
+    the session runs (add_member/remove_member). The rate limit is charged
+    per copy sent.
+
+    Given `capture`, every datagram received is also written to that trace.
+    """
+
+    # Max datagrams drained from one socket before moving on to the others
+    BATCH = 64
+    # Bytes a busy session may forward per round; 0 forwards first come, first served
+    QUANTUM = 16 * 1024
+    # Datagrams a single-port session may have waiting for its turn
+    QUEUE_LIMIT = 64
+    # Seconds without traffic in either direction before a session is dropped
+    SESSION_IDLE_TTL = 300.0
+
+    def __init__(self, owner_id: str, pool: BufferPool, mux_sock: Optional[socket.socket] = None,
+                 capture: Optional[Capture] = None):
+        self.owner_id = owner_id
+        self.capture = capture
+        self.selector = selectors.DefaultSelector()
+        # Only the loop thread reads, so a single buffer serves every session
+        self.receiver = Receiver(pool)
+        self.running = False
+        self.thread = None
+
+        # session_id -> session dict (the same objects stored in Peer.relay_sessions)
+        self.sessions: Dict[str, Dict] = {}
+
+        # Single-port mode: channel -> (session_id, from_peer_key, to_peer_key),
+        # or (session_id, member peer_id, None) in a group.
+        # Channels are handed out by assign_channels() on the caller's thread and
+        # only become routable once the session is added on the loop thread.
+        self.mux_sock = mux_sock
+        self.channels: Dict[int, Tuple[str, str, Optional[str]]] = {}
+        self.channel_ids = ChannelAllocator()
+        if mux_sock is not None:
+            mux_sock.setblocking(False)
+            self.selector.register(mux_sock, selectors.EVENT_READ, MUX)
+
+        # Totals of forwarded traffic, sampled by the relay's load reports;
+        # per-session counters live in each session dict. `limited` counts
+        # datagrams dropped for exceeding a session's rate limit.
+        self.packets = 0
+        self.bytes = 0
+        self.drops = 0
+        self.limited = 0
+
+        # Single-port sessions with queued datagrams, in round robin order
+        self.backlog: deque = deque()
+        # Drains of the shared socket so far; a session's "drain_bytes" count
+        # what it sent directly in drain number "drain"
+        self.drains = 0
+
+        # Idle-session expiry. Packets only stamp session["last_seen"]; the timer
+        # is re-armed lazily when it fires, which keeps the hot path cheap.
+        self.timers = TimingWheel(tick=1.0)
+        self.now = time.monotonic()
+        # Called from the loop thread with the session_id of each idle session dropped
+        self.on_session_expired: Optional[Callable[[str], None]] = None
+
+        # Sessions are added/removed from other threads; those requests are queued
+        # and the loop is woken up through a socketpair.
+        self._commands: List[Tuple[str, str, Dict]] = []
+        self._commands_lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def start(self):
+        """Start the relay loop thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the relay loop."""
+        self.running = False
+        self._wakeup()
+
+    def add_session(self, session_id: str, session: Dict):
+        """Start relaying for a session built by Peer._handle_relay_setup."""
+        self._submit("add", session_id, session)
+
+    def remove_session(self, session_id: str):
+        """Stop relaying for a session and close its sockets."""
+        self._submit("remove", session_id, {})
+
+    def set_rate_limit(self, session_id: str, rate_limit: Optional[Dict]):
+        """Replace a live session's rate limit (None lifts it)."""
+        self._submit("limit", session_id, {"rate_limit": rate_limit})
+
+    def add_member(self, session_id: str, peer_id: str, side: Dict):
+        """Start relaying a new member of a group session (its socket, or channel from assign_channels)."""
+        self._submit("join", session_id, {"peer_id": peer_id, "side": side})
+
+    def remove_member(self, session_id: str, peer_id: str):
+        """Stop relaying a member of a group session and close its socket."""
+        self._submit("leave", session_id, {"peer_id": peer_id})
+
+    @property
+    def mux_port(self) -> Optional[int]:
+        return self.mux_sock.getsockname()[1] if self.mux_sock is not None else None
+
+    def assign_channels(self, session_id: str, session: Dict) -> int:
+        """
+        Give both sides of a single-port session (or every member of a group)
+        a free channel number, stored as side["channel"], and return the port
+        to reach it on.
+        """
+        for side in _sides(session):
+            side["channel"] = self.channel_ids.allocate()
+        return self.mux_port
+
+    def session_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-session forwarded packets/bytes, drops and rate limited drops."""
+        return {sid: {"packets": s["packets"], "bytes": s["bytes"], "drops": s["drops"],
+                      "limited": s["limited"]}
+                for sid, s in list(self.sessions.items())}
+
+    def _submit(self, op: str, session_id: str, session: Dict):
+        with self._commands_lock:
+            self._commands.append((op, session_id, session))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # Loop is already pending a wakeup
+
+    def _apply_commands(self):
+        """Drain the wakeup socket and apply queued add/remove requests."""
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+        with self._commands_lock:
+            commands, self._commands = self._commands, []
+
+        for op, session_id, session in commands:
+            if op == "add":
+                self.sessions[session_id] = session
+                session.update(last_seen=self.now, packets=0, bytes=0, drops=0, limited=0,
+                               bucket=make_bucket(session.get("rate_limit"), self.now),
+                               queue=deque(), deficit=0, drain=0, drain_bytes=0)
+                self.timers.schedule(session_id, self.SESSION_IDLE_TTL)
+                if session.get("group"):
+                    for peer_id, side in session["members"].items():
+                        self._add_side(side, (session_id, peer_id, None))
+                    continue
+                for from_key, to_key in (("peer_a", "peer_b"), ("peer_b", "peer_a")):
+                    self._add_side(session[from_key], (session_id, from_key, to_key))
+            elif op == "remove":
+                self._close_session(session_id)
+            elif op == "limit" and session_id in self.sessions:
+                live = self.sessions[session_id]
+                live["rate_limit"] = session["rate_limit"]
+                live["bucket"] = make_bucket(session["rate_limit"], self.now)
+            elif op == "join":
+                live = self.sessions.get(session_id)
+                if live is None or not live.get("group") or session["peer_id"] in live["members"]:
+                    self._release_side(session["side"])
+                    continue
+                live["members"][session["peer_id"]] = session["side"]
+                self._add_side(session["side"], (session_id, session["peer_id"], None))
+            elif op == "leave" and session_id in self.sessions:
+                side = self.sessions[session_id]["members"].pop(session["peer_id"], None)
+                if side is not None:
+                    self._release_side(side)
+
+    def _add_side(self, side: Dict, route: Tuple[str, str, Optional[str]]):
+        """Make one side (or group member) of a session routable on the loop."""
+        side["deficit"] = 0
+        if "channel" in side:
+            self.channels[side["channel"]] = route
+            return
+        sock = side["socket"]
+        sock.setblocking(False)
+        # Looked up once, for the capture to record which port datagrams came in on
+        side["port"] = sock.getsockname()[1]
+        self.selector.register(sock, selectors.EVENT_READ, route)
+
+    def _release_side(self, side: Dict):
+        if "channel" in side:
+            self.channels.pop(side["channel"], None)
+            self.channel_ids.release(side["channel"])
+            return
+        sock = side["socket"]
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def _close_session(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if not session:
+            return False
+        self.timers.cancel(session_id)
+        session["queue"].clear()    # Its backlog entry is skipped once empty
+        for side in _sides(session):
+            self._release_side(side)
+        return True
+
+    def _expire_idle(self):
+        for session_id in self.timers.advance(self.now):
+            session = self.sessions.get(session_id)
+            if session is None:
+                continue
+            idle = self.now - session["last_seen"]
+            if idle < self.SESSION_IDLE_TTL:
+                self.timers.schedule(session_id, self.SESSION_IDLE_TTL - idle)
+                continue
+            self._close_session(session_id)
+            log.info("[RELAY %s] Session %s idle, closed", self.owner_id, session_id)
+            if self.on_session_expired:
+                self.on_session_expired(session_id)
+
+    def _run(self):
+        """Event loop: wait for readable session sockets and forward their datagrams."""
+        while self.running:
+            # Don't sleep while queued datagrams wait for their round
+            events = self.selector.select(0 if self.backlog else self.timers.tick)
+            self.now = time.monotonic()
+            self._expire_idle()
+            for key, _ in events:
+                if key.data is None:
+                    self._apply_commands()
+                elif key.data is MUX:
+                    self._forward_mux()
+                elif key.data[2] is None:
+                    self._forward_group(key.fileobj, key.data[0], key.data[1])
+                else:
+                    self._forward(key.fileobj, *key.data)
+            if self.backlog:
+                self._send_round()
+
+    def _forward(self, from_sock: socket.socket, session_id: str, from_peer_key: str, to_peer_key: str):
+        """
+        Drain one session socket, up to this round's quantum, and forward to the
+        other peer's known address. If we don't know the sender's address yet,
+        we learn it from the first inbound packet.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        side = session[from_peer_key]
+        to_sock = session[to_peer_key]["socket"]
+        bucket = session["bucket"]
+        # A fresh quantum less whatever the last round overspent
+        budget = side["deficit"] + self.QUANTUM if self.QUANTUM else float("inf")
+        # Checked once per batch so per-packet logging costs nothing when off
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        for _ in range(self.BATCH):
+            if budget <= 0:
+                break
+            try:
+                data, addr = self.receiver.recv(from_sock)
+            except BlockingIOError:
+                side["deficit"] = 0    # Drained: nothing carries over
+                return
+            except OSError as e:
+                log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e,
+                            extra={"rate_key": session_id})
+                return
+            if data is None:
+                session["drops"] += 1
+                self.drops += 1
+                log.warning("[RELAY %s] Dropped oversized datagram from %s", self.owner_id, addr,
+                            extra={"rate_key": session_id})
+                continue
+            if self.capture is not None:
+                self.capture.write(data, addr, side["port"], wire.peek_type(data))
+
+            budget -= len(data)
+            session["last_seen"] = self.now
+
+            # If we haven't learned the "from" peer's NAT address yet, store it
+            if not side["addr"]:
+                if not _accepts(side, addr):
+                    session["drops"] += 1
+                    self.drops += 1
+                    continue
+                side["addr"] = addr
+                log.info("[RELAY %s] Learned %s address: %s", self.owner_id, from_peer_key, addr)
+            elif addr != side["addr"]:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+
+            # Forward the packet if we know where to send it
+            to_addr = session[to_peer_key]["addr"]
+            if not to_addr:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            if bucket is not None and not bucket.take(len(data), self.now):
+                session["limited"] += 1
+                self.limited += 1
+                continue
+            try:
+                # `data` is a view into the receive buffer: forwarded without a copy
+                to_sock.sendto(data, to_addr)
+            except OSError as e:
+                session["drops"] += 1
+                self.drops += 1
+                log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e,
+                            extra={"rate_key": session_id})
+                continue
+            session["packets"] += 1
+            session["bytes"] += len(data)
+            self.packets += 1
+            self.bytes += len(data)
+            if debug:
+                log.debug("[RELAY %s] Relayed %s -> %s", self.owner_id, from_peer_key, to_peer_key,
+                          extra={"rate_key": session_id})
+        # Still backlogged: only an overspend carries into the next round
+        side["deficit"] = min(budget, 0)
+
+    def _forward_group(self, from_sock: socket.socket, session_id: str, peer_id: str):
+        """
+        Drain one group member's socket, up to this round's quantum, and send
+        each datagram on to every other member whose address is known, from
+        that member's own socket.
+        """
+        session = self.sessions.get(session_id)
+        side = session["members"].get(peer_id) if session is not None else None
+        if side is None:
+            return
+        bucket = session["bucket"]
+        budget = side["deficit"] + self.QUANTUM if self.QUANTUM else float("inf")
+        debug = log.isEnabledFor(logging.DEBUG)
+        # Members only join, leave or learn their address between batches
+        recipients = self._recipients(session, side)
+
+        for _ in range(self.BATCH):
+            if budget <= 0:
+                break
+            try:
+                data, addr = self.receiver.recv(from_sock)
+            except BlockingIOError:
+                side["deficit"] = 0
+                return
+            except OSError as e:
+                log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e,
+                            extra={"rate_key": session_id})
+                return
+            if data is None:
+                session["drops"] += 1
+                self.drops += 1
+                log.warning("[RELAY %s] Dropped oversized datagram from %s", self.owner_id, addr,
+                            extra={"rate_key": session_id})
+                continue
+            if self.capture is not None:
+                self.capture.write(data, addr, side["port"], wire.peek_type(data))
+
+            budget -= len(data)
+            session["last_seen"] = self.now
+            if not side["addr"]:
+                if not _accepts(side, addr):
+                    session["drops"] += 1
+                    self.drops += 1
+                    continue
+                side["addr"] = addr
+                log.info("[RELAY %s] Learned %s address: %s", self.owner_id, peer_id, addr)
+            elif addr != side["addr"]:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+
+            if not recipients:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            if bucket is not None and not bucket.take(len(data) * len(recipients), self.now):
+                session["limited"] += 1
+                self.limited += 1
+                continue
+            for to_side in recipients:
+                try:
+                    # Every copy is sent from the same receive buffer
+                    to_side["socket"].sendto(data, to_side["addr"])
+                except OSError as e:
+                    session["drops"] += 1
+                    self.drops += 1
+                    log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e,
+                                extra={"rate_key": session_id})
+                    continue
+                session["packets"] += 1
+                session["bytes"] += len(data)
+                self.packets += 1
+                self.bytes += len(data)
+            if debug:
+                log.debug("[RELAY %s] Relayed %s to %s members", self.owner_id, peer_id, len(recipients),
+                          extra={"rate_key": session_id})
+        side["deficit"] = min(budget, 0)
+
+    @staticmethod
+    def _recipients(session: Dict, side: Dict) -> List[Dict]:
+        """The other members of a group that a datagram from `side` can be sent to."""
+        return [member for member in session["members"].values() if member is not side and member["addr"]]
+
+    def _forward_mux(self):
+        """
+        Drain the shared socket, routing each channel frame to the other side of
+        its session. A channel is bound to the first address that uses it from
+        the peer's host (see _accepts); frames from anywhere else are dropped so
+        channels can't be hijacked.
+        A session's frames are sent on directly until it has sent QUANTUM bytes
+        in this drain; after that they are queued for _send_round().
+        """
+        sock = self.mux_sock
+        debug = log.isEnabledFor(logging.DEBUG)
+        self.drains += 1
+
+        for _ in range(self.BATCH):
+            try:
+                data, addr = self.receiver.recv(sock)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e)
+                return
+
+            if data is not None and self.capture is not None:
+                self.capture.write(data, addr, self.mux_port, wire.peek_type(data))
+            route = self.channels.get(wire.channel_of(data)) if data is not None else None
+            if route is None:
+                self.drops += 1
+                log.warning("[RELAY %s] Dropped datagram from %s: no such channel", self.owner_id, addr,
+                            extra={"rate_key": addr})
+                continue
+            session_id, from_peer_key, to_peer_key = route
+            session = self.sessions[session_id]
+            side = session[from_peer_key] if to_peer_key is not None else session["members"][from_peer_key]
+
+            from_addr = side["addr"]
+            if from_addr is None and _accepts(side, addr):
+                side["addr"] = addr
+                log.info("[RELAY %s] Learned %s address: %s", self.owner_id, from_peer_key, addr)
+            elif from_addr != addr:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            session["last_seen"] = self.now
+            if to_peer_key is None:
+                self._replicate_mux(session, session_id, side, data, debug)
+                continue
+
+            to_addr = session[to_peer_key]["addr"]
+            if not to_addr:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            bucket = session["bucket"]
+            if bucket is not None and not bucket.take(len(data), self.now):
+                session["limited"] += 1
+                self.limited += 1
+                continue
+            queue = session["queue"]
+            if not queue and self._within_quantum(session, len(data)):
+                self._send_mux(session, session_id, data, to_addr, debug)
+                continue
+            if len(queue) >= self.QUEUE_LIMIT:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            if not queue:
+                self.backlog.append(session_id)
+            # The receive buffer is reused for the next datagram, so queue a copy
+            queue.append((bytes(data), to_addr))
+
+    def _replicate_mux(self, session: Dict, session_id: str, side: Dict, data, debug: bool):
+        """Send (or queue) a group member's frame to every other member with a known address."""
+        recipients = self._recipients(session, side)
+        if not recipients:
+            session["drops"] += 1
+            self.drops += 1
+            return
+        bucket = session["bucket"]
+        if bucket is not None and not bucket.take(len(data) * len(recipients), self.now):
+            session["limited"] += 1
+            self.limited += 1
+            return
+        queue = session["queue"]
+        if not queue and self._within_quantum(session, len(data) * len(recipients)):
+            for to_side in recipients:
+                self._send_mux(session, session_id, data, to_side["addr"], debug)
+            return
+        if not queue:
+            self.backlog.append(session_id)
+        # One copy of the frame, queued once per recipient; the queue holds
+        # QUEUE_LIMIT datagrams' worth for each
+        frame = bytes(data)
+        limit = self.QUEUE_LIMIT * len(recipients)
+        for to_side in recipients:
+            if len(queue) >= limit:
+                session["drops"] += 1
+                self.drops += 1
+                continue
+            queue.append((frame, to_side["addr"]))
+
+    def _within_quantum(self, session: Dict, size: int) -> bool:
+        """Charge `size` bytes to a session's direct sends this drain; False once it has had a quantum."""
+        if not self.QUANTUM:
+            return True
+        if session["drain"] != self.drains:
+            session["drain"] = self.drains
+            session["drain_bytes"] = 0
+        if session["drain_bytes"] >= self.QUANTUM:
+            return False
+        session["drain_bytes"] += size
+        return True
+
+    def _send_round(self):
+        """One deficit round robin pass over the single-port sessions with queued frames."""
+        debug = log.isEnabledFor(logging.DEBUG)
+        for _ in range(len(self.backlog)):
+            session_id = self.backlog.popleft()
+            session = self.sessions.get(session_id)
+            if session is None or not session["queue"]:
+                continue
+            queue = session["queue"]
+            deficit = session["deficit"] + self.QUANTUM
+            while queue and len(queue[0][0]) <= deficit:
+                data, to_addr = queue.popleft()
+                deficit -= len(data)
+                self._send_mux(session, session_id, data, to_addr, debug)
+            if queue:
+                session["deficit"] = deficit
+                self.backlog.append(session_id)
+            else:
+                session["deficit"] = 0
+
+    def _send_mux(self, session: Dict, session_id: str, data, to_addr: Tuple[str, int], debug: bool):
+        try:
+            # The frame keeps the sender's channel header; receivers skip it
+            self.mux_sock.sendto(data, to_addr)
+        except OSError as e:
+            session["drops"] += 1
+            self.drops += 1
+            log.warning("[RELAY %s] Error in relay: %s", self.owner_id, e,
+                        extra={"rate_key": session_id})
+            return
+        session["packets"] += 1
+        session["bytes"] += len(data)
+        self.packets += 1
+        self.bytes += len(data)
+        if debug:
+            log.debug("[RELAY %s] Relayed to %s", self.owner_id, to_addr, extra={"rate_key": session_id})
@@ -0,0 +1,352 @@
+import array
+import json
+import multiprocessing
+import selectors
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from .relay_engine import ChannelAllocator, RelayEngine, bind_mux_socket
+from ..common.bufpool import BufferPool
+from ..common.capture import Capture
+from ..common.log import configured_level, get_logger, setup_logging
+
+log = get_logger("relay")
+
+# Per-session counters a worker reports, in the order it sends them
+SESSION_FIELDS = ("packets", "bytes", "drops", "limited")
+
+
+# socket.send_fds/recv_fds need Python 3.9; the deployment image runs 3.8
+def _send_fds(sock: socket.socket, data: bytes, fds: List[int]):
+    """Send `data` with file descriptors `fds` attached (SCM_RIGHTS)."""
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+
+
+def _recv_fds(sock: socket.socket, bufsize: int, maxfds: int):
+    """Receive a message and up to `maxfds` descriptors sent with it; returns (data, fds)."""
+    fds = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(bufsize, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    return data, list(fds)
+
+
+class RelayWorkerPool:
+    """
+    Relay data plane spread over N worker processes, each running its own
+    RelayEngine, so relayed throughput is not capped by one core and the GIL.
+
+    The parent process keeps the signaling role: it binds the session sockets
+    (so relay_ready reports the real ports) and passes their file descriptors to
+    the least loaded worker over a Unix socket. Workers report traffic totals,
+    per-session counters and idle expiries back over the same socket.
+
+    In single-port mode (`mux_port` given) every worker gets its own shared
+    socket, bound to mux_port + index (or an ephemeral port for 0); channels
+    are numbered here so they are unique across workers.
+
+    A group session is added empty and its members follow one by one, each
+    with its own descriptor or channel, the same way members joining later do.
+
+    Exposes the same interface as RelayEngine so Peer can use either. With
+    `capture_path`, each worker writes its own trace to that path plus ".<index>".
+    """
+
+    # Seconds between worker stats reports
+    STATS_INTERVAL = 1.0
+    # Sessions per counters report, keeping each report well inside one datagram
+    SESSION_BATCH = 400
+
+    def __init__(self, owner_id: str, workers: int, pool: BufferPool,
+                 mux_port: Optional[int] = None, capture_path: Optional[str] = None):
+        self.owner_id = owner_id
+        self.capture_path = capture_path
+        self.max_datagram = pool.max_datagram
+        self.num_workers = workers
+        self.running = False
+
+        self.controls: List[socket.socket] = []
+        self.processes: List[multiprocessing.Process] = []
+        self.worker_sessions: List[int] = [0] * workers    # sessions per worker
+        self.session_worker: Dict[str, int] = {}           # session_id -> worker index
+        self.worker_totals = [(0, 0, 0, 0)] * workers      # (packets, bytes, drops, limited) per worker
+        # session_id -> [packets, bytes, drops, limited] as of each worker's last complete report,
+        # and the batches of the report in progress
+        self.worker_session_stats: List[Dict[str, List[int]]] = [{} for _ in range(workers)]
+        self.pending_session_stats: List[Dict[str, List[int]]] = [{} for _ in range(workers)]
+        self.lock = threading.Lock()
+
+        self.mux = mux_port is not None
+        self.mux_base_port = mux_port or 0
+        self.mux_ports: List[int] = []                      # shared socket port per worker
+        self.session_channels: Dict[str, Dict[str, int]] = {}  # session_id -> side or member -> channel
+        self.channel_ids = ChannelAllocator()
+
+        self.on_session_expired: Optional[Callable[[str], None]] = None
+
+    @property
+    def packets(self) -> int:
+        return sum(t[0] for t in self.worker_totals)
+
+    @property
+    def bytes(self) -> int:
+        return sum(t[1] for t in self.worker_totals)
+
+    @property
+    def drops(self) -> int:
+        return sum(t[2] for t in self.worker_totals)
+
+    @property
+    def limited(self) -> int:
+        return sum(t[3] for t in self.worker_totals)
+
+    def session_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-session counters as of the workers' last reports, for sessions still relayed."""
+        with self.lock:
+            live = set(self.session_worker)
+        return {sid: dict(zip(SESSION_FIELDS, counts))
+                for stats in self.worker_session_stats for sid, counts in stats.items() if sid in live}
+
+    def start(self):
+        """Fork the workers and start the thread collecting their reports."""
+        self.running = True
+        for index in range(self.num_workers):
+            parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            mux_sock = None
+            if self.mux:
+                mux_sock = bind_mux_socket(self.mux_base_port + index if self.mux_base_port else 0)
+                self.mux_ports.append(mux_sock.getsockname()[1])
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(child_end, f"{self.owner_id}/w{index}", self.max_datagram, self.STATS_INTERVAL,
+                      configured_level(), mux_sock,
+                      f"{self.capture_path}.{index}" if self.capture_path else None, self.SESSION_BATCH),
+                daemon=True)
+            process.start()
+            child_end.close()
+            if mux_sock is not None:
+                mux_sock.close()    # The worker has its own copy
+            self.controls.append(parent_end)
+            self.processes.append(process)
+
+        threading.Thread(target=self._collect_reports, daemon=True).start()
+        log.info("[RELAY %s] Started %s relay workers", self.owner_id, self.num_workers)
+
+    def stop(self):
+        self.running = False
+        for control in self.controls:
+            try:
+                control.send(json.dumps({"op": "stop"}).encode())
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=2)
+
+    @property
+    def mux_port(self) -> Optional[int]:
+        return self.mux_ports[0] if self.mux_ports else None
+
+    def assign_channels(self, session_id: str, session: Dict) -> int:
+        """
+        Place a single-port session on a worker now (or find the worker it is
+        on, for members joining a group) and return that worker's port.
+        """
+        index = self._place(session_id)
+        sides = session["members"] if session.get("group") else {"peer_a": session["peer_a"],
+                                                                  "peer_b": session["peer_b"]}
+        channels = {}
+        for key, side in sides.items():
+            side["channel"] = channels[key] = self.channel_ids.allocate()
+        with self.lock:
+            self.session_channels.setdefault(session_id, {}).update(channels)
+        return self.mux_ports[index]
+
+    def _place(self, session_id: str) -> int:
+        with self.lock:
+            index = self.session_worker.get(session_id)
+            if index is None:
+                index = min(range(self.num_workers), key=lambda i: self.worker_sessions[i])
+                self.worker_sessions[index] += 1
+                self.session_worker[session_id] = index
+            return index
+
+    def add_session(self, session_id: str, session: Dict):
+        """Hand a session's sockets (or channels) to the least loaded worker."""
+        index = self._place(session_id)
+        if session.get("group"):
+            command = {"op": "add", "session_id": session_id, "group": True,
+                       "rate_limit": session.get("rate_limit")}
+            self.controls[index].send(json.dumps(command).encode())
+            for peer_id, side in session["members"].items():
+                self.add_member(session_id, peer_id, side)
+            return
+        header = {"op": "add", "session_id": session_id,
+                  "peer_a": session["peer_a"]["id"], "peer_b": session["peer_b"]["id"],
+                  "hosts": [session["peer_a"].get("host"), session["peer_b"].get("host")],
+                  "rate_limit": session.get("rate_limit")}
+        if "channel" in session["peer_a"]:
+            header["channels"] = [session["peer_a"]["channel"], session["peer_b"]["channel"]]
+            self.controls[index].send(json.dumps(header).encode())
+            return
+
+        sock_a, sock_b = session["peer_a"]["socket"], session["peer_b"]["socket"]
+        _send_fds(self.controls[index], json.dumps(header).encode(), [sock_a.fileno(), sock_b.fileno()])
+        # The worker owns the descriptors now
+        sock_a.close()
+        sock_b.close()
+
+    def add_member(self, session_id: str, peer_id: str, side: Dict):
+        """Hand a group member's socket (or channel) to the worker relaying the group."""
+        index = self._place(session_id)
+        command = {"op": "join", "session_id": session_id, "peer_id": peer_id, "host": side.get("host")}
+        if "channel" in side:
+            command["channel"] = side["channel"]
+            self.controls[index].send(json.dumps(command).encode())
+            return
+        _send_fds(self.controls[index], json.dumps(command).encode(), [side["socket"].fileno()])
+        side["socket"].close()
+
+    def remove_member(self, session_id: str, peer_id: str):
+        with self.lock:
+            index = self.session_worker.get(session_id)
+            channel = self.session_channels.get(session_id, {}).pop(peer_id, None)
+        if channel is not None:
+            self.channel_ids.release(channel)
+        if index is not None:
+            command = {"op": "leave", "session_id": session_id, "peer_id": peer_id}
+            self.controls[index].send(json.dumps(command).encode())
+
+    def remove_session(self, session_id: str):
+        index = self._forget(session_id)
+        if index is not None:
+            self.controls[index].send(json.dumps({"op": "remove", "session_id": session_id}).encode())
+
+    def set_rate_limit(self, session_id: str, rate_limit: Optional[Dict]):
+        with self.lock:
+            index = self.session_worker.get(session_id)
+        if index is not None:
+            command = {"op": "limit", "session_id": session_id, "rate_limit": rate_limit}
+            self.controls[index].send(json.dumps(command).encode())
+
+    def _forget(self, session_id: str) -> Optional[int]:
+        with self.lock:
+            index = self.session_worker.pop(session_id, None)
+            if index is not None:
+                self.worker_sessions[index] -= 1
+            channels = self.session_channels.pop(session_id, {})
+        for channel in channels.values():
+            self.channel_ids.release(channel)
+        return index
+
+    def _collect_reports(self):
+        selector = selectors.DefaultSelector()
+        for index, control in enumerate(self.controls):
+            selector.register(control, selectors.EVENT_READ, index)
+
+        while self.running:
+            for key, _ in selector.select(1.0):
+                try:
+                    report = json.loads(key.fileobj.recv(65536))
+                except (OSError, ValueError):
+                    continue
+                if report["op"] == "stats":
+                    self.worker_totals[key.data] = (report["packets"], report["bytes"], report["drops"],
+                                                    report["limited"])
+                elif report["op"] == "sessions":
+                    pending = self.pending_session_stats[key.data]
+                    pending.update(report["stats"])
+                    if report["last"]:
+                        self.worker_session_stats[key.data] = pending
+                        self.pending_session_stats[key.data] = {}
+                elif report["op"] == "expired":
+                    self._forget(report["session_id"])
+                    if self.on_session_expired:
+                        self.on_session_expired(report["session_id"])
+
+
+def _worker_main(control: socket.socket, owner_id: str, max_datagram: int, stats_interval: float,
+                 log_level: Optional[int] = None, mux_sock: Optional[socket.socket] = None,
+                 capture_path: Optional[str] = None, session_batch: int = RelayWorkerPool.SESSION_BATCH):
+    """Worker process: run a RelayEngine fed with sessions by the parent."""
+    if log_level is not None:
+        # The parent's writer thread does not exist in this process
+        setup_logging(log_level)
+    capture = Capture(capture_path) if capture_path else None
+    engine = RelayEngine(owner_id, BufferPool(max_datagram), mux_sock, capture)
+
+    def report(message: Dict):
+        try:
+            control.send(json.dumps(message).encode())
+        except OSError:
+            pass
+
+    def report_stats():
+        report({"op": "stats", "packets": engine.packets, "bytes": engine.bytes,
+                "drops": engine.drops, "limited": engine.limited})
+        # Always at least one batch, so the parent drops sessions that have gone
+        sessions = list(engine.session_stats().items())
+        for start in range(0, max(len(sessions), 1), session_batch):
+            batch = sessions[start:start + session_batch]
+            report({"op": "sessions", "last": start + session_batch >= len(sessions),
+                    "stats": {sid: [stats[field] for field in SESSION_FIELDS] for sid, stats in batch}})
+
+    engine.on_session_expired = lambda session_id: report({"op": "expired", "session_id": session_id})
+    engine.start()
+
+    control.settimeout(stats_interval)
+    next_stats = time.monotonic() + stats_interval
+    while True:
+        if time.monotonic() >= next_stats:
+            report_stats()
+            next_stats = time.monotonic() + stats_interval
+        try:
+            data, fds = _recv_fds(control, 65536, 2)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        if not data:
+            break  # Parent went away
+
+        command = json.loads(data)
+        if command["op"] == "add" and command.get("group"):
+            engine.add_session(command["session_id"], {"group": True, "members": {},
+                                                       "rate_limit": command.get("rate_limit")})
+        elif command["op"] == "add" and "channels" in command:
+            channel_a, channel_b = command["channels"]
+            host_a, host_b = command["hosts"]
+            engine.add_session(command["session_id"], {
+                "peer_a": {"id": command["peer_a"], "channel": channel_a, "addr": None, "host": host_a},
+                "peer_b": {"id": command["peer_b"], "channel": channel_b, "addr": None, "host": host_b},
+                "rate_limit": command.get("rate_limit")
+            })
+        elif command["op"] == "add":
+            sock_a = socket.socket(fileno=fds[0])
+            sock_b = socket.socket(fileno=fds[1])
+            host_a, host_b = command["hosts"]
+            engine.add_session(command["session_id"], {
+                "peer_a": {"id": command["peer_a"], "socket": sock_a, "addr": None, "host": host_a},
+                "peer_b": {"id": command["peer_b"], "socket": sock_b, "addr": None, "host": host_b},
+                "rate_limit": command.get("rate_limit")
+            })
+        elif command["op"] == "join":
+            side = {"id": command["peer_id"], "addr": None, "host": command.get("host")}
+            if "channel" in command:
+                side["channel"] = command["channel"]
+            else:
+                side["socket"] = socket.socket(fileno=fds[0])
+            engine.add_member(command["session_id"], command["peer_id"], side)
+        elif command["op"] == "leave":
+            engine.remove_member(command["session_id"], command["peer_id"])
+        elif command["op"] == "remove":
+            engine.remove_session(command["session_id"])
+        elif command["op"] == "limit":
+            engine.set_rate_limit(command["session_id"], command["rate_limit"])
+        elif command["op"] == "stop":
+            break
+
+    engine.stop()
+    if capture is not None:
+        capture.close()
@@ -0,0 +1,443 @@
+"""
+Reliable, ordered byte streams between the two peers of a session.
+
+send_message() is a single datagram with no ordering or delivery guarantee.
+A Transport splits a payload into numbered segments carried in `stream`
+messages (a raw wire type, so relays forward them untouched like relay_data),
+and the receiver hands the data on in order as it arrives, holding only the
+segments that came early. Receivers acknowledge with
+the next segment they expect plus up to MAX_SACK_BLOCKS ranges they already
+hold beyond it (selective ACKs), so the sender only resends what is missing.
+
+The sender keeps a congestion window in segments (slow start, then additive
+increase, halved once per loss episode) capped by the window the receiver
+advertises. In the spirit of RACK, a segment counts as lost once something
+sent after it is acknowledged and either DUP_THRESH later sends have been or
+a quarter round trip has passed on top of the expected one; ordering by send
+time rather than seq catches lost retransmissions the same way. When ACKs
+stop for about two round trips the newest outstanding segment is resent (a
+tail loss probe) so its ACK can reveal the losses, and the retransmission
+timer (RFC 6298 estimator, exponential backoff) is the last resort.
+
+Every segment starts with a 10-byte header:
+
+        0      1       2           6                 10
+        +------+-------+-----------+-----------------+---------
+        | kind | flags | stream id | seq / cum. ack  | ...
+        +------+-------+-----------+-----------------+---------
+
+  DATA is followed by up to `segment_size` bytes of the stream; FLAG_FIN marks
+  the last segment. ACK carries the next expected seq, then the advertised
+  window (4 bytes) and (start, end) pairs of selectively acknowledged seqs.
+"""
+import io
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import BinaryIO, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from ..common.log import get_logger
+
+log = get_logger("peer")
+
+DATA = 1
+ACK = 2
+FLAG_FIN = 0x01
+
+SEGMENT = struct.Struct("!BBII")
+WINDOW = struct.Struct("!I")
+SACK_BLOCK = struct.Struct("!II")
+
+# Payload bytes per segment; keeps datagrams under a typical path MTU
+DEFAULT_SEGMENT_SIZE = 1200
+# Out-of-order segments a receiver buffers (and the most a sender has unacknowledged)
+RECV_WINDOW = 4096
+# Segments received before an ACK is sent (out-of-order, duplicate and final segments are acked at once)
+ACK_EVERY = 2
+MAX_SACK_BLOCKS = 8
+# Segments sent later that must be acknowledged before a missing one counts as lost
+DUP_THRESH = 3
+INITIAL_WINDOW = 10
+# Retransmission timeout bounds (seconds) and consecutive timeouts before giving up
+RTO_INITIAL = 1.0
+RTO_MIN = 0.2
+RTO_MAX = 5.0
+MAX_BACKOFFS = 6
+# Floor of the tail loss probe delay (seconds)
+PROBE_MIN = 0.01
+# Finished streams remembered so retransmitted final segments are still acked
+FINISHED_STREAMS = 256
+
+Source = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+class _Sender:
+    """One outgoing stream. run() blocks the caller; ACKs arrive on the message thread."""
+
+    def __init__(self, transport: "Transport", stream_id: int, reader: BinaryIO):
+        self.transport = transport
+        self.stream_id = stream_id
+        self.reader = reader
+        self.segment_size = transport.segment_size
+        self.pending = reader.read(self.segment_size)    # Read one segment ahead to spot the last
+        self.cond = threading.Condition()
+
+        self.next_seq = 0
+        self.snd_una = 0              # Lowest seq not cumulatively acknowledged
+        self.fin_seq: Optional[int] = None
+        self.unacked: Dict[int, bytes] = {}          # seq -> encoded segment
+        self.sacked: Set[int] = set()
+        # seq -> (send time, send order), oldest send first
+        self.in_flight: Dict[int, Tuple[float, int]] = {}
+        self.lost: Deque[int] = deque()
+        self.retransmitted: Set[int] = set()         # No RTT samples from these (Karn)
+        self.sends = 0
+        self.delivered_order = -1     # Latest send order acknowledged so far
+
+        self.cwnd = float(INITIAL_WINDOW)
+        self.ssthresh = float(RECV_WINDOW)
+        self.rwnd = RECV_WINDOW
+        self.recovery_point = -1
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = RTO_INITIAL
+        self.backoffs = 0
+        self.probed = False
+
+        self.bytes = 0
+        self.retransmits = 0
+        self.timeouts = 0
+        self.done = False
+        self.error: Optional[str] = None
+
+    def run(self) -> Dict:
+        start = time.monotonic()
+        with self.cond:
+            self._transmit(start)
+            while not self.done:
+                if self.error:
+                    raise ConnectionError(f"Stream {self.stream_id}: {self.error}")
+                now = time.monotonic()
+                if not self.in_flight:
+                    self._transmit(now)
+                if self.in_flight:
+                    deadline = next(iter(self.in_flight.values()))[0] + self.rto
+                    probe_at = self._probe_deadline()
+                    if probe_at is not None and probe_at < deadline:
+                        if now >= probe_at:
+                            self._probe(now)
+                            continue
+                        deadline = probe_at
+                    elif now >= deadline:
+                        self._on_timeout(now)
+                        continue
+                    self.cond.wait(deadline - now)
+                else:
+                    self.cond.wait(self.rto)
+        elapsed = max(time.monotonic() - start, 1e-9)
+        return {
+            "stream_id": self.stream_id,
+            "bytes": self.bytes,
+            "segments": self.next_seq,
+            "retransmits": self.retransmits,
+            "timeouts": self.timeouts,
+            "seconds": elapsed,
+            "throughput_bps": self.bytes * 8 / elapsed,
+            "srtt_ms": (self.srtt or 0.0) * 1000,
+        }
+
+    def fail(self, reason: str):
+        with self.cond:
+            self.error = reason
+            self.cond.notify()
+
+    def _next_segment(self) -> Optional[int]:
+        if self.fin_seq is not None:
+            return None
+        seq = self.next_seq
+        data, self.pending = self.pending, self.reader.read(self.segment_size)
+        flags = 0 if self.pending else FLAG_FIN
+        if flags:
+            self.fin_seq = seq
+        self.unacked[seq] = SEGMENT.pack(DATA, flags, self.stream_id, seq) + data
+        self.bytes += len(data)
+        self.next_seq += 1
+        return seq
+
+    def _transmit(self, now: float):
+        """Send retransmissions, then new segments, while the windows allow."""
+        while len(self.in_flight) < self.cwnd:
+            if self.lost:
+                seq = self.lost.popleft()
+                if seq not in self.unacked or seq in self.sacked or seq in self.in_flight:
+                    continue
+                self.retransmits += 1
+                self.retransmitted.add(seq)
+            elif self.next_seq < self.snd_una + self.rwnd:
+                seq = self._next_segment()
+                if seq is None:
+                    return
+            else:
+                return
+            self.in_flight[seq] = (now, self.sends)
+            self.sends += 1
+            self.transport.send(self.unacked[seq])
+
+    def on_ack(self, cum: int, window: int, blocks: List[Tuple[int, int]]):
+        now = time.monotonic()
+        with self.cond:
+            newly = 0
+            sample = None
+            if cum > self.snd_una:
+                for seq in range(self.snd_una, min(cum, self.next_seq)):
+                    if self.unacked.pop(seq, None) is None:
+                        continue
+                    if seq not in self.sacked:
+                        newly += 1
+                        sample = self._delivered(seq, now) or sample
+                    self.sacked.discard(seq)
+                    self.retransmitted.discard(seq)
+                self.snd_una = cum
+                self.backoffs = 0
+                self.probed = False
+            for start, end in blocks:
+                for seq in range(max(start, self.snd_una), min(end, self.next_seq)):
+                    if seq in self.sacked or seq not in self.unacked:
+                        continue
+                    self.sacked.add(seq)
+                    newly += 1
+                    sample = self._delivered(seq, now) or sample
+            self.rwnd = window
+            if sample is not None:
+                self._update_rto(sample)
+
+            # In flight, sent before something now acknowledged, and either
+            # DUP_THRESH sends or a reordering window older: lost
+            lost = []
+            reorder_deadline = now - 1.25 * (self.srtt or self.rto)
+            for seq, (sent, order) in self.in_flight.items():
+                if order >= self.delivered_order:
+                    break
+                if order + DUP_THRESH > self.delivered_order and sent > reorder_deadline:
+                    break
+                lost.append(seq)
+            for seq in lost:
+                del self.in_flight[seq]
+            self.lost.extend(lost)
+
+            if lost and self.snd_una > self.recovery_point:
+                self.ssthresh = max(self.cwnd / 2, 2.0)
+                self.cwnd = self.ssthresh
+                self.recovery_point = self.next_seq - 1
+            elif newly and self.snd_una > self.recovery_point:
+                if self.cwnd < self.ssthresh:
+                    self.cwnd += newly
+                else:
+                    self.cwnd += newly / self.cwnd
+                self.cwnd = min(self.cwnd, float(RECV_WINDOW))
+
+            if self.fin_seq is not None and self.snd_una > self.fin_seq:
+                self.done = True
+                self.cond.notify()
+                return
+            self._transmit(now)
+
+    def _delivered(self, seq: int, now: float) -> Optional[float]:
+        """Take an acknowledged segment out of flight; returns an RTT sample if it gives one."""
+        entry = self.in_flight.pop(seq, None)
+        if entry is None:
+            return None
+        sent, order = entry
+        if order > self.delivered_order:
+            self.delivered_order = order
+        return None if seq in self.retransmitted else now - sent
+
+    def _update_rto(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN), RTO_MAX)
+
+    def _probe_deadline(self) -> Optional[float]:
+        """When to send a tail loss probe, or None if one isn't due."""
+        if self.probed or self.srtt is None:
+            return None
+        last_sent = next(reversed(self.in_flight.values()))[0]
+        return last_sent + max(2 * self.srtt, PROBE_MIN)
+
+    def _probe(self, now: float):
+        """Resend the highest outstanding segment so its ACK reveals any earlier losses."""
+        self.probed = True
+        seq = max(self.in_flight)
+        del self.in_flight[seq]
+        self.in_flight[seq] = (now, self.sends)
+        self.sends += 1
+        self.retransmits += 1
+        self.retransmitted.add(seq)
+        self.transport.send(self.unacked[seq])
+
+    def _on_timeout(self, now: float):
+        """Retransmission timer fired: back off and resend everything still outstanding."""
+        self.backoffs += 1
+        self.timeouts += 1
+        self.probed = False
+        if self.backoffs > MAX_BACKOFFS:
+            self.error = "peer stopped acknowledging"
+            return
+        self.rto = min(self.rto * 2, RTO_MAX)
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = 1.0
+        self.recovery_point = self.next_seq - 1
+        self.lost.extend(sorted(self.in_flight))
+        self.in_flight.clear()
+        log.debug("[PEER %s] Stream %s: retransmission timeout, rto %.3fs", self.transport.owner_id,
+                  self.stream_id, self.rto)
+        self._transmit(now)
+
+
+class _Receiver:
+    """Reassembly state of one incoming stream; in-order data goes to `deliver` at once."""
+
+    def __init__(self, deliver: Callable[[bytes], None]):
+        self.deliver = deliver
+        self.next_seq = 0
+        self.bytes = 0
+        self.out_of_order: Dict[int, bytes] = {}
+        self.fin_seq: Optional[int] = None
+        self.unacked = 0
+
+    def on_data(self, seq: int, flags: int, data: bytes) -> bool:
+        """Store a segment. Returns True if it should be acknowledged right away."""
+        if flags & FLAG_FIN:
+            self.fin_seq = seq
+        if seq == self.next_seq:
+            self._deliver(data)
+            while self.next_seq in self.out_of_order:
+                self._deliver(self.out_of_order.pop(self.next_seq))
+            self.unacked += 1
+            return self.unacked >= ACK_EVERY or bool(self.out_of_order) or self.complete
+        if self.next_seq < seq < self.next_seq + RECV_WINDOW:
+            self.out_of_order[seq] = data
+        return True
+
+    def _deliver(self, data: bytes):
+        self.next_seq += 1
+        self.bytes += len(data)
+        self.deliver(data)
+
+    @property
+    def complete(self) -> bool:
+        return self.fin_seq is not None and self.next_seq > self.fin_seq
+
+    def sack_blocks(self) -> List[Tuple[int, int]]:
+        blocks: List[Tuple[int, int]] = []
+        for seq in sorted(self.out_of_order):
+            if blocks and blocks[-1][1] == seq:
+                blocks[-1] = (blocks[-1][0], seq + 1)
+            else:
+                blocks.append((seq, seq + 1))
+        if len(blocks) > MAX_SACK_BLOCKS:
+            # Keep the lowest holes precise and the highest seq for loss detection
+            blocks = blocks[:MAX_SACK_BLOCKS - 1] + blocks[-1:]
+        return blocks
+
+
+class Transport:
+    """
+    Streams in both directions over one session. `send` puts an encoded segment
+    on the wire; segments coming back are handed to handle(). Incoming data is
+    passed to `on_chunk(stream_id, data)` in order as it arrives, and
+    `on_stream(stream_id, size)` is called once a stream is complete.
+    """
+
+    def __init__(self, owner_id: str, send: Callable[[bytes], None],
+                 on_chunk: Optional[Callable[[int, bytes], None]] = None,
+                 on_stream: Optional[Callable[[int, int], None]] = None,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.owner_id = owner_id
+        self.send = send
+        self.on_chunk = on_chunk
+        self.on_stream = on_stream
+        self.segment_size = segment_size
+        self.senders: Dict[int, _Sender] = {}
+        self.receivers: Dict[int, _Receiver] = {}
+        # stream_id -> final cumulative ack, for re-acknowledging late retransmissions
+        self.finished: "OrderedDict[int, int]" = OrderedDict()
+        self.next_stream = random.getrandbits(31)
+        self.lock = threading.Lock()
+
+    def send_stream(self, source: Source) -> Dict:
+        """
+        Send bytes or the rest of a binary file object reliably. Blocks until the
+        other side has acknowledged all of it and returns transfer statistics;
+        raises ConnectionError if the other side stops acknowledging.
+        """
+        reader = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+        with self.lock:
+            stream_id = self.next_stream
+            self.next_stream = (self.next_stream + 1) & 0xFFFFFFFF
+        sender = _Sender(self, stream_id, reader)
+        self.senders[stream_id] = sender
+        try:
+            return sender.run()
+        finally:
+            del self.senders[stream_id]
+
+    def send_file(self, path: str) -> Dict:
+        with open(path, "rb") as f:
+            return self.send_stream(f)
+
+    def handle(self, segment: bytes):
+        """Process one segment from the other peer (called on the message thread)."""
+        if len(segment) < SEGMENT.size:
+            return
+        kind, flags, stream_id, seq = SEGMENT.unpack_from(segment)
+        if kind == ACK:
+            sender = self.senders.get(stream_id)
+            if sender is None or len(segment) < SEGMENT.size + WINDOW.size:
+                return
+            offset = SEGMENT.size
+            window, = WINDOW.unpack_from(segment, offset)
+            offset += WINDOW.size
+            blocks = [SACK_BLOCK.unpack_from(segment, i)
+                      for i in range(offset, len(segment) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
+            sender.on_ack(seq, window, blocks)
+        elif kind == DATA:
+            self._handle_data(stream_id, flags, seq, segment[SEGMENT.size:])
+
+    def _handle_data(self, stream_id: int, flags: int, seq: int, data: bytes):
+        if stream_id in self.finished:
+            self._ack(stream_id, self.finished[stream_id], RECV_WINDOW, [])
+            return
+        receiver = self.receivers.get(stream_id)
+        if receiver is None:
+            on_chunk = self.on_chunk
+            receiver = self.receivers[stream_id] = _Receiver(
+                (lambda data: on_chunk(stream_id, data)) if on_chunk else (lambda data: None))
+        if not receiver.on_data(seq, flags, data):
+            return
+        receiver.unacked = 0
+        self._ack(stream_id, receiver.next_seq, RECV_WINDOW - len(receiver.out_of_order),
+                  receiver.sack_blocks())
+        if receiver.complete:
+            del self.receivers[stream_id]
+            self.finished[stream_id] = receiver.next_seq
+            if len(self.finished) > FINISHED_STREAMS:
+                self.finished.popitem(last=False)
+            if self.on_stream:
+                self.on_stream(stream_id, receiver.bytes)
+
+    def _ack(self, stream_id: int, cum: int, window: int, blocks: List[Tuple[int, int]]):
+        ack = SEGMENT.pack(ACK, 0, stream_id, cum) + WINDOW.pack(window)
+        self.send(ack + b"".join(SACK_BLOCK.pack(start, end) for start, end in blocks))
+
+    def close(self, reason: str = "session closed"):
+        """Fail streams being sent and drop partially received ones."""
+        for sender in list(self.senders.values()):
+            sender.fail(reason)
+        self.receivers.clear()
+        self.finished.clear()
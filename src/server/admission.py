@@ -0,0 +1,142 @@
+"""
+Admission control for the signaling server's ingress.
+
+The server reads datagrams off its socket faster than it handles them and
+parks them here, so under load the backlog sits in a queue it controls
+rather than in the kernel's FIFO socket buffer. The queue is drained most
+urgent class first:
+
+  URGENT  messages that finish work already under way (acks, accept_connection,
+          relay_ready, punch results, relay switches, cluster traffic between nodes)
+  NORMAL  upkeep (keepalives, relay load and pool reports, stats)
+  NEW     messages that start new work (register, connect_request)
+
+It holds at most `limit` messages. When it is full an arrival pushes out the
+newest message of a less urgent class, or is shed itself if there is none.
+Registers and connects are also metered per source address with a token
+bucket, so one client flooding them can't fill the queue by itself.
+
+Shed messages are returned to the caller, which answers requests with a
+"busy" reply telling the sender when to try again. A source over its rate is
+told once per wait, not once per datagram, so a flood isn't answered in kind;
+the same goes for a source whose messages don't fit in the queue.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional, Tuple
+
+from ..common.ratelimit import TokenBucket
+
+URGENT, NORMAL, NEW = 0, 1, 2
+
+# Message type -> class; unlisted types are NORMAL
+PRIORITIES = {
+    "ack": URGENT,
+    "accept_connection": URGENT,
+    "relay_ready": URGENT,
+    "punch_result": URGENT,
+    "relay_switched": URGENT,
+    "session_closed": URGENT,
+    "cluster_heartbeat": URGENT,
+    "cluster_leave": URGENT,
+    "cluster_deliver": URGENT,
+    "register": NEW,
+    "connect_request": NEW,
+    "cluster_forward": NEW,
+}
+# Types metered per source. Forwards come from other cluster nodes, which
+# speak for many peers, so they are only subject to the queue limit.
+METERED = {"register", "connect_request"}
+
+# Messages queued before arrivals start to be shed
+QUEUE_LIMIT = 1024
+# Metered messages a single source address may send per second, and in a burst
+SOURCE_RATE = 20.0
+SOURCE_BURST = 40.0
+# Source addresses whose buckets are remembered (least recently seen go first)
+MAX_SOURCES = 65536
+# Seconds a sender shed for a full queue is told to wait before retrying
+RETRY_AFTER = 1.0
+
+Addr = Tuple[str, int]
+# (message, addr, reason, seconds to wait before retrying or None if the
+# sender was already told and should get no reply)
+Shed = Tuple[Dict, Addr, str, Optional[float]]
+
+
+class Admission:
+    """
+    Bounded priority queue of received messages with per-source rate limits.
+    Not thread-safe: the server's receive loop owns it.
+    """
+
+    def __init__(self, limit: int = QUEUE_LIMIT, source_rate: float = SOURCE_RATE,
+                 source_burst: float = SOURCE_BURST, clock: Callable[[], float] = time.monotonic):
+        self.limit = limit
+        self.source_rate = source_rate
+        self.source_burst = source_burst or source_rate
+        self.clock = clock
+        self.queues = (deque(), deque(), deque())
+        # addr -> [bucket (None until it sends a metered message), time until
+        # which it has been told to hold off]
+        self.sources: "OrderedDict[Addr, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.queues)
+
+    def offer(self, message: Dict, addr: Addr) -> Optional[Shed]:
+        """Queue a message; returns whatever had to be shed to stay within limits, if anything."""
+        msg_type = message.get("type")
+        level = PRIORITIES.get(msg_type, NORMAL)
+        if msg_type in METERED and self.source_rate > 0:
+            wait = self._meter(addr)
+            if wait:
+                return message, addr, "rate", self._tell(addr, wait)
+
+        if self.limit and len(self) >= self.limit:
+            lowest = max(i for i, q in enumerate(self.queues) if q)
+            if lowest <= level:
+                return message, addr, "queue", self._tell(addr, RETRY_AFTER)
+            # Tail drop: the newest of the least urgent class has waited least
+            shed_message, shed_addr = self.queues[lowest].pop()
+            self.queues[level].append((message, addr))
+            return shed_message, shed_addr, "queue", self._tell(shed_addr, RETRY_AFTER)
+        self.queues[level].append((message, addr))
+        return None
+
+    def pop(self) -> Optional[Tuple[Dict, Addr]]:
+        """The oldest message of the most urgent class waiting, or None."""
+        for queue in self.queues:
+            if queue:
+                return queue.popleft()
+        return None
+
+    def _source(self, addr: Addr) -> list:
+        source = self.sources.get(addr)
+        if source is None:
+            source = self.sources[addr] = [None, 0.0]
+            if len(self.sources) > MAX_SOURCES:
+                self.sources.popitem(last=False)
+        else:
+            self.sources.move_to_end(addr)
+        return source
+
+    def _meter(self, addr: Addr) -> float:
+        """0 if `addr` may start new work now, else seconds until it may."""
+        now = self.clock()
+        source = self._source(addr)
+        if source[0] is None:
+            source[0] = TokenBucket(self.source_rate, self.source_burst, now)
+        bucket = source[0]
+        if bucket.take(1, now):
+            return 0.0
+        return (1 - bucket.tokens) / self.source_rate
+
+    def _tell(self, addr: Addr, wait: float) -> Optional[float]:
+        """`wait` if `addr` should be told to hold off, None if it already was and hasn't waited yet."""
+        now = self.clock()
+        source = self._source(addr)
+        if now < source[1]:
+            return None
+        source[1] = now + wait
+        return wait
@@ -0,0 +1,191 @@
+"""
+Cluster membership and peer ownership for running several signaling servers.
+
+Every server is a node named "host:port" (the address peers and other nodes
+reach it on). Peer ids are mapped to nodes with a consistent-hash ring, so
+adding or removing a node only moves the peers in the ranges it takes over or
+gives up. A peer's owner holds its registry record; other nodes redirect it
+there and forward messages for it.
+
+Membership is kept by heartbeats: each node pings every configured node once
+per HEARTBEAT_INTERVAL, and a node that stays silent for NODE_TTL drops out of
+the ring. Only direct heartbeats bring a node in, so gossip about a dead node
+can't revive it.
+
+Node-to-node messages arrive on the public signaling port, so a node only
+accepts them from the address of a configured node (itself and its seeds).
+Source addresses are easy to forge over UDP; with a shared secret every
+message also carries an HMAC and a timestamp, and unsigned, badly signed or
+stale ones are dropped.
+"""
+import bisect
+import hashlib
+import hmac
+import json
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def parse_node(node: str) -> Tuple[str, int]:
+    host, port = node.rsplit(":", 1)
+    return host, int(port)
+
+
+def _resolve(node: str) -> Tuple[str, int]:
+    host, port = parse_node(node)
+    try:
+        return socket.gethostbyname(host), port
+    except OSError:
+        return host, port
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` points per node."""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self.nodes: Set[str] = set()
+        self.points: List[int] = []
+        self.owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.owners[index]
+
+
+class Cluster:
+    """This node's view of the cluster: who is alive and who owns which peer."""
+
+    # Seconds between heartbeats to every known node
+    HEARTBEAT_INTERVAL = 1.0
+    # Seconds without a heartbeat before a node leaves the ring
+    NODE_TTL = 3.5
+    # Seconds a signed message's timestamp may be off before it is refused as a replay
+    MAX_SKEW = 10.0
+
+    def __init__(self, node: str, seeds: Iterable[str] = (), vnodes: int = 64,
+                 secret: Optional[bytes] = None):
+        self.node = node
+        self.addr = parse_node(node)
+        # Nodes we heartbeat and accept cluster messages from: the seeds
+        self.known: Set[str] = set(seeds) - {node}
+        # (ip, port) -> configured node, to tell which node a datagram came from
+        self.node_addrs: Dict[Tuple[str, int], str] = {_resolve(n): n for n in self.known}
+        self.secret = secret
+        # node -> monotonic time of its last heartbeat
+        self.last_seen: Dict[str, float] = {}
+        self.next_heartbeat = 0.0
+        # Readers use whichever ring object is current; changes build a new one
+        self.ring = HashRing([node], vnodes)
+        self.vnodes = vnodes
+        self.lock = threading.Lock()
+
+    @property
+    def members(self) -> List[str]:
+        return sorted(self.ring.nodes)
+
+    def owner(self, peer_id: str) -> str:
+        return self.ring.owner(peer_id)
+
+    def is_local(self, peer_id: str) -> bool:
+        return self.ring.owner(peer_id) == self.node
+
+    def owner_addr(self, peer_id: str) -> Tuple[str, int]:
+        return parse_node(self.owner(peer_id))
+
+    def heartbeat_due(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        if now < self.next_heartbeat:
+            return False
+        self.next_heartbeat = now + self.HEARTBEAT_INTERVAL
+        return True
+
+    def heartbeat_targets(self) -> List[Tuple[str, int]]:
+        return [parse_node(node) for node in sorted(self.known)]
+
+    def sign(self, message: Dict) -> Dict:
+        """Stamp and MAC a message for other nodes (unchanged without a secret)"""
+        if self.secret is None:
+            return message
+        message = {**message, "ts": time.time()}
+        return {**message, "mac": self._mac(message)}
+
+    def sender(self, message: Dict, addr: Tuple[str, int]) -> Optional[str]:
+        """The configured node a cluster message came from, or None to drop it"""
+        node = self.node_addrs.get(addr)
+        if node is None:
+            return None
+        if self.secret is not None:
+            mac = message.get("mac")
+            unsigned = {k: v for k, v in message.items() if k != "mac"}
+            if not isinstance(mac, str) or not hmac.compare_digest(mac, self._mac(unsigned)):
+                return None
+            if abs(time.time() - message.get("ts", 0)) > self.MAX_SKEW:
+                return None
+        return node
+
+    def _mac(self, message: Dict) -> str:
+        body = json.dumps(message, sort_keys=True, separators=(",", ":")).encode()
+        return hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+
+    def heard_from(self, node: str) -> bool:
+        """Record a heartbeat. Returns True if the ring changed."""
+        with self.lock:
+            self.last_seen[node] = time.monotonic()
+            if node in self.ring.nodes:
+                return False
+            self._rebuild()
+            return True
+
+    def forget(self, node: str) -> bool:
+        """Drop a node that said it is leaving. Returns True if the ring changed."""
+        with self.lock:
+            self.last_seen.pop(node, None)
+            if node not in self.ring.nodes:
+                return False
+            self._rebuild()
+            return True
+
+    def expire(self, now: Optional[float] = None) -> bool:
+        """Drop nodes that stopped sending heartbeats. Returns True if the ring changed."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            dead = [n for n, seen in self.last_seen.items() if now - seen > self.NODE_TTL]
+            for node in dead:
+                del self.last_seen[node]
+            if not any(node in self.ring.nodes for node in dead):
+                return False
+            self._rebuild()
+            return True
+
+    def leave(self) -> bool:
+        """Take this node out of its own ring. Returns True if other nodes remain."""
+        with self.lock:
+            self.ring = HashRing(self.last_seen, self.vnodes)
+            return len(self.ring) > 0
+
+    def _rebuild(self):
+        self.ring = HashRing([self.node, *self.last_seen], self.vnodes)
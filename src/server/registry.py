@@ -1,9 +1,50 @@
 import threading
-from typing import Dict, Tuple, Optional
+import time
+from typing import Dict, FrozenSet, List, Set, Tuple, Optional
+from ..common.log import get_logger
+from ..common.timing_wheel import TimingWheel
+
+log = get_logger("registry")
+
+
+def session_members(session: Dict) -> Tuple[str, ...]:
+    """Peers a session carries traffic between: its group members, or its two peers."""
+    return session.get("members") or (session["peer_a"], session["peer_b"])
+
 
 class Registry:
+    """
+    In-memory peer/session store.
+
+    Writers serialize on `mutex`. Readers take no lock: every record is replaced
+    wholesale rather than mutated in place, and single dict lookups are atomic,
+    so a reader always sees either the old or the new record.
+
+    Nothing lives forever: peers expire PEER_TTL seconds after their last
+    register/keepalive/relay_load, pending connections after PENDING_TTL, and a
+    session goes away with either of its peers or its relay. Deadlines are kept
+    in a TimingWheel that the server advances through expire().
+
+    A draining relay gets no new sessions, and the ones it carries move to
+    other relays: a migrating session already counts against its new relay
+    and remembers the old one until both peers have switched, or for at most
+    MIGRATE_TTL seconds.
+
+    A group session relays between any number of members, each with its own
+    allocation on the relay. A named group is joined by asking for it by
+    name; members leave by expiring, and the session goes when the last does.
+    """
+
+    # Seconds without register/keepalive/relay_load before a peer is dropped
+    PEER_TTL = 35.0
+    # Seconds a connect_request may wait for accept_connection
+    PENDING_TTL = 30.0
+    # Seconds a migrating session waits for both peers to switch before the old relay lets go
+    MIGRATE_TTL = 10.0
+
     def __init__(self):
-        # peer_id -> { "addr": (ip, port), "is_relay": bool }
+        # peer_id -> { "addr": (ip, port), "is_relay": bool, "wire": int,
+        #              "acks": bool }   # acknowledges signaling (see common.retransmit)
         self.peers: Dict[str, Dict] = {}
 
         # session_id -> {
@@ -11,94 +52,323 @@ class Registry:
         #    "peer_b": str,
         #    "relay": str,      # relay's peer_id
         #    "status": str,
+        #    "wire": int,       # encoding between the two peers
         #    "ports": {         # optional: track the assigned ports
         #       "peer_a": int,
         #       "peer_b": int
-        #    }
+        #    },
+        #    "migrating_from": str,     # while moving: the relay it is leaving
+        #    "switched": frozenset,     # and the peers seen on the new relay
+        #    "members": tuple,          # group sessions: every member (peer_a and
+        #                               # peer_b are the first two, peer_b None if alone)
+        #    "group": str or None       # and the name it is joined by
         # }
+
         self.active_sessions: Dict[str, Dict] = {}
 
         # session_id -> {
         #   "from_peer": str,
         #   "to_peer": str,
-        #   "status": "pending"
+        #   "status": "pending" | "punching" | "relaying",
+        #   "from_wire": int or None,  # set when from_peer lives on another server
+        #   "from_addr": (ip, port) or None,
+        #   "wire": int                # once punching: encoding between the peers
         # }
         self.pending_connections: Dict[str, Dict] = {}
 
+        # Indexes kept in step with the tables above
+        self.addr_index: Dict[Tuple[str, int], str] = {}           # addr -> peer_id
+        self.pending_index: Dict[Tuple[str, str], str] = {}        # (from_peer, to_peer) -> session_id
+        self.relays: FrozenSet[str] = frozenset()                  # live relay peer_ids (copy-on-write)
+        self.draining: FrozenSet[str] = frozenset()                # relays taking no new sessions
+        self.migrations: Dict[str, Set[str]] = {}                  # relay -> session_ids moving off it
+        self.groups: Dict[str, str] = {}                           # group name -> session_id
+
+        # relay peer_id -> last "relay_load" report plus
+        #   "assigned": sessions placed on the relay since that report
+        #   "ts": when the report was received
+        self.relay_load: Dict[str, Dict] = {}
+
+        # relay peer_id -> warm allocations it advertised ("relay_pool") that
+        # haven't been handed out: {"id": str, "ports": [a, b]} or, on
+        # single-port relays, {"id": str, "port": int, "channels": [a, b]}
+        self.relay_pools: Dict[str, List[Dict]] = {}
+        # relay peer_id -> ids handed out that its last advertisement may still list
+        self.relay_pool_taken: Dict[str, Set[str]] = {}
+
+        # peer_id (peer or relay) -> session_ids it takes part in, for expiry
+        self.peer_sessions: Dict[str, Set[str]] = {}
+
+        # ("peer", peer_id) / ("pending", session_id) / ("punch", session_id) /
+        # ("migrate", session_id) -> deadline
+        self.timers = TimingWheel()
+        # Connections whose hole punching timed out, waiting for a relay
+        self.punch_timeouts: List[Dict] = []
+        # Migrations whose peers didn't both switch in time: {"session_id", "relay": old relay}
+        self.migration_timeouts: List[Dict] = []
+        # Members that expired out of groups still going: {"session_id", "peer_id", "relay"}
+        self.group_departures: List[Dict] = []
+
         self.mutex = threading.Lock()
 
-    def register_peer(self, peer_id: str, addr: Tuple[str, int], is_relay: bool = False) -> bool:
+    def register_peer(self, peer_id: str, addr: Tuple[str, int], is_relay: bool = False,
+                      wire: int = 0, acks: bool = False) -> bool:
         """Register a new peer or update existing peer's information."""
         with self.mutex:
+            old = self.peers.get(peer_id)
+            if old and old["addr"] != addr and self.addr_index.get(old["addr"]) == peer_id:
+                del self.addr_index[old["addr"]]
+
             self.peers[peer_id] = {
                 "addr": addr,
-                "is_relay": is_relay
+                "is_relay": is_relay,
+                "wire": wire,
+                "acks": acks
             }
+            self.addr_index[addr] = peer_id
+
+            if is_relay and peer_id not in self.relays:
+                self.relays = self.relays | {peer_id}
+            elif not is_relay and peer_id in self.relays:
+                self.relays = self.relays - {peer_id}
+                self.relay_load.pop(peer_id, None)
+                self._drop_relay_pool(peer_id)
+
+            self.timers.schedule(("peer", peer_id), self.PEER_TTL)
             return True
 
-    def get_peer_addr(self, peer_id: str) -> Optional[Tuple[str, int]]:
-        """Get a peer's address."""
+    def touch_peer(self, peer_id: str, addr: Optional[Tuple[str, int]] = None) -> bool:
+        """Refresh a peer's liveness (keepalive), following it if its address changed."""
         with self.mutex:
             peer = self.peers.get(peer_id)
-            return peer["addr"] if peer else None
+            if not peer:
+                return False
+            if addr and peer["addr"] != addr:
+                if self.addr_index.get(peer["addr"]) == peer_id:
+                    del self.addr_index[peer["addr"]]
+                self.peers[peer_id] = {**peer, "addr": addr}
+                self.addr_index[addr] = peer_id
+            self.timers.schedule(("peer", peer_id), self.PEER_TTL)
+            return True
+
+    def get_peer_addr(self, peer_id: str) -> Optional[Tuple[str, int]]:
+        """Get a peer's address."""
+        peer = self.peers.get(peer_id)
+        return peer["addr"] if peer else None
 
     def is_peer_relay(self, peer_id: str) -> bool:
         """Check if a peer is relay-capable."""
-        with self.mutex:
-            peer = self.peers.get(peer_id)
-            return peer["is_relay"] if peer else False
+        peer = self.peers.get(peer_id)
+        return peer["is_relay"] if peer else False
+
+    def get_peer_wire(self, peer_id: str) -> int:
+        """Get the wire version negotiated with a peer (0 = JSON)."""
+        peer = self.peers.get(peer_id)
+        return peer["wire"] if peer else 0
+
+    def peer_acks(self, peer_id: str) -> bool:
+        """Check if a peer acknowledges signaling messages, so they can be resent until it does."""
+        peer = self.peers.get(peer_id)
+        return peer["acks"] if peer else False
 
     def get_peer_id_by_addr(self, addr: Tuple[str, int]) -> Optional[str]:
         """Get peer ID from its address."""
-        with self.mutex:
-            for pid, pdata in self.peers.items():
-                if pdata["addr"] == addr:
-                    return pid
-        return None
+        return self.addr_index.get(addr)
 
     def get_available_relays(self) -> list:
         """Get a list of available relay peers."""
+        return list(self.relays)
+
+    def update_relay_load(self, peer_id: str, load: Dict) -> bool:
+        """Store a relay's self-reported load."""
         with self.mutex:
-            # You might add logic to filter out busy relays or select one behind full-cone NAT, etc.
-            return [peer_id for peer_id, data in self.peers.items() if data["is_relay"]]
+            if peer_id not in self.relays:
+                return False
+            # Relays don't send keepalives; their load reports keep them alive
+            self.timers.schedule(("peer", peer_id), self.PEER_TTL)
+            self.relay_load[peer_id] = {
+                "sessions": int(load.get("sessions", 0)),
+                "capacity": int(load.get("capacity", 0)),
+                "pps": float(load.get("pps", 0.0)),
+                "bps": float(load.get("bps", 0.0)),
+                "max_pps": float(load.get("max_pps", 0.0)),
+                "assigned": 0,
+                "ts": time.monotonic()
+            }
+            return True
 
-    def create_pending_connection(self, session_id: str, from_peer: str, to_peer: str) -> bool:
-        """Create a pending connection between two peers."""
+    def set_relay_pool(self, peer_id: str, allocations: List[Dict]) -> bool:
+        """
+        Replace a relay's warm allocations with the ones it just advertised,
+        leaving out any already handed out that it hadn't consumed when it sent them.
+        """
+        with self.mutex:
+            if peer_id not in self.relays:
+                return False
+            advertised = {alloc["id"] for alloc in allocations}
+            taken = self.relay_pool_taken.get(peer_id, set()) & advertised
+            self.relay_pool_taken[peer_id] = taken
+            self.relay_pools[peer_id] = [alloc for alloc in allocations if alloc["id"] not in taken]
+            return True
+
+    def take_relay_allocation(self, peer_id: str) -> Optional[Dict]:
+        """Hand out one of a relay's warm allocations, or None if it has none left."""
+        with self.mutex:
+            pool = self.relay_pools.get(peer_id)
+            if not pool:
+                return None
+            alloc = pool.pop()
+            self.relay_pool_taken.setdefault(peer_id, set()).add(alloc["id"])
+            return alloc
+
+    def get_relay_candidates(self) -> List[Dict]:
+        """
+        Current load view of every live relay that isn't draining, in the shape
+        relay policies expect. Relays that have not reported yet look idle with
+        unknown capacity.
+        """
+        candidates = []
+        for relay in self.relays - self.draining:
+            load = self.relay_load.get(relay)
+            if load is None:
+                candidates.append({"relay": relay, "sessions": 0, "capacity": 0, "pps": 0.0,
+                                   "bps": 0.0, "max_pps": 0.0})
+            else:
+                candidates.append({**load, "relay": relay,
+                                   "sessions": load["sessions"] + load["assigned"]})
+        return candidates
+
+    def create_pending_connection(self, session_id: str, from_peer: str, to_peer: str,
+                                  from_wire: Optional[int] = None,
+                                  from_addr: Optional[Tuple[str, int]] = None) -> bool:
+        """
+        Create a pending connection between two peers. `from_wire` and
+        `from_addr` describe the initiator when it is registered on another server.
+        """
         with self.mutex:
             self.pending_connections[session_id] = {
                 "from_peer": from_peer,
                 "to_peer": to_peer,
-                "status": "pending"
+                "status": "pending",
+                "from_wire": from_wire,
+                "from_addr": from_addr
             }
+            # A newer request between the same pair supersedes the older one
+            self.pending_index[(from_peer, to_peer)] = session_id
+            self.timers.schedule(("pending", session_id), self.PENDING_TTL)
             return True
 
     def get_pending_connection(self, from_peer: str, to_peer: str) -> Optional[Dict]:
         """Get a pending connection by from_peer and to_peer."""
-        with self.mutex:
-            for sid, conn in self.pending_connections.items():
-                if conn["from_peer"] == from_peer and conn["to_peer"] == to_peer:
-                    return {"session_id": sid, **conn}
+        sid = self.pending_index.get((from_peer, to_peer))
+        if sid is None:
             return None
+        conn = self.pending_connections.get(sid)
+        return {"session_id": sid, **conn} if conn else None
+
+    def start_punch(self, session_id: str, timeout: float, wire: int) -> bool:
+        """
+        Mark a pending connection as trying a direct path. If finish_punch()
+        isn't called within `timeout` seconds, expire() queues it for a relay
+        (see take_punch_timeouts()).
+        """
+        with self.mutex:
+            conn = self.pending_connections.get(session_id)
+            if not conn:
+                return False
+            self.pending_connections[session_id] = {**conn, "status": "punching", "wire": wire}
+            self.timers.schedule(("punch", session_id), timeout)
+            return True
+
+    def finish_punch(self, session_id: str) -> Optional[Dict]:
+        """The direct path came up: drop the pending connection and return it."""
+        with self.mutex:
+            conn = self.pending_connections.get(session_id)
+            if not conn or conn["status"] != "punching":
+                return None
+            self._remove_pending(session_id)
+            return {"session_id": session_id, **conn}
+
+    def take_punch_timeouts(self) -> List[Dict]:
+        """Pending connections whose direct attempt timed out since the last call."""
+        with self.mutex:
+            timed_out, self.punch_timeouts = self.punch_timeouts, []
+            return timed_out
 
-    def create_session(self, session_id: str, peer_a: str, peer_b: str, relay: str) -> bool:
-        """Create a new relay session."""
+    def create_session(self, session_id: str, peer_a: str, peer_b: str, relay: str,
+                       wire: int = 0) -> bool:
+        """Create a new relay session; `wire` is the encoding its peers use with each other."""
         with self.mutex:
-            if session_id in self.pending_connections:
-                del self.pending_connections[session_id]
+            self._remove_pending(session_id)
 
             self.active_sessions[session_id] = {
                 "peer_a": peer_a,
                 "peer_b": peer_b,
                 "relay": relay,
                 "status": "active",
+                "wire": wire,
                 "ports": {}
             }
+            for member in (peer_a, peer_b, relay):
+                self.peer_sessions.setdefault(member, set()).add(session_id)
+
+            # Count the session against the relay until its next load report
+            load = self.relay_load.get(relay)
+            if load:
+                self.relay_load[relay] = {**load, "assigned": load["assigned"] + 1}
             return True
 
+    def create_group(self, session_id: str, members: List[str], relay: str, wire: int = 0,
+                     name: Optional[str] = None) -> bool:
+        """Create a group session relaying between `members`, joinable by `name` if given."""
+        with self.mutex:
+            members = tuple(dict.fromkeys(members))
+            self.active_sessions[session_id] = {
+                "peer_a": members[0],
+                "peer_b": members[1] if len(members) > 1 else None,
+                "members": members,
+                "group": name,
+                "relay": relay,
+                "status": "active",
+                "wire": wire,
+                "ports": {}
+            }
+            for member in (*members, relay):
+                self.peer_sessions.setdefault(member, set()).add(session_id)
+            if name is not None:
+                self.groups[name] = session_id
+
+            load = self.relay_load.get(relay)
+            if load:
+                self.relay_load[relay] = {**load, "assigned": load["assigned"] + 1}
+            return True
+
+    def get_group(self, name: str) -> Optional[str]:
+        """Session id of a named group, or None if it has no members."""
+        return self.groups.get(name)
+
+    def join_group(self, session_id: str, peer_id: str) -> Optional[Dict]:
+        """Add a member to a group session; returns the updated record, or None if it is gone."""
+        with self.mutex:
+            session = self.active_sessions.get(session_id)
+            if not session or "members" not in session:
+                return None
+            if peer_id not in session["members"]:
+                members = session["members"] + (peer_id,)
+                session = self.active_sessions[session_id] = {**session, "members": members,
+                                                              "peer_b": members[1]}
+                self.peer_sessions.setdefault(peer_id, set()).add(session_id)
+            return {"session_id": session_id, **session}
+
+    def take_group_departures(self) -> List[Dict]:
+        """Members that left groups since the last call, for their relays to let go of."""
+        with self.mutex:
+            departed, self.group_departures = self.group_departures, []
+            return departed
+
     def get_session(self, session_id: str) -> Optional[Dict]:
         """Get session information."""
-        with self.mutex:
-            return self.active_sessions.get(session_id)
+        return self.active_sessions.get(session_id)
 
     def update_session_ports(self, session_id: str, ports: Dict[str, int]) -> bool:
         """
@@ -109,5 +379,209 @@ class Registry:
             session = self.active_sessions.get(session_id)
             if not session:
                 return False
-            session["ports"] = ports
+            self.active_sessions[session_id] = {**session, "ports": ports}
             return True
+
+    def drain_relay(self, relay: str) -> Optional[List[str]]:
+        """
+        Stop placing sessions on a relay and forget its warm allocations.
+        Returns the sessions still on it and not already moving, or None if
+        it isn't a live relay.
+        """
+        with self.mutex:
+            if relay not in self.relays:
+                return None
+            if relay not in self.draining:
+                self.draining = self.draining | {relay}
+            self._drop_relay_pool(relay)
+            return list(self.peer_sessions.get(relay, ()))
+
+    def start_migration(self, session_id: str, relay: str) -> Optional[Dict]:
+        """
+        Move a session onto `relay`. Until finish_migration() (or MIGRATE_TTL)
+        the record keeps the relay it is leaving in "migrating_from". Returns
+        the record as it was, or None if the session is gone. If the session
+        was already moving, the relay it was leaving is forgotten: the caller
+        tears it down.
+        """
+        with self.mutex:
+            session = self.active_sessions.get(session_id)
+            if not session:
+                return None
+            old_relay = session["relay"]
+            if session.get("migrating_from"):
+                self._forget_migration(session_id, session["migrating_from"])
+            self._unindex(old_relay, session_id)
+            self.peer_sessions.setdefault(relay, set()).add(session_id)
+            self.migrations.setdefault(old_relay, set()).add(session_id)
+            self.active_sessions[session_id] = {**session, "relay": relay, "ports": {},
+                                                "migrating_from": old_relay, "switched": frozenset()}
+            self.timers.schedule(("migrate", session_id), self.MIGRATE_TTL)
+            load = self.relay_load.get(relay)
+            if load:
+                self.relay_load[relay] = {**load, "assigned": load["assigned"] + 1}
+            return {"session_id": session_id, **session}
+
+    def peer_switched(self, session_id: str, peer_id: str) -> Optional[str]:
+        """
+        A peer of a migrating session reached its new relay. Once all of them
+        have, the migration is over: returns the relay left behind, else None.
+        """
+        with self.mutex:
+            session = self.active_sessions.get(session_id)
+            if not session or not session.get("migrating_from"):
+                return None
+            members = session_members(session)
+            if peer_id not in members:
+                return None
+            switched = session["switched"] | {peer_id}
+            if len(switched) < len(members):
+                self.active_sessions[session_id] = {**session, "switched": switched}
+                return None
+            return self._finish_migration(session_id)
+
+    def finish_migration(self, session_id: str) -> Optional[str]:
+        """End a session's migration whether or not its peers switched; returns the relay left behind."""
+        with self.mutex:
+            return self._finish_migration(session_id)
+
+    def migrating_off(self, relay: str) -> int:
+        """Sessions still moving off a relay."""
+        return len(self.migrations.get(relay, ()))
+
+    def take_migration_timeouts(self) -> List[Dict]:
+        """Migrations that ran out of time since the last call, already finished."""
+        with self.mutex:
+            timed_out, self.migration_timeouts = self.migration_timeouts, []
+            return timed_out
+
+    def remove_session(self, session_id: str) -> Optional[Dict]:
+        """Drop a session; returns its record (with "session_id") if it existed."""
+        with self.mutex:
+            return self._remove_session(session_id)
+
+    def release_peer(self, peer_id: str) -> bool:
+        """
+        Forget a peer that moved to another server, leaving its sessions in
+        place: they keep running and are closed through the new owner.
+        """
+        with self.mutex:
+            return self._drop_peer_record(peer_id)
+
+    def expire(self, now: Optional[float] = None) -> List[Dict]:
+        """
+        Drop every peer and pending connection whose TTL ran out.
+        Returns the sessions removed as a consequence, so the caller can tear
+        them down on their relays.
+        """
+        removed = []
+        with self.mutex:
+            fired = self.timers.advance(now)
+            for kind, key in fired:
+                if kind == "pending":
+                    self._remove_pending(key)
+                elif kind == "punch":
+                    conn = self.pending_connections.get(key)
+                    if conn and conn["status"] == "punching":
+                        self.pending_connections[key] = {**conn, "status": "relaying"}
+                        self.punch_timeouts.append({"session_id": key, **conn})
+                elif kind == "migrate":
+                    old_relay = self._finish_migration(key)
+                    if old_relay:
+                        self.migration_timeouts.append({"session_id": key, "relay": old_relay})
+                elif kind == "peer":
+                    removed.extend(self._remove_peer(key))
+        if fired:
+            log.debug("[REGISTRY] Expired %d timers, %d sessions", len(fired), len(removed))
+        return removed
+
+    def _remove_pending(self, session_id: str):
+        conn = self.pending_connections.pop(session_id, None)
+        if conn:
+            self.timers.cancel(("pending", session_id))
+            self.timers.cancel(("punch", session_id))
+            key = (conn["from_peer"], conn["to_peer"])
+            if self.pending_index.get(key) == session_id:
+                del self.pending_index[key]
+
+    def _remove_session(self, session_id: str) -> Optional[Dict]:
+        session = self.active_sessions.pop(session_id, None)
+        if not session:
+            return None
+        for member in (*session_members(session), session["relay"]):
+            self._unindex(member, session_id)
+        if session.get("group") is not None and self.groups.get(session["group"]) == session_id:
+            del self.groups[session["group"]]
+        if session.get("migrating_from"):
+            self._forget_migration(session_id, session["migrating_from"])
+        return {"session_id": session_id, **session}
+
+    def _unindex(self, member: str, session_id: str):
+        sessions = self.peer_sessions.get(member)
+        if sessions:
+            sessions.discard(session_id)
+            if not sessions:
+                del self.peer_sessions[member]
+
+    def _finish_migration(self, session_id: str) -> Optional[str]:
+        session = self.active_sessions.get(session_id)
+        if not session or not session.get("migrating_from"):
+            return None
+        old_relay = session["migrating_from"]
+        self._forget_migration(session_id, old_relay)
+        self.active_sessions[session_id] = {k: v for k, v in session.items()
+                                            if k not in ("migrating_from", "switched")}
+        return old_relay
+
+    def _forget_migration(self, session_id: str, old_relay: str):
+        self.timers.cancel(("migrate", session_id))
+        moving = self.migrations.get(old_relay)
+        if moving:
+            moving.discard(session_id)
+            if not moving:
+                del self.migrations[old_relay]
+
+    def _remove_peer(self, peer_id: str) -> List[Dict]:
+        if not self._drop_peer_record(peer_id):
+            return []
+        removed = []
+        for session_id in list(self.peer_sessions.get(peer_id, ())):
+            session = self.active_sessions.get(session_id)
+            if session and self._leave_group(session_id, session, peer_id):
+                continue
+            session = self._remove_session(session_id)
+            if session:
+                removed.append(session)
+        return removed
+
+    def _leave_group(self, session_id: str, session: Dict, peer_id: str) -> bool:
+        """Drop a member from a group that outlives it; False if the session should go instead."""
+        if "members" not in session or peer_id == session["relay"] or len(session["members"]) < 2:
+            return False
+        members = tuple(m for m in session["members"] if m != peer_id)
+        session = {**session, "members": members, "peer_a": members[0],
+                   "peer_b": members[1] if len(members) > 1 else None}
+        if "switched" in session:
+            session["switched"] = session["switched"] - {peer_id}
+        self.active_sessions[session_id] = session
+        self._unindex(peer_id, session_id)
+        self.group_departures.append({"session_id": session_id, "peer_id": peer_id, "relay": session["relay"]})
+        return True
+
+    def _drop_peer_record(self, peer_id: str) -> bool:
+        peer = self.peers.pop(peer_id, None)
+        if not peer:
+            return False
+        self.timers.cancel(("peer", peer_id))
+        if self.addr_index.get(peer["addr"]) == peer_id:
+            del self.addr_index[peer["addr"]]
+        if peer_id in self.relays:
+            self.relays = self.relays - {peer_id}
+            self.draining = self.draining - {peer_id}
+            self.relay_load.pop(peer_id, None)
+            self._drop_relay_pool(peer_id)
+        return True
+
+    def _drop_relay_pool(self, peer_id: str):
+        self.relay_pools.pop(peer_id, None)
+        self.relay_pool_taken.pop(peer_id, None)
@@ -0,0 +1,67 @@
+import random
+from typing import Dict, List, Optional
+
+# A candidate is the dict built by Registry.get_relay_candidates():
+# {
+#    "relay": str,          # relay's peer_id
+#    "sessions": int,       # last reported sessions + sessions assigned since
+#    "capacity": int,       # self-declared max sessions (0 = unknown)
+#    "pps": float,          # packets/s relayed at last report
+#    "bps": float,          # bytes/s relayed at last report
+#    "max_pps": float,      # self-declared packet budget (0 = unlimited)
+# }
+
+
+def load_ratio(candidate: Dict) -> float:
+    """Utilization of a relay in [0, inf); >= 1.0 means overloaded."""
+    ratio = 0.0
+    if candidate.get("capacity"):
+        ratio = candidate["sessions"] / candidate["capacity"]
+    if candidate.get("max_pps"):
+        ratio = max(ratio, candidate["pps"] / candidate["max_pps"])
+    return ratio
+
+
+class RelayPolicy:
+    """Picks the relay for a new session out of the non-overloaded candidates."""
+
+    def choose(self, candidates: List[Dict], peer_a: str, peer_b: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+class FirstAvailable(RelayPolicy):
+    """Original behavior: whichever relay comes first."""
+
+    def choose(self, candidates, peer_a, peer_b):
+        return candidates[0]["relay"] if candidates else None
+
+
+class LeastLoaded(RelayPolicy):
+    """Relay with the lowest utilization; ties are broken at random."""
+
+    def choose(self, candidates, peer_a, peer_b):
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: (load_ratio(c), c["sessions"], random.random()))["relay"]
+
+
+class PowerOfTwoChoices(RelayPolicy):
+    """
+    Sample two relays at random and keep the less loaded one. Avoids the herd
+    effect of LeastLoaded when many sessions are placed on the same stale report.
+    """
+
+    def choose(self, candidates, peer_a, peer_b):
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]["relay"]
+        first, second = random.sample(candidates, 2)
+        return min((first, second), key=lambda c: (load_ratio(c), c["sessions"]))["relay"]
+
+
+POLICIES = {
+    "first": FirstAvailable,
+    "least-loaded": LeastLoaded,
+    "p2c": PowerOfTwoChoices,
+}
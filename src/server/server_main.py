@@ -1,77 +1,368 @@
+import asyncio
 import socket
-import json
 import threading
+import time
 import uuid
-from typing import Dict, Tuple
-from .registry import Registry
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional
+from .admission import Admission, QUEUE_LIMIT, SOURCE_BURST, SOURCE_RATE
+from .cluster import Cluster, parse_node
+from .registry import Registry, session_members
+from .relay_policy import POLICIES, RelayPolicy, LeastLoaded, load_ratio
+from ..common import wire
+from ..common.bufpool import BufferPool, Receiver, DEFAULT_MAX_DATAGRAM
+from ..common.capture import Capture
+from ..common.log import get_logger, setup_logging
+from ..common.metrics import Metrics
+from ..common.retransmit import DedupeCache, Retransmitter, ack_for
+
+log = get_logger("server")
 
 class Server:
-    def __init__(self, host: str = "0.0.0.0", port: int = 50000):
+    # Seconds between registry expiry sweeps
+    EXPIRY_INTERVAL = 1.0
+    # Redirects a register may follow before a node accepts it regardless of
+    # ownership (guards against loops while nodes disagree about the ring)
+    MAX_REDIRECTS = 3
+    # Seconds peers get to punch a direct path before a relay is assigned
+    PUNCH_TIMEOUT = 2.0
+    # With admission control: datagrams pulled off the socket per wakeup, and
+    # queued messages handled before looking at the socket again. Reading
+    # faster than handling keeps the backlog in the admission queue.
+    READ_BATCH = 64
+    HANDLE_BATCH = 16
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 50000,
+                 relay_policy: Optional[RelayPolicy] = None,
+                 max_datagram: int = DEFAULT_MAX_DATAGRAM,
+                 cluster: Optional[Cluster] = None,
+                 punch_timeout: Optional[float] = None,
+                 session_rate: float = 0, session_burst: float = 0,
+                 admission: Optional[Admission] = None,
+                 capture: Optional[Capture] = None):
         self.host = host
         self.port = port
+        # 0 disables hole punching: every connection gets a relay right away
+        self.punch_timeout = self.PUNCH_TIMEOUT if punch_timeout is None else punch_timeout
+        # Bytes/s (and bucket depth) relays let each relayed session forward, 0 = unlimited
+        self.session_rate = session_rate
+        self.session_burst = session_burst
         self.registry = Registry()
+        self.relay_policy = relay_policy or LeastLoaded()
+        self.receiver = Receiver(BufferPool(max_datagram))
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.running = False
+        # Ingress queue with priorities and per-source limits; None handles
+        # every datagram as it is read
+        self.admission = admission
+        # Trace of every datagram received, for replaying elsewhere
+        self.capture = capture
+
+        # Clustered mode: this node owns the peers the hash ring maps to it.
+        # Relays owned by other nodes are learned from their heartbeats and
+        # kept in the registry so any node can place sessions on them.
+        self.cluster = cluster
+        self.remote_relays: Dict[str, str] = {}    # relay peer_id -> owning node
+        # Draining relay -> (where it asked from, sessions that had nowhere to go),
+        # until its other sessions have moved
+        self.drains: Dict[str, Tuple[Tuple[str, int], int]] = {}
+
+        # Acknowledged signaling: messages we resend until the peer acks them,
+        # and the requests we already handled (by request id) with our replies
+        self.retransmitter = Retransmitter(self._send, on_give_up=self._on_give_up)
+        self.seen_requests = DedupeCache()
+
+        # message type -> handler
+        self.handlers = {
+            "register": self._handle_register,
+            "connect_request": self._handle_connect_request,
+            "relay_ready": self._handle_relay_ready,
+            "accept_connection": self._handle_accept_connection,
+            "relay_load": self._handle_relay_load,
+            "relay_pool": self._handle_relay_pool,
+            "keepalive": self._handle_keepalive,
+            "session_closed": self._handle_session_closed,
+            "punch_result": self._handle_punch_result,
+            "relay_drain": self._handle_relay_drain,
+            "relay_switched": self._handle_relay_switched,
+            "stats": self._handle_stats,
+            "ack": self._handle_ack,
+        }
+        if cluster:
+            self.handlers.update({
+                "cluster_heartbeat": self._handle_cluster_heartbeat,
+                "cluster_leave": self._handle_cluster_leave,
+                "cluster_forward": self._handle_cluster_forward,
+                "cluster_deliver": self._handle_cluster_deliver,
+            })
+        self._init_metrics()
+
+    def _init_metrics(self):
+        """Per-type message counters/latency histograms and registry size gauges"""
+        self.metrics = Metrics("server")
+        self.message_metrics = {
+            msg_type: (
+                self.metrics.counter("messages_total", "Signaling messages handled", type=msg_type),
+                self.metrics.histogram("handler_seconds", "Handler latency", type=msg_type),
+            )
+            for msg_type in self.handlers
+        }
+        self.unknown_messages = self.metrics.counter("messages_total", "Signaling messages handled",
+                                                     type="unknown")
+
+        registry = self.registry
+        self.metrics.gauge("peers", "Registered peers and relays", fn=lambda: len(registry.peers))
+        self.metrics.gauge("relays", "Live relays", fn=lambda: len(registry.relays))
+        self.metrics.gauge("pending_connections", "Connections awaiting accept",
+                           fn=lambda: len(registry.pending_connections))
+        self.metrics.gauge("active_sessions", "Relay sessions", fn=lambda: len(registry.active_sessions))
+        self.metrics.gauge("truncated_datagrams", "Datagrams dropped for exceeding max size",
+                           fn=lambda: self.receiver.truncated)
+        self.metrics.gauge("unacked_messages", "Signaling messages awaiting an ack",
+                           fn=lambda: len(self.retransmitter))
+        self.metrics.gauge("retransmits", "Signaling messages resent for lack of an ack",
+                           fn=lambda: self.retransmitter.retransmits)
+        self.metrics.gauge("duplicate_requests", "Retransmitted requests answered without handling them again",
+                           fn=lambda: self.seen_requests.duplicates)
+        self.metrics.gauge("ingress_queue", "Messages waiting in the admission queue",
+                           fn=lambda: len(self.admission) if self.admission is not None else 0)
+        self.shed_messages = {
+            reason: self.metrics.counter("shed_messages_total", "Messages dropped by admission control",
+                                         reason=reason)
+            for reason in ("rate", "queue")
+        }
+        self.connection_paths = {
+            path: self.metrics.counter("connections_total", "Connections set up, by path", path=path)
+            for path in ("direct", "relayed", "group")
+        }
+        self.relay_allocations = {
+            source: self.metrics.counter("relay_allocations_total",
+                                         "Relay sessions, by warm pool or on-demand setup", source=source)
+            for source in ("pool", "setup")
+        }
+        self.metrics.gauge("draining_relays", "Relays taking no new sessions",
+                           fn=lambda: len(registry.draining))
+        self.migrations = {
+            outcome: self.metrics.counter("migrations_total", "Sessions moved off draining relays, by outcome",
+                                          outcome=outcome)
+            for outcome in ("switched", "forced", "closed", "stranded")
+        }
+        if self.cluster:
+            self.metrics.gauge("cluster_nodes", "Nodes in the hash ring", fn=lambda: len(self.cluster.ring))
 
     def start(self):
         """Start the server"""
         self.sock.bind((self.host, self.port))
         self.running = True
-        print(f"[SERVER] Started on {self.host}:{self.port}")
+        log.info("[SERVER] Started on %s:%s", self.host, self.port)
 
-        while self.running:
+        # Wake up periodically even when idle so expiry keeps running, and in
+        # time for the next resend of an unacknowledged message
+        next_expiry = time.monotonic() + self.EXPIRY_INTERVAL
+        try:
+            while self.running:
+                try:
+                    if time.monotonic() >= next_expiry:
+                        self._expire()
+                        next_expiry = time.monotonic() + self.EXPIRY_INTERVAL
+                    self.retransmitter.poll()
+                    due = self.retransmitter.next_due()
+                    if self.admission is not None and len(self.admission):
+                        self.sock.settimeout(0)    # Queued work waits; only look at the socket
+                    else:
+                        self.sock.settimeout(self.EXPIRY_INTERVAL if due is None else max(due, 0.001))
+                    try:
+                        self._ingest(*self.receiver.recv(self.sock))
+                        if self.admission is not None:
+                            self.sock.settimeout(0)
+                            self._read_more()
+                    except (socket.timeout, BlockingIOError):
+                        pass
+                    if self.admission is not None:
+                        self._handle_queued(self.HANDLE_BATCH)
+                except Exception as e:
+                    log.error("[SERVER] Error handling message: %s", e)
+        finally:
+            self._leave_cluster()
+            if self.capture is not None:
+                self.capture.close()
+
+    def _ingest(self, data, addr: Tuple[str, int]):
+        """Decode a datagram (None if it was oversized) and queue it for handling, or shed it"""
+        if data is None:
+            log.warning("[SERVER] Dropped oversized datagram from %s", addr, extra={"rate_key": addr})
+            return
+        try:
+            message = wire.decode(data)
+        except Exception as e:
+            log.error("[SERVER] Error handling message: %s", e)
+            if self.capture is not None:
+                self.capture.write(data, addr, self.port, "")
+            return
+        if self.capture is not None:
+            self.capture.write(data, addr, self.port, message.get("type", ""))
+        if self.admission is None:
+            self._run_handler(message, addr)
+            return
+        shed = self.admission.offer(message, addr)
+        if shed:
+            self._shed(*shed)
+
+    def _read_more(self):
+        """Queue datagrams already waiting on the (non-blocking) socket, up to READ_BATCH"""
+        for _ in range(self.READ_BATCH):
             try:
-                data, addr = self.sock.recvfrom(1024)
-                message = json.loads(data.decode())
-                self._handle_message(message, addr)
-            except Exception as e:
-                print(f"[SERVER] Error handling message: {e}")
+                data, addr = self.receiver.recv(self.sock)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.warning("[SERVER] Socket error: %s", e)
+                return
+            self._ingest(data, addr)
+
+    def _handle_queued(self, limit: int) -> bool:
+        """Handle up to `limit` queued messages, most urgent first; True if more are waiting"""
+        for _ in range(limit):
+            item = self.admission.pop()
+            if item is None:
+                return False
+            self._run_handler(*item)
+        return len(self.admission) > 0
+
+    def _run_handler(self, message: Dict, addr: Tuple[str, int]):
+        self._handle_safely(message, addr)
+
+    def _handle_safely(self, message: Dict, addr: Tuple[str, int]):
+        try:
+            self._handle_message(message, addr)
+        except Exception as e:
+            log.error("[SERVER] Error handling message: %s", e)
+
+    def _shed(self, message: Dict, addr: Tuple[str, int], reason: str, retry_after: Optional[float]):
+        """Drop a message admission control refused; a request gets told when to retry"""
+        self.shed_messages[reason].inc()
+        log.debug("[SERVER] Shed %s from %s (%s)", message.get("type"), addr, reason,
+                  extra={"rate_key": addr})
+        rid = message.get("rid")
+        if rid is not None and retry_after is not None:
+            self._send({"type": "busy", "busy": rid, "retry_after": round(retry_after, 3)}, addr)
 
     def _handle_message(self, message: Dict, addr: Tuple[str, int]):
         """Handle incoming messages"""
         msg_type = message.get("type")
-        print(f"[SERVER] Received {msg_type} from {addr}")
-        
-        if msg_type == "register":
-            self._handle_register(message, addr)
+        log.debug("[SERVER] Received %s from %s", msg_type, addr)
+
+        handler = self.handlers.get(msg_type)
+        if handler is None:
+            self.unknown_messages.inc()
+            log.warning("[SERVER] Unknown message type: %s", msg_type)
+            return
+        if msg_type.startswith("cluster_"):
+            node = self.cluster.sender(message, addr)
+            if node is None or message.get("node", node) != node:
+                log.warning("[SERVER] Dropped %s from %s: not from a cluster node", msg_type, addr,
+                            extra={"rate_key": addr})
+                return
 
-        elif msg_type == "connect_request":
-            self._handle_connect_request(message, addr)
+        count, latency = self.message_metrics[msg_type]
+        start = time.perf_counter()
+        try:
+            self._handle_request(handler, message, addr)
+        finally:
+            count.inc()
+            latency.observe(time.perf_counter() - start)
 
-        elif msg_type == "relay_ready":
-            self._handle_relay_ready(message, addr)
+    def _handle_request(self, handler, message: Dict, addr: Tuple[str, int]):
+        """
+        Run a handler. A request with an id is handled once: retransmissions
+        get the replies the first copy got, and requests without a reply get a
+        bare ack.
+        """
+        rid = message.get("rid")
+        if rid is None:
+            handler(message, addr)
+            return
+        replies, duplicate = self.seen_requests.check(rid)
+        if duplicate:
+            log.debug("[SERVER] Duplicate %s %s from %s", message.get("type"), rid, addr)
+            for reply in list(replies):
+                self._send(reply, addr)
+            return
+        handler(message, addr)
+        if not replies:
+            ack = ack_for(rid)
+            replies.append(ack)
+            self._send(ack, addr)
 
-        elif msg_type == "accept_connection":
-            self._handle_accept_connection(message, addr)
+    def _handle_ack(self, message: Dict, addr: Tuple[str, int]):
+        """A peer or relay received a message we are resending"""
+        self.retransmitter.ack(message["ack"])
 
-        else:
-            print(f"[SERVER] Unknown message type: {msg_type}")
+    def _on_give_up(self, message: Dict, addr: Tuple[str, int]):
+        log.warning("[SERVER] No ack for %s to %s, giving up", message.get("type"), addr)
+
+    def _handle_stats(self, message: Dict, addr: Tuple[str, int]):
+        """Reply with a metrics snapshot (JSON or Prometheus text)"""
+        self._send(self.metrics.stats_response(message), addr)
 
     def _handle_register(self, message: Dict, addr: Tuple[str, int]):
         """Handle peer registration"""
         peer_id = message["peer_id"]
         is_relay = message.get("is_relay_capable", False)
+        # Peers that predate the binary protocol offer nothing and stay on JSON
+        wire_version = wire.negotiate(message.get("wire_versions"))
+
+        if (self.cluster and not self.cluster.is_local(peer_id)
+                and message.get("redirects", 0) < self.MAX_REDIRECTS):
+            self._redirect(peer_id, addr, message)
+            return
         
-        self.registry.register_peer(peer_id, addr, is_relay)
-        print(f"[SERVER] Registered {'relay' if is_relay else 'peer'}: {peer_id}")
+        # Peers that send request ids also acknowledge what we send them
+        self.registry.register_peer(peer_id, addr, is_relay, wire_version, acks="rid" in message)
+        self.remote_relays.pop(peer_id, None)
+        log.info("[SERVER] Registered %s: %s", 'relay' if is_relay else 'peer', peer_id)
 
         response = {
             "type": "register_response",
-            "status": "success"
+            "status": "success",
+            "wire_version": wire_version
         }
-        self.sock.sendto(json.dumps(response).encode(), addr)
+        if self.cluster:
+            # Lets the peer fail over if its owner stops answering
+            response["nodes"] = [list(parse_node(node)) for node in self.cluster.members]
+        self._reply(message, response, addr)
 
     def _handle_connect_request(self, message: Dict, addr: Tuple[str, int]):
         """Handle connection request between peers"""
+        if "to_peers" in message or "group" in message:
+            self._handle_group_request(message, addr)
+            return
         from_peer = message["from_peer"]
         to_peer = message["to_peer"]
+
+        # The pending connection lives with the target, so hand the request to its owner
+        if self.cluster and not self.cluster.is_local(to_peer) and "from_wire" not in message:
+            forward = {
+                "type": "cluster_forward",
+                "message": {**message, "from_wire": self.registry.get_peer_wire(from_peer)},
+                "addr": list(addr)
+            }
+            self._send_node(forward, self.cluster.owner_addr(to_peer))
+            log.debug("[SERVER] Forwarded connection request for %s to %s", to_peer,
+                      self.cluster.owner(to_peer))
+            return
         
-        print(f"[SERVER] Connection request: {from_peer} -> {to_peer}")
+        log.info("[SERVER] Connection request: %s -> %s", from_peer, to_peer)
 
         # Verify peers exist
         to_peer_addr = self.registry.get_peer_addr(to_peer)
         if not to_peer_addr:
-            self._send_error(addr, "Target peer not found")
+            error = {"type": "error", "message": "Target peer not found"}
+            if "from_wire" in message:
+                # Forwarded: the node the initiator talks to acked the request already
+                self._deliver(from_peer, error, addr)
+            else:
+                self._reply(message, error, addr)
             return
 
         # Notify Peer B about incoming connection
@@ -79,76 +370,438 @@ class Server:
             "type": "incoming_connection",
             "from_peer": from_peer
         }
-        self.sock.sendto(json.dumps(notify_msg).encode(), to_peer_addr)
-        print(f"[SERVER] Notified peer {to_peer} about incoming connection")
+        self._send_reliable(notify_msg, to_peer_addr)
+        log.debug("[SERVER] Notified peer %s about incoming connection", to_peer)
 
         # Create session ID to track this connection request
         session_id = str(uuid.uuid4())
         
         # Store pending connection in registry
-        self.registry.create_pending_connection(session_id, from_peer, to_peer)
+        self.registry.create_pending_connection(session_id, from_peer, to_peer,
+                                                message.get("from_wire"), addr)
         
-        print(f"[SERVER] Created pending connection with session {session_id}")
+        log.debug("[SERVER] Created pending connection with session %s", session_id)
+
+    def _handle_group_request(self, message: Dict, addr: Tuple[str, int]):
+        """
+        Connect a peer to several at once: "to_peers" starts a group session
+        with the peers listed, "group" joins the named group (starting it if
+        it has no members yet). Groups are always relayed, with one
+        allocation per member that the relay copies every datagram from to
+        all the others, so a member sends each datagram once however many
+        receive it. Members aren't asked to accept.
+        """
+        from_peer = message["from_peer"]
+        name = message.get("group")
+
+        # A named group lives with the node that owns its name
+        if self.cluster and name is not None and not self.cluster.is_local(name) and "from_wire" not in message:
+            forward = {
+                "type": "cluster_forward",
+                "message": {**message, "from_wire": self.registry.get_peer_wire(from_peer)},
+                "addr": list(addr)
+            }
+            self._send_node(forward, self.cluster.owner_addr(name))
+            log.debug("[SERVER] Forwarded group request for %s to %s", name, self.cluster.owner(name))
+            return
+
+        from_wire = message.get("from_wire")
+        if from_wire is None:
+            from_wire = self.registry.get_peer_wire(from_peer)
+
+        session_id = self.registry.get_group(name) if name is not None else None
+        if session_id is not None:
+            # The group's datagrams reach the joiner as they were sent, so it must read their encoding
+            session = self.registry.get_session(session_id)
+            if session and from_wire < session["wire"]:
+                self._group_error(message, addr, "Group uses a wire encoding this peer doesn't support")
+                return
+            self._join_group(session_id, from_peer)
+            return
+
+        # Targets registered on other nodes are reached through their owners
+        targets = [peer_id for peer_id in message.get("to_peers", ())
+                   if peer_id != from_peer and (self.registry.get_peer_addr(peer_id)
+                                                or (self.cluster and not self.cluster.is_local(peer_id)))]
+        if name is None and not targets:
+            self._group_error(message, addr, "Target peer not found")
+            return
+        members = [from_peer, *targets]
+
+        candidates = [c for c in self.registry.get_relay_candidates() if load_ratio(c) < 1.0]
+        relay_peer = self.relay_policy.choose(candidates, members[0], members[-1])
+        if relay_peer is None:
+            self._deliver(from_peer, {"type": "error", "message": "No relay peers available"}, addr)
+            return
+
+        # Everyone receives everyone's datagrams, so use the encoding all of them understand
+        data_wire = min([from_wire] + [self.registry.get_peer_wire(peer_id) for peer_id in targets])
+
+        session_id = str(uuid.uuid4())
+        self.registry.create_group(session_id, members, relay_peer, data_wire, name)
+        self.connection_paths["group"].inc()
+        log.info("[SERVER] Group %s of %s on relay %s", name or session_id, members, relay_peer)
+        self._place_session(session_id, relay_peer, members[0], members[-1])
+
+    def _group_error(self, message: Dict, addr: Tuple[str, int], text: str):
+        """Refuse a group request, whether it came from the peer or was forwarded by another node"""
+        error = {"type": "error", "message": text}
+        if "from_wire" in message:
+            self._deliver(message["from_peer"], error, addr)
+        else:
+            self._reply(message, error, addr)
+
+    def _join_group(self, session_id: str, peer_id: str):
+        """
+        Ask a group's relay for an allocation for a new member; its relay_ready
+        brings the member in. Until the relay has answered the group's setup
+        the join waits, so it can't overtake the setup.
+        """
+        session = self.registry.join_group(session_id, peer_id)
+        if session is None:
+            return
+        log.info("[SERVER] %s joining group %s", peer_id, session["group"] or session_id)
+        relay_addr = self.registry.get_peer_addr(session["relay"])
+        if relay_addr and session["ports"]:
+            self._send_reliable({"type": "relay_group_join", "session_id": session_id, "peer_id": peer_id,
+                                 "addrs": self._peer_addrs((peer_id,))}, relay_addr)
 
     def _handle_accept_connection(self, message: Dict, addr: Tuple[str, int]):
         """Handle connection acceptance from Peer B"""
         from_peer = message["from_peer"]
         accepting_peer_id = self.registry.get_peer_id_by_addr(addr)
         
-        print(f"[SERVER] Peer {accepting_peer_id} accepted connection from {from_peer}")
+        log.debug("[SERVER] Peer %s accepted connection from %s", accepting_peer_id, from_peer)
         
         # Find pending connection
         pending_conn = self.registry.get_pending_connection(from_peer, accepting_peer_id)
         if not pending_conn:
-            print(f"[SERVER] No pending connection found")
+            log.warning("[SERVER] No pending connection found")
             return
+        session_id = pending_conn["session_id"]
 
-        # Choose the first available relay (simple approach)
-        available_relays = self.registry.get_available_relays()
-        if not available_relays:
-            self._send_error(addr, "No relay peers available")
+        # Relay data goes peer to peer, so use the encoding both ends understand
+        from_wire = pending_conn.get("from_wire")
+        if from_wire is None:
+            from_wire = self.registry.get_peer_wire(from_peer)
+        data_wire = min(from_wire, self.registry.get_peer_wire(accepting_peer_id))
+
+        # Try a direct path first; the relay is only assigned if punching times out
+        from_addr = pending_conn.get("from_addr") or self.registry.get_peer_addr(from_peer)
+        if (self.punch_timeout > 0 and from_addr
+                and self.registry.start_punch(session_id, self.punch_timeout, data_wire)):
+            self._start_punch(session_id, from_peer, from_addr, accepting_peer_id, addr, data_wire)
             return
 
-        relay_peer = available_relays[0]
-        relay_addr = self.registry.get_peer_addr(relay_peer)
-        session_id = pending_conn["session_id"]
+        self._assign_relay(session_id, from_peer, accepting_peer_id, data_wire)
+
+    def _start_punch(self, session_id: str, peer_a: str, addr_a: Tuple[str, int],
+                     peer_b: str, addr_b: Tuple[str, int], data_wire: int):
+        """Give each peer the other's public address so both can punch through their NATs"""
+        punch = {"type": "punch", "session_id": session_id, "wire": data_wire}
+        self._deliver(peer_a, {**punch, "peer_id": peer_b, "addr": list(addr_b)}, reliable=True)
+        # The accepting peer lives on this server, so it reports the outcome
+        self._deliver(peer_b, {**punch, "peer_id": peer_a, "addr": list(addr_a), "report": True},
+                      reliable=True)
+        log.debug("[SERVER] Punching %s <-> %s for session %s", peer_a, peer_b, session_id)
+
+    def _handle_punch_result(self, message: Dict, addr: Tuple[str, int]):
+        """A peer reports that the direct path is up"""
+        conn = self.registry.finish_punch(message["session_id"])
+        if conn:
+            self.connection_paths["direct"].inc()
+            log.info("[SERVER] Direct connection %s <-> %s", conn["from_peer"], conn["to_peer"])
+
+    def _assign_relay(self, session_id: str, from_peer: str, accepting_peer_id: str, data_wire: int):
+        """Pick a relay for a connection and ask it to set the session up"""
+        # Let the relay policy pick among relays that still have headroom
+        candidates = [c for c in self.registry.get_relay_candidates() if load_ratio(c) < 1.0]
+        relay_peer = self.relay_policy.choose(candidates, from_peer, accepting_peer_id)
+        if relay_peer is None:
+            accepting_addr = self.registry.get_peer_addr(accepting_peer_id)
+            if accepting_addr:
+                self._send_error(accepting_addr, "No relay peers available")
+            return
 
         # Create active session in registry
-        self.registry.create_session(session_id, from_peer, accepting_peer_id, relay_peer)
+        self.registry.create_session(session_id, from_peer, accepting_peer_id, relay_peer, data_wire)
+        self.connection_paths["relayed"].inc()
+        self._place_session(session_id, relay_peer, from_peer, accepting_peer_id)
+
+    def _place_session(self, session_id: str, relay_peer: str, from_peer: str, accepting_peer_id: str):
+        """Give a session's peers a path through `relay_peer`, from its warm pool or by asking it to set one up"""
+        relay_addr = self.registry.get_peer_addr(relay_peer)
+
+        # Warm allocations come in pairs; a group's members get theirs set up
+        session = self.registry.get_session(session_id)
+        if session and "members" in session:
+            self.relay_allocations["setup"].inc()
+            relay_setup = {
+                "type": "relay_setup",
+                "session_id": session_id,
+                "members": list(session["members"]),
+                "addrs": self._peer_addrs(session["members"])
+            }
+            rate_limit = self._rate_limit()
+            if rate_limit:
+                relay_setup["rate_limit"] = rate_limit
+            self._send_reliable(relay_setup, relay_addr)
+            return
+
+        # A warm allocation is already bound and relaying, so both peers can
+        # start right away; the relay learns which session it serves in parallel
+        alloc = self.registry.take_relay_allocation(relay_peer)
+        if alloc:
+            self.relay_allocations["pool"].inc()
+            relay_assign = {
+                "type": "relay_assign",
+                "session_id": session_id,
+                "alloc": alloc["id"],
+                "peer_a": from_peer,
+                "peer_b": accepting_peer_id
+            }
+            rate_limit = self._rate_limit()
+            if rate_limit:
+                relay_assign["rate_limit"] = rate_limit
+            self._send_reliable(relay_assign, relay_addr)
+            if "channels" in alloc:
+                ports = {from_peer: alloc["port"], accepting_peer_id: alloc["port"]}
+                channels = dict(zip((from_peer, accepting_peer_id), alloc["channels"]))
+            else:
+                ports = dict(zip((from_peer, accepting_peer_id), alloc["ports"]))
+                channels = None
+            log.info("[SERVER] Relay %s allocation %s assigned to session %s", relay_peer, alloc["id"], session_id)
+            self._send_relay_info(session_id, relay_addr, ports, channels)
+            return
 
-        # Send relay setup request to the chosen relay
+        # Otherwise ask the chosen relay to set the session up
+        self.relay_allocations["setup"].inc()
         relay_setup = {
             "type": "relay_setup",
             "session_id": session_id,
             "peer_a": from_peer,
-            "peer_b": accepting_peer_id
+            "peer_b": accepting_peer_id,
+            "addrs": self._peer_addrs((from_peer, accepting_peer_id))
         }
-        print(f"[SERVER] Sending relay setup to {relay_peer} at {relay_addr}")
-        self.sock.sendto(json.dumps(relay_setup).encode(), relay_addr)
+        rate_limit = self._rate_limit()
+        if rate_limit:
+            relay_setup["rate_limit"] = rate_limit
+        log.debug("[SERVER] Sending relay setup to %s at %s", relay_peer, relay_addr)
+        self._send_reliable(relay_setup, relay_addr)
+
+    def _peer_addrs(self, peers) -> Dict[str, List]:
+        """Addresses we see `peers` at, for the relay to accept their traffic from (unknown ones left out)"""
+        addrs = {}
+        for peer_id in peers:
+            addr = self.registry.get_peer_addr(peer_id)
+            if addr:
+                addrs[peer_id] = list(addr)
+        return addrs
+
+    def _rate_limit(self) -> Optional[Dict]:
+        """Rate limit the relay should enforce on each session (the same for all), or None for unlimited"""
+        if self.session_rate <= 0:
+            return None
+        return {"bps": self.session_rate, "burst": self.session_burst or self.session_rate}
+
+    def _handle_relay_load(self, message: Dict, addr: Tuple[str, int]):
+        """Handle a periodic load report from a relay"""
+        peer_id = message["peer_id"]
+        if peer_id in self.remote_relays or not self.registry.update_relay_load(peer_id, message):
+            log.warning("[SERVER] Load report from unknown relay %s", peer_id)
+            self._redirect(peer_id, addr)
+        elif self.cluster:
+            self._send({"type": "keepalive_ack"}, addr)
+
+    def _handle_relay_pool(self, message: Dict, addr: Tuple[str, int]):
+        """Handle a relay advertising the allocations it holds ready"""
+        peer_id = message["peer_id"]
+        if peer_id in self.remote_relays or not self.registry.set_relay_pool(peer_id, message["allocations"]):
+            log.warning("[SERVER] Relay pool from unknown relay %s", peer_id)
+            self._redirect(peer_id, addr)
+            return
+        log.debug("[SERVER] Relay %s has %s warm allocations", peer_id, len(message["allocations"]))
+
+    def _handle_keepalive(self, message: Dict, addr: Tuple[str, int]):
+        """Handle keepalive: refresh the peer's TTL and follow NAT rebinding"""
+        if not self.registry.touch_peer(message["peer_id"], addr):
+            log.warning("[SERVER] Keepalive from unknown peer %s", message['peer_id'])
+            self._redirect(message["peer_id"], addr)
+        elif self.cluster:
+            self._send({"type": "keepalive_ack"}, addr)
+
+    def _handle_session_closed(self, message: Dict, addr: Tuple[str, int]):
+        """Handle a relay reporting that it dropped an idle session"""
+        session_id = message["session_id"]
+        session = self.registry.get_session(session_id)
+        reporter = self.registry.get_peer_id_by_addr(addr)
+        if session and reporter and reporter != session["relay"]:
+            if reporter == session.get("migrating_from"):
+                # The relay it is moving off let go first: nothing left to tear down there
+                self._end_migration(session_id, self.registry.finish_migration(session_id), "switched",
+                                    teardown=False)
+            return  # Otherwise a relay the session already left
+        session = self.registry.remove_session(session_id)
+        if session:
+            log.info("[SERVER] Relay closed session %s", session['session_id'])
+            self._close_session(session, notify_relay=False)
+
+    def _handle_relay_drain(self, message: Dict, addr: Tuple[str, int]):
+        """
+        A relay is going away: stop placing sessions on it and move the ones it
+        carries to other relays. It keeps forwarding until their peers have
+        switched, and is told "relay_drained" once none are left to wait for.
+        """
+        relay = message["peer_id"]
+        sessions = self.registry.drain_relay(relay)
+        if sessions is None:
+            log.warning("[SERVER] Drain from unknown relay %s", relay)
+            self._send_reliable({"type": "relay_drained", "peer_id": relay, "stranded": 0}, addr)
+            return
+        stranded = sum(not self._migrate_session(session_id) for session_id in sessions)
+        log.info("[SERVER] Draining relay %s: moving %s sessions%s", relay, len(sessions) - stranded,
+                 f", {stranded} with nowhere to go" if stranded else "")
+        self.drains[relay] = (addr, stranded)
+        self._check_drained(relay)
+
+    def _migrate_session(self, session_id: str) -> bool:
+        """Move a session to another relay, make-before-break; False if there is none to take it"""
+        session = self.registry.get_session(session_id)
+        if not session:
+            return True
+        candidates = [c for c in self.registry.get_relay_candidates() if load_ratio(c) < 1.0]
+        members = session_members(session)
+        relay_peer = self.relay_policy.choose(candidates, members[0], members[-1])
+        if relay_peer is None:
+            self.migrations["stranded"].inc()
+            return False
+        previous = self.registry.start_migration(session_id, relay_peer)
+        if previous is None:
+            return True
+        if previous.get("migrating_from"):
+            # Moved again before its peers had left the relay before that one
+            self._end_migration(session_id, previous["migrating_from"], "forced")
+        log.debug("[SERVER] Moving session %s from relay %s to %s", session_id, previous["relay"], relay_peer)
+        self._place_session(session_id, relay_peer, members[0], members[-1])
+        return True
+
+    def _handle_relay_switched(self, message: Dict, addr: Tuple[str, int]):
+        """A peer of a migrating session heard from its new relay"""
+        old_relay = self.registry.peer_switched(message["session_id"], message["peer_id"])
+        if old_relay:
+            log.info("[SERVER] Session %s moved off relay %s", message["session_id"], old_relay)
+            self._end_migration(message["session_id"], old_relay, "switched")
+
+    def _end_migration(self, session_id: str, old_relay: Optional[str], outcome: str, teardown: bool = True):
+        """Release a moved session on the relay it left; tell a draining relay once it is empty"""
+        if not old_relay:
+            return
+        self.migrations[outcome].inc()
+        relay_addr = self.registry.get_peer_addr(old_relay)
+        if teardown and relay_addr:
+            self._send({"type": "relay_teardown", "session_id": session_id}, relay_addr)
+        self._check_drained(old_relay)
+
+    def _check_drained(self, relay: str):
+        if self.registry.migrating_off(relay):
+            return
+        drain = self.drains.pop(relay, None)
+        if drain:
+            addr, stranded = drain
+            log.info("[SERVER] Relay %s drained", relay)
+            self._send_reliable({"type": "relay_drained", "peer_id": relay, "stranded": stranded}, addr)
+
+    def _expire(self):
+        """Drop expired peers/pending connections and tear down their sessions"""
+        if self.cluster:
+            self._cluster_tick()
+        for session in self.registry.expire():
+            log.info("[SERVER] Session %s expired", session['session_id'])
+            self._close_session(session, notify_relay=True)
+        for conn in self.registry.take_punch_timeouts():
+            log.info("[SERVER] No direct path %s <-> %s, relaying", conn["from_peer"], conn["to_peer"])
+            self._assign_relay(conn["session_id"], conn["from_peer"], conn["to_peer"], conn["wire"])
+        for moved in self.registry.take_migration_timeouts():
+            log.info("[SERVER] Session %s: peers didn't both switch in time, releasing relay %s",
+                     moved["session_id"], moved["relay"])
+            self._end_migration(moved["session_id"], moved["relay"], "forced")
+        for departed in self.registry.take_group_departures():
+            log.info("[SERVER] %s left group session %s", departed["peer_id"], departed["session_id"])
+            relay_addr = self.registry.get_peer_addr(departed["relay"])
+            if relay_addr:
+                self._send({"type": "relay_group_leave", "session_id": departed["session_id"],
+                            "peer_id": departed["peer_id"]}, relay_addr)
+
+    def _close_session(self, session: Dict, notify_relay: bool):
+        """Tell the relay to release the session and the surviving peers that it is gone"""
+        closed = {"type": "session_closed", "session_id": session["session_id"]}
+        for peer_id in session_members(session):
+            self._deliver(peer_id, closed)
+
+        relay_addr = self.registry.get_peer_addr(session["relay"])
+        if notify_relay and relay_addr:
+            teardown = {"type": "relay_teardown", "session_id": session["session_id"]}
+            self._send(teardown, relay_addr)
+        # Closed while moving: the relay it was leaving holds it too
+        self._end_migration(session["session_id"], session.get("migrating_from"), "closed")
 
     def _handle_relay_ready(self, message: Dict, addr: Tuple[str, int]):
         """Handle relay ready notification from the relay peer"""
         session_id = message["session_id"]
         session = self.registry.get_session(session_id)
         if not session:
-            print(f"[SERVER] No session found for {session_id}")
+            log.warning("[SERVER] No session found for %s", session_id)
             return
+        if self.registry.get_peer_id_by_addr(addr) not in (None, session["relay"]):
+            log.debug("[SERVER] Ignoring relay_ready for %s from a relay it moved off", session_id)
+            return
+
+        # Single-port relays answer with one port and a channel per peer
+        channels = message.get("channels")
+        if channels is not None:
+            relay_ports = {peer_id: message["mux_port"] for peer_id in channels}
+            log.info("[SERVER] Relay %s ready on port %s with channels: %s",
+                     session['relay'], message["mux_port"], channels)
+        else:
+            relay_ports = message["ports"]
+            log.info("[SERVER] Relay %s ready with ports: %s", session['relay'], relay_ports)
+        self._send_relay_info(session_id, addr, relay_ports, channels)
 
-        relay_ports = message["ports"]
-        print(f"[SERVER] Relay {session['relay']} ready with ports: {relay_ports}")
+        if "members" in session:
+            # Members that joined while the setup was on its way need their own allocation
+            self.registry.update_session_ports(session_id, {**session["ports"], **relay_ports})
+            if not session["ports"]:
+                for peer_id in session_members(self.registry.get_session(session_id) or session):
+                    if peer_id not in relay_ports:
+                        self._send_reliable({"type": "relay_group_join", "session_id": session_id,
+                                             "peer_id": peer_id, "addrs": self._peer_addrs((peer_id,))}, addr)
 
-        # Notify peers of relay details
-        for peer_id in [session["peer_a"], session["peer_b"]]:
-            peer_addr = self.registry.get_peer_addr(peer_id)
-            if peer_addr:
-                relay_info = {
-                    "type": "relay_info",
-                    "session_id": session_id,
-                    "relay_addr": addr,  # relay's (IP, port) from the server's perspective
-                    "port": relay_ports[peer_id]  # the specific port for this peer
-                }
-                print(f"[SERVER] Sending relay info to {peer_id}: {relay_info}")
-                self.sock.sendto(json.dumps(relay_info).encode(), peer_addr)
+    def _send_relay_info(self, session_id: str, relay_addr: Tuple[str, int], relay_ports: Dict[str, int],
+                         channels: Optional[Dict[str, int]] = None):
+        """Tell the peers of a session where on the relay to send their traffic"""
+        session = self.registry.get_session(session_id)
+        if not session:
+            return
+        for peer_id in session_members(session):
+            if peer_id not in relay_ports:
+                continue    # A member joining later gets its own relay_ready
+            relay_info = {
+                "type": "relay_info",
+                "session_id": session_id,
+                "relay_addr": relay_addr,  # relay's (IP, port) from the server's perspective
+                "port": relay_ports[peer_id],  # the specific port for this peer
+                "wire": session["wire"]
+            }
+            if channels is not None:
+                relay_info["channel"] = channels[peer_id]
+            if "members" in session:
+                relay_info["group"] = session["group"]
+                relay_info["members"] = list(session["members"])
+            if session.get("migrating_from"):
+                # Keep the current relay until this one is seen to work
+                relay_info["migrate"] = True
+            log.debug("[SERVER] Sending relay info to %s: %s", peer_id, relay_info)
+            self._deliver(peer_id, relay_info, reliable=True)
 
     def _send_error(self, addr: Tuple[str, int], message: str):
         """Send error message to peer"""
@@ -156,8 +809,407 @@ class Server:
             "type": "error",
             "message": message
         }
-        self.sock.sendto(json.dumps(error).encode(), addr)
+        self._send(error, addr)
+
+    def _deliver(self, peer_id: str, message: Dict, fallback: Optional[Tuple[str, int]] = None,
+                 reliable: bool = False):
+        """
+        Send a message to a peer registered here, or have its owner pass it on.
+        `fallback` is used when the peer is unknown everywhere we can tell.
+        `reliable` messages are resent until the peer acks them (by the node
+        that sends them to the peer, which is where the ack comes back).
+        """
+        peer_addr = self.registry.get_peer_addr(peer_id)
+        if peer_addr:
+            if reliable:
+                self._send_reliable(message, peer_addr)
+            else:
+                self._send(message, peer_addr)
+        elif self.cluster and not self.cluster.is_local(peer_id):
+            deliver = {"type": "cluster_deliver", "peer_id": peer_id, "message": message}
+            if reliable:
+                deliver["reliable"] = True
+            self._send_node(deliver, self.cluster.owner_addr(peer_id))
+        elif fallback:
+            self._send(message, fallback)
+
+    def _reply(self, request: Dict, response: Dict, addr: Tuple[str, int]):
+        """Answer a request; the answer acks it and is sent again if the request is retransmitted"""
+        rid = request.get("rid")
+        if rid is not None:
+            response = {**response, "ack": rid}
+            replies = self.seen_requests.get(rid)
+            if replies is not None:
+                replies.append(response)
+        self._send(response, addr)
+
+    def _send_reliable(self, message: Dict, addr: Tuple[str, int]):
+        """Send a message and resend it until acked, if the peer at `addr` acks signaling"""
+        peer_id = self.registry.get_peer_id_by_addr(addr)
+        if peer_id and self.registry.peer_acks(peer_id):
+            self.retransmitter.send(message, addr)
+        else:
+            self._send(message, addr)
+
+    # ============== CLUSTER ==============
+    def _redirect(self, peer_id: str, addr: Tuple[str, int], request: Optional[Dict] = None):
+        """Point a peer at the node that owns it (possibly this one, to re-register)"""
+        if self.cluster:
+            self._reply(request or {}, {"type": "redirect", "server": list(self.cluster.owner_addr(peer_id))},
+                        addr)
+
+    def _cluster_tick(self):
+        """Heartbeat the other nodes, drop silent ones and rebalance if the ring changed"""
+        if self.cluster.expire():
+            self._rebalance()
+        if not self.cluster.heartbeat_due():
+            return
+
+        relays = []
+        for relay in self.registry.relays:
+            if relay in self.remote_relays:
+                continue
+            load = self.registry.relay_load.get(relay)
+            relays.append({
+                "peer_id": relay,
+                "addr": list(self.registry.get_peer_addr(relay) or ()),
+                "wire": self.registry.get_peer_wire(relay),
+                "acks": self.registry.peer_acks(relay),
+                "draining": relay in self.registry.draining,
+                "load": {k: v for k, v in load.items() if k not in ("assigned", "ts")} if load else None
+            })
+        heartbeat = self.cluster.sign({"type": "cluster_heartbeat", "node": self.cluster.node, "relays": relays})
+        for node_addr in self.cluster.heartbeat_targets():
+            self._send(heartbeat, node_addr)
+
+        # Forget remote relays that expired from the registry
+        for relay in [r for r in self.remote_relays if r not in self.registry.relays]:
+            self.remote_relays.pop(relay, None)
+
+    def _rebalance(self):
+        """Send every peer this node no longer owns to its new owner"""
+        log.info("[SERVER] Cluster is now %s", self.cluster.members)
+        moved = 0
+        for peer_id in list(self.registry.peers):
+            if peer_id in self.remote_relays or self.cluster.is_local(peer_id):
+                continue
+            addr = self.registry.get_peer_addr(peer_id)
+            if addr and self.registry.release_peer(peer_id):
+                self._redirect(peer_id, addr)
+                moved += 1
+        if moved:
+            log.info("[SERVER] Redirected %s peers to their new owners", moved)
+
+    def _leave_cluster(self):
+        """Tell the other nodes we are going and hand our peers over"""
+        if not self.cluster:
+            return
+        leave = self.cluster.sign({"type": "cluster_leave", "node": self.cluster.node})
+        for node_addr in self.cluster.heartbeat_targets():
+            self._send(leave, node_addr)
+        if self.cluster.leave():
+            self._rebalance()
+
+    def _handle_cluster_heartbeat(self, message: Dict, addr: Tuple[str, int]):
+        """Track a live node and the relays it owns"""
+        node = message["node"]
+        for relay in message.get("relays", ()):
+            relay_id = relay["peer_id"]
+            if relay_id in self.registry.peers and relay_id not in self.remote_relays:
+                continue  # Registered here; our record wins
+            self.registry.register_peer(relay_id, tuple(relay["addr"]), True, relay["wire"],
+                                        relay.get("acks", False))
+            if relay["load"]:
+                self.registry.update_relay_load(relay_id, relay["load"])
+            if relay.get("draining"):
+                # Its sessions here move when it asks this node; no new ones meanwhile
+                self.registry.drain_relay(relay_id)
+            self.remote_relays[relay_id] = node
+        if self.cluster.heard_from(node):
+            self._rebalance()
+
+    def _handle_cluster_leave(self, message: Dict, addr: Tuple[str, int]):
+        if self.cluster.forget(message["node"]):
+            self._rebalance()
+
+    def _handle_cluster_forward(self, message: Dict, addr: Tuple[str, int]):
+        """A request another node passed on because we own its target"""
+        inner = message["message"]
+        if inner.get("type") == "connect_request":
+            self._handle_connect_request(inner, tuple(message["addr"]))
+
+    def _handle_cluster_deliver(self, message: Dict, addr: Tuple[str, int]):
+        """Another node has a message for one of our peers"""
+        peer_addr = self.registry.get_peer_addr(message["peer_id"])
+        if peer_addr and message.get("reliable"):
+            self._send_reliable(message["message"], peer_addr)
+        elif peer_addr:
+            self._send(message["message"], peer_addr)
+
+    def _send(self, message: Dict, addr: Tuple[str, int]):
+        """Send a message to a peer in its negotiated encoding"""
+        self.sock.sendto(self._encode_for(message, addr), addr)
+
+    def _send_node(self, message: Dict, addr: Tuple[str, int]):
+        """Send a message to another cluster node, signed if the cluster has a secret"""
+        self._send(self.cluster.sign(message), addr)
+
+    def _encode_for(self, message: Dict, addr: Tuple[str, int]) -> bytes:
+        peer_id = self.registry.get_peer_id_by_addr(addr)
+        return wire.encode(message, self.registry.get_peer_wire(peer_id) if peer_id else wire.WIRE_JSON)
+
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams from the event loop into an AsyncServer"""
+
+    def __init__(self, server: "AsyncServer"):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        self.server._dispatch(data, addr)
+
+    def error_received(self, exc: Exception):
+        # ICMP errors (e.g. port unreachable for a peer that went away) land here
+        log.warning("[SERVER] Socket error: %s", exc)
+
+
+class AsyncServer(Server):
+    """
+    asyncio version of Server. The receive path never blocks on a handler:
+    sends are queued on the datagram transport, and handlers can optionally
+    be run on a worker pool. With admission control the worker pool is fed
+    from the admission queue a few messages at a time, so the backlog stays
+    where it is bounded and ordered.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 50000, workers: int = 0,
+                 relay_policy: Optional[RelayPolicy] = None,
+                 max_datagram: int = DEFAULT_MAX_DATAGRAM,
+                 cluster: Optional[Cluster] = None,
+                 punch_timeout: Optional[float] = None,
+                 session_rate: float = 0, session_burst: float = 0,
+                 admission: Optional[Admission] = None,
+                 capture: Optional[Capture] = None):
+        super().__init__(host, port, relay_policy, max_datagram, cluster, punch_timeout,
+                         session_rate, session_burst, admission, capture)
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        # Handlers submitted to the worker pool and not finished yet
+        self._in_flight = 0
+        self._drain_scheduled = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._loop_thread: Optional[int] = None
+        self._stopped: Optional[asyncio.Event] = None
+        # Armed for the earliest resend while anything awaits an ack
+        self._retransmit_timer: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        """Run the server until stop() is called"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """Serve on the running event loop until stop() is called"""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stopped = asyncio.Event()
+
+        self.sock.bind((self.host, self.port))
+        self.sock.setblocking(False)
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: _ServerProtocol(self), sock=self.sock)
+        self.running = True
+        log.info("[SERVER] Started on %s:%s%s", self.host, self.port,
+                 f" with {self.executor._max_workers} workers" if self.executor else "")
+
+        expiry_timer = self.loop.call_later(self.EXPIRY_INTERVAL, self._expiry_tick)
+        try:
+            await self._stopped.wait()
+        finally:
+            expiry_timer.cancel()
+            if self._retransmit_timer:
+                self._retransmit_timer.cancel()
+            self.running = False
+            if self.executor:
+                # Let in-flight handlers finish before the transport goes away
+                await self.loop.run_in_executor(None, self.executor.shutdown, True)
+            self._leave_cluster()
+            transport.close()
+            if self.capture is not None:
+                self.capture.close()
+            log.info("[SERVER] Stopped")
+
+    def _expiry_tick(self):
+        if not self.running:
+            return
+        try:
+            self._expire()
+        except Exception as e:
+            log.error("[SERVER] Error expiring sessions: %s", e)
+        self.loop.call_later(self.EXPIRY_INTERVAL, self._expiry_tick)
+
+    def _arm_retransmit(self):
+        due = self.retransmitter.next_due()
+        if due is None or not self.running:
+            return
+        when = self.loop.time() + due
+        if self._retransmit_timer:
+            if self._retransmit_timer.when() <= when:
+                return
+            self._retransmit_timer.cancel()
+        self._retransmit_timer = self.loop.call_at(when, self._retransmit_tick)
+
+    def _retransmit_tick(self):
+        self._retransmit_timer = None
+        try:
+            self.retransmitter.poll()
+        except Exception as e:
+            log.error("[SERVER] Error resending messages: %s", e)
+        self._arm_retransmit()
+
+    def stop(self):
+        """Request shutdown; safe to call from any thread"""
+        if self.loop and self._stopped:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def _dispatch(self, data: bytes, addr: Tuple[str, int]):
+        """Decode a datagram and run its handler (inline or on the worker pool) or queue it"""
+        # The transport reads into its own buffer, so only the size limit applies here
+        if len(data) > self.receiver.max_datagram:
+            self.receiver.truncated += 1
+            log.warning("[SERVER] Dropped oversized datagram from %s", addr, extra={"rate_key": addr})
+            return
+        self._ingest(data, addr)
+        if self.admission is not None:
+            # The transport reads one datagram per wakeup; take the rest of the
+            # burst too so the most urgent is handled first
+            self._read_more()
+            self._schedule_drain()
+
+    def _schedule_drain(self):
+        # Runs on the next loop iteration, after the socket has been read again
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.loop.call_soon(self._drain)
+
+    def _drain(self):
+        self._drain_scheduled = False
+        limit = self.HANDLE_BATCH
+        if self.executor:
+            # Keep the pool busy without moving the backlog into its unbounded queue
+            limit = min(limit, 2 * self.executor._max_workers - self._in_flight)
+        if self._handle_queued(limit) and limit == self.HANDLE_BATCH:
+            self._schedule_drain()
+
+    def _run_handler(self, message: Dict, addr: Tuple[str, int]):
+        if not self.executor:
+            self._handle_safely(message, addr)
+            return
+        self._in_flight += 1
+        self.executor.submit(self._handle_in_worker, message, addr)
+
+    def _handle_in_worker(self, message: Dict, addr: Tuple[str, int]):
+        try:
+            self._handle_safely(message, addr)
+        finally:
+            self.loop.call_soon_threadsafe(self._handler_done)
+
+    def _handler_done(self):
+        self._in_flight -= 1
+        if self.admission is not None and len(self.admission):
+            self._schedule_drain()
+
+    def _send_reliable(self, message: Dict, addr: Tuple[str, int]):
+        super()._send_reliable(message, addr)
+        if threading.get_ident() == self._loop_thread:
+            self._arm_retransmit()
+        else:
+            self.loop.call_soon_threadsafe(self._arm_retransmit)
+
+    def _send(self, message: Dict, addr: Tuple[str, int]):
+        """Queue a message on the transport; never blocks the caller"""
+        payload = self._encode_for(message, addr)
+        if threading.get_ident() == self._loop_thread:
+            self.transport.sendto(payload, addr)
+        else:
+            self.loop.call_soon_threadsafe(self.transport.sendto, payload, addr)
+
 
 if __name__ == "__main__":
-    server = Server()
-    server.start()
+    import argparse
+    import signal
+    import sys
+    parser = argparse.ArgumentParser(description="Signaling server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run message handlers on a pool of N threads")
+    parser.add_argument("--blocking", action="store_true",
+                        help="use the single-threaded blocking server loop")
+    parser.add_argument("--relay-policy", choices=sorted(POLICIES), default="least-loaded",
+                        help="how to pick a relay for a new session")
+    parser.add_argument("--max-datagram", type=int, default=DEFAULT_MAX_DATAGRAM,
+                        help="largest datagram accepted, up to 65535 bytes")
+    parser.add_argument("--punch-timeout", type=float, default=Server.PUNCH_TIMEOUT,
+                        help="seconds to try a direct peer-to-peer path before relaying, 0 = always relay")
+    parser.add_argument("--session-rate", type=float, default=0,
+                        help="bytes/s a relay forwards per session, 0 = unlimited")
+    parser.add_argument("--session-burst", type=float, default=0,
+                        help="bytes a session may burst above --session-rate (default: one second's worth)")
+    parser.add_argument("--ingress-limit", type=int, default=QUEUE_LIMIT,
+                        help="messages queued for handling before load is shed, 0 = no admission control")
+    parser.add_argument("--source-rate", type=float, default=SOURCE_RATE,
+                        help="registers/connects per second accepted from one address, 0 = unlimited")
+    parser.add_argument("--source-burst", type=float, default=SOURCE_BURST,
+                        help="registers/connects one address may send in a burst")
+    parser.add_argument("--capture", default=None, metavar="PATH",
+                        help="append every datagram received to a trace file (see bench/replay.py)")
+    parser.add_argument("--cluster", default="",
+                        help="comma-separated HOST:PORT of other nodes to join as a cluster")
+    parser.add_argument("--cluster-secret-file", default=None, metavar="PATH",
+                        help="file holding a secret shared by all nodes; cluster messages are signed with it")
+    parser.add_argument("--advertise", default=None,
+                        help="HOST:PORT other nodes and peers reach this node on "
+                             "(default: --host:--port; set it when binding 0.0.0.0)")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    policy = POLICIES[args.relay_policy]()
+    cluster = None
+    if args.cluster or args.advertise:
+        seeds = [node for node in args.cluster.split(",") if node]
+        secret = None
+        if args.cluster_secret_file:
+            with open(args.cluster_secret_file, "rb") as f:
+                secret = f.read().strip()
+        cluster = Cluster(args.advertise or f"{args.host}:{args.port}", seeds, secret=secret)
+    admission = None
+    if args.ingress_limit > 0:
+        admission = Admission(args.ingress_limit, args.source_rate, args.source_burst)
+    capture = None
+    if args.capture:
+        capture = Capture(args.capture)
+        # Flush the trace when stopped with SIGTERM too, not just Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.blocking:
+        server = Server(args.host, args.port, relay_policy=policy, max_datagram=args.max_datagram,
+                        cluster=cluster, punch_timeout=args.punch_timeout,
+                        session_rate=args.session_rate, session_burst=args.session_burst,
+                        admission=admission, capture=capture)
+    else:
+        server = AsyncServer(args.host, args.port, workers=args.workers, relay_policy=policy,
+                             max_datagram=args.max_datagram, cluster=cluster,
+                             punch_timeout=args.punch_timeout,
+                             session_rate=args.session_rate, session_burst=args.session_burst,
+                             admission=admission, capture=capture)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if capture is not None:
+            capture.close()